@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+fakes.py
+
+Local stand-ins for every external service the pipeline talks to, served
+from one threaded HTTP server:
+
+  • OpenAI          POST /v1/chat/completions
+  • OpenAI batches  POST /v1/files, GET /v1/files/<id>/content,
+                    POST /v1/batches, GET /v1/batches/<id>
+  • Nominatim       GET  /search
+  • YouTube Data    GET  /youtube/v3/search
+  • YT transcripts  GET  /watch, POST /youtubei/v1/player, GET /api/timedtext
+  • OpenWeatherMap  GET  /data/2.5/weather
+
+Each service gets a configurable latency (mean ± jitter, seconds) and an
+error rate; failed calls answer 500 (or 429 for OpenAI) after the delay.
+For "batch" the latency is how long a batch takes to complete and the
+error rate applies per request inside it.
+
+    python bench/fakes.py --port 9100 --latency openai=0.8 --error-rate openai=0.05
+
+or, in-process:
+
+    fakes = FakeServices(FakeConfig(latency={"openai": 0.8}))
+    fakes.start()
+    env = fakes.env()        # point the pipeline at the fakes
+"""
+
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from urllib.parse import urlparse, parse_qs
+
+SERVICES = ("openai", "batch", "nominatim", "youtube", "transcript", "weather")
+
+CARE_JSON = {
+    "Temp": "60-75°F / 15-24°C",
+    "Humidity": "40-60%",
+    "Soil PH": "6.0-7.0",
+    "Leaf color": {
+        "Spring": ["#7FB800", "#6FA300", "#5E8F00", "#4E7A00", "#3D6600"],
+        "Summer": ["#2E8B22", "#287A1E", "#22691A", "#1C5816", "#164712"],
+        "Autumn": ["#D9A400", "#CC7A00", "#B35900", "#993D00", "#802600"],
+        "Winter": ["#6B5B3E", "#5E5036", "#51452E", "#443A26", "#372F1E"],
+    },
+    "Trunk color": {
+        "Spring": ["#8B7D6B", "#7D705F", "#6F6354", "#615648", "#53493C"],
+        "Summer": ["#8B7D6B", "#7D705F", "#6F6354", "#615648", "#53493C"],
+        "Autumn": ["#7A6A55", "#6D5E4B", "#605242", "#534638", "#463A2F"],
+        "Winter": ["#6E6253", "#625749", "#564C40", "#4A4136", "#3E362D"],
+    },
+    "Recommendations": "Water deeply once a week, mulch the root zone and prune dead wood in late winter.",
+    "Watering Schedule": 7,
+}
+
+
+@dataclass
+class FakeConfig:
+    latency: dict = field(default_factory=dict)      # service -> mean seconds
+    jitter: float = 0.25                             # ± fraction of the mean
+    error_rate: dict = field(default_factory=dict)   # service -> probability 0..1
+    seed: int = None
+
+
+class FakeServices:
+    def __init__(self, config: FakeConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeConfig()
+        self._rng = random.Random(self.config.seed)
+        self._rng_lock = threading.Lock()
+        self.calls = {s: 0 for s in SERVICES}
+        self.errors = {s: 0 for s in SERVICES}
+        self._counts_lock = threading.Lock()
+        self.files = {}      # file_id -> {"filename", "purpose", "bytes"}
+        self.batches = {}    # batch_id -> batch object (+ private fields)
+        self._batch_lock = threading.RLock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    # ——— lifecycle ———
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def env(self) -> dict:
+        """Environment variables that point the pipeline and recom.py at these fakes."""
+        host, port = self.server.server_address[:2]
+        return {
+            "OPENAIKEY": "bench-key",
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "NOMINATIM_DOMAIN": f"{host}:{port}",
+            "NOMINATIM_SCHEME": "http",
+            "YOUTUBEAPI": "bench-key",
+            "YOUTUBE_API_ENDPOINT": self.base_url,
+            "YOUTUBE_TRANSCRIPT_BASE_URL": self.base_url,
+            "OPENWEATHERMAP_API_KEY": "bench-key",
+            "OPENWEATHERMAP_URL": f"{self.base_url}/data/2.5/weather",
+        }
+
+    def stats(self) -> dict:
+        with self._counts_lock:
+            return {"calls": dict(self.calls), "errors": dict(self.errors)}
+
+    # ——— behaviour ———
+
+    def _roll(self, service: str, can_fail: bool = True):
+        """Counts one call; returns (delay seconds, should fail)."""
+        mean = float(self.config.latency.get(service, 0.0))
+        with self._rng_lock:
+            spread = mean * self.config.jitter
+            delay = max(0.0, self._rng.uniform(mean - spread, mean + spread))
+            fail = can_fail and self._rng.random() < float(self.config.error_rate.get(service, 0.0))
+        with self._counts_lock:
+            self.calls[service] += 1
+            if fail:
+                self.errors[service] += 1
+        return delay, fail
+
+    def _delay_and_fail(self, service: str) -> bool:
+        """Sleeps for the service's latency; returns True if this call should fail."""
+        delay, fail = self._roll(service)
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def _make_handler(self):
+        fakes = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                raw = body if isinstance(body, bytes) else (
+                    body.encode() if isinstance(body, str) else json.dumps(body).encode())
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                ctype = self.headers.get("Content-Type", "")
+                if ctype.startswith("multipart/form-data"):
+                    msg = BytesParser(policy=email_policy).parsebytes(
+                        b"Content-Type: " + ctype.encode() + b"\r\n\r\n" + raw)
+                    return {part.get_param("name", header="content-disposition"):
+                            (part.get_filename(), part.get_payload(decode=True))
+                            for part in msg.iter_parts()}
+                try:
+                    return json.loads(raw or b"{}")
+                except json.JSONDecodeError:
+                    return {}
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                qs = parse_qs(url.query)
+                route = fakes.route(fakes.routes_get, url.path)
+                if route is None:
+                    return self._send(404, {"error": "no such fake route"})
+                route(self, qs)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                route = fakes.route(fakes.routes_post, url.path)
+                if route is None:
+                    return self._send(404, {"error": "no such fake route"})
+                route(self, parse_qs(url.query), self._body())
+
+        return Handler
+
+    @staticmethod
+    def route(routes: dict, path: str):
+        """Exact match, else the longest route ending in "/" that prefixes path."""
+        if path in routes:
+            return routes[path]
+        prefixes = [p for p in routes if p.endswith("/") and path.startswith(p)]
+        return routes[max(prefixes, key=len)] if prefixes else None
+
+    @property
+    def routes_get(self):
+        return {
+            "/v1/files/": self._file_content,
+            "/v1/batches/": self._batch_retrieve,
+            "/search": self._nominatim,
+            "/youtube/v3/search": self._youtube_search,
+            "/watch": self._watch_page,
+            "/api/timedtext": self._timedtext,
+            "/data/2.5/weather": self._weather,
+        }
+
+    @property
+    def routes_post(self):
+        return {
+            "/v1/chat/completions": self._chat_completion,
+            "/v1/files": self._file_upload,
+            "/v1/batches": self._batch_create,
+            "/youtubei/v1/player": self._innertube_player,
+        }
+
+    # ——— OpenAI ———
+
+    @staticmethod
+    def diagnosis_json() -> dict:
+        return {
+            "species": "bench",
+            "healthy": "YES",
+            "percentage": 92,
+            "observed_leaf_color": "#287A1E",
+            "expected_leaf_colors": CARE_JSON["Leaf color"]["Summer"],
+            "reasons_unhealthy": [],
+            "treatment_recommendations": ["Keep mulch topped up", "Water weekly", "Inspect for pests"],
+            "Watering Schedule": 7,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+
+    def completion_content(self, request_body: dict) -> str:
+        system = next((m.get("content") for m in request_body.get("messages", [])
+                       if m.get("role") == "system"), "") or ""
+        if isinstance(system, list):
+            system = " ".join(part.get("text", "") for part in system)
+        # recom.py asks for care recommendations; everything else is a diagnosis
+        if "care recommendations for a given tree species" in system:
+            return json.dumps(CARE_JSON)
+        return json.dumps(self.diagnosis_json())
+
+    def completion_response(self, request_body: dict) -> dict:
+        content = self.completion_content(request_body)
+        prompt_chars = len(json.dumps(request_body.get("messages", [])))
+        return {
+            "id": f"chatcmpl-bench-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request_body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (prompt_chars + len(content)) // 4},
+        }
+
+    def _chat_completion(self, h, qs, body):
+        if self._delay_and_fail("openai"):
+            return h._send(429, {"error": {"message": "Rate limit (injected)", "type": "rate_limit"}})
+        h._send(200, self.completion_response(body))
+
+    # ——— OpenAI files & batches ———
+
+    def _new_file(self, filename: str, purpose: str, raw: bytes) -> dict:
+        file_id = f"file-bench{uuid.uuid4().hex[:12]}"
+        with self._batch_lock:
+            self.files[file_id] = {"filename": filename, "purpose": purpose, "bytes": raw}
+        return {"id": file_id, "object": "file", "bytes": len(raw), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def _file_upload(self, h, qs, body):
+        filename, raw = body.get("file", (None, None))
+        if raw is None:
+            return h._send(400, {"error": {"message": "file is required"}})
+        purpose = (body.get("purpose") or (None, b"batch"))[1].decode()
+        h._send(200, self._new_file(filename or "upload.jsonl", purpose, raw))
+
+    def _file_content(self, h, qs):
+        file_id = urlparse(h.path).path.split("/")[3]
+        f = self.files.get(file_id)
+        if f is None:
+            return h._send(404, {"error": {"message": f"No such file {file_id}"}})
+        h._send(200, f["bytes"], "application/octet-stream")
+
+    def _batch_create(self, h, qs, body):
+        input_file = self.files.get(body.get("input_file_id"))
+        if input_file is None:
+            return h._send(400, {"error": {"message": "unknown input_file_id"}})
+        delay, _ = self._roll("batch", can_fail=False)
+        lines = [json.loads(line) for line in input_file["bytes"].decode().splitlines() if line.strip()]
+        now = int(time.time())
+        batch = {
+            "id": f"batch_bench{uuid.uuid4().hex[:12]}", "object": "batch",
+            "endpoint": body.get("endpoint"), "errors": None,
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating", "output_file_id": None, "error_file_id": None,
+            "created_at": now, "in_progress_at": None, "completed_at": None,
+            "expires_at": now + 86400,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+            "metadata": body.get("metadata"),
+            "_ready_at": time.time() + delay, "_lines": lines,
+        }
+        with self._batch_lock:
+            self.batches[batch["id"]] = batch
+        h._send(200, self._public_batch(batch))
+
+    @staticmethod
+    def _public_batch(batch: dict) -> dict:
+        return {k: v for k, v in batch.items() if not k.startswith("_")}
+
+    def _run_batch(self, batch: dict):
+        """Answers every request in the batch at once; failures go to the error file."""
+        ok, failed = [], []
+        for line in batch["_lines"]:
+            with self._rng_lock:
+                fail = self._rng.random() < float(self.config.error_rate.get("batch", 0.0))
+            request_id = f"req_bench{uuid.uuid4().hex[:12]}"
+            if fail:
+                failed.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": line["custom_id"],
+                               "response": {"status_code": 429, "request_id": request_id,
+                                            "body": {"error": {"message": "Rate limit (injected)"}}},
+                               "error": None})
+            else:
+                ok.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": line["custom_id"],
+                           "response": {"status_code": 200, "request_id": request_id,
+                                        "body": self.completion_response(line.get("body", {}))},
+                           "error": None})
+
+        with self._counts_lock:
+            self.errors["batch"] += len(failed)
+
+        def as_file(rows, name):
+            raw = "".join(json.dumps(r) + "\n" for r in rows).encode()
+            return self._new_file(name, "batch_output", raw)["id"] if rows else None
+
+        now = int(time.time())
+        batch.update(status="completed", in_progress_at=batch["in_progress_at"] or now, completed_at=now,
+                     output_file_id=as_file(ok, "output.jsonl"), error_file_id=as_file(failed, "errors.jsonl"),
+                     request_counts={"total": len(batch["_lines"]), "completed": len(ok), "failed": len(failed)})
+
+    def _batch_retrieve(self, h, qs):
+        batch_id = urlparse(h.path).path.rstrip("/").split("/")[-1]
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return h._send(404, {"error": {"message": f"No such batch {batch_id}"}})
+        with self._batch_lock:
+            if batch["status"] == "validating":
+                batch.update(status="in_progress", in_progress_at=int(time.time()))
+            elif batch["status"] == "in_progress" and time.time() >= batch["_ready_at"]:
+                self._run_batch(batch)
+            public = self._public_batch(batch)
+        h._send(200, public)
+
+    # ——— Nominatim ———
+
+    def _nominatim(self, h, qs):
+        if self._delay_and_fail("nominatim"):
+            return h._send(500, {"error": "injected"})
+        h._send(200, [{"place_id": 1, "lat": "41.0190", "lon": "-73.6260",
+                       "display_name": f"{qs.get('q', [''])[0]}, Bench County, USA",
+                       "boundingbox": ["41.0", "41.1", "-73.7", "-73.6"]}])
+
+    # ——— YouTube ———
+
+    def _youtube_search(self, h, qs):
+        if self._delay_and_fail("youtube"):
+            return h._send(500, {"error": {"code": 500, "message": "injected"}})
+        h._send(200, {"kind": "youtube#searchListResponse",
+                      "items": [{"id": {"kind": "youtube#video", "videoId": f"benchvid{i}"}}
+                                for i in range(4)]})
+
+    def _watch_page(self, h, qs):
+        h._send(200, '<html><script>ytcfg.set({"INNERTUBE_API_KEY": "benchkey"});</script></html>',
+                "text/html")
+
+    def _innertube_player(self, h, qs, body):
+        if self._delay_and_fail("transcript"):
+            return h._send(500, {"error": "injected"})
+        vid = body.get("videoId", "benchvid0")
+        h._send(200, {
+            "playabilityStatus": {"status": "OK"},
+            "captions": {"playerCaptionsTracklistRenderer": {
+                "captionTracks": [{"baseUrl": f"{self.base_url}/api/timedtext?v={vid}",
+                                   "name": {"runs": [{"text": "English"}]},
+                                   "languageCode": "en"}],
+                "translationLanguages": [],
+            }},
+        })
+
+    def _timedtext(self, h, qs):
+        lines = ["Water your tree deeply once a week.", "Mulch around the base.",
+                 "Prune dead branches in late winter."]
+        xml = "<transcript>" + "".join(
+            f'<text start="{i * 4}" dur="4">{line}</text>' for i, line in enumerate(lines)) + "</transcript>"
+        h._send(200, xml, "text/xml")
+
+    # ——— OpenWeatherMap ———
+
+    def _weather(self, h, qs):
+        if self._delay_and_fail("weather"):
+            return h._send(500, {"cod": 500, "message": "injected"})
+        h._send(200, {"main": {"temp": 68.0, "humidity": 55},
+                      "weather": [{"description": "scattered clouds"}], "name": "Benchville"})
+
+
+def parse_service_map(items) -> dict:
+    out = {}
+    for item in items or []:
+        name, _, value = item.partition("=")
+        if name not in SERVICES:
+            raise argparse.ArgumentTypeError(f"Unknown service {name!r}; choose from {SERVICES}")
+        out[name] = float(value)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the stand-in external services.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", nargs="*", help="service=seconds, e.g. openai=0.8")
+    parser.add_argument("--error-rate", nargs="*", help="service=probability, e.g. openai=0.05")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = FakeConfig(latency=parse_service_map(args.latency),
+                        error_rate=parse_service_map(args.error_rate), seed=args.seed)
+    fakes = FakeServices(config, args.host, args.port)
+    print(f"Fake services on {fakes.base_url}. Export these to use them:")
+    for k, v in fakes.env().items():
+        print(f"  export {k}={v}")
+    try:
+        fakes.server.serve_forever()
+    except KeyboardInterrupt:
+        fakes.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+run_bench.py
+
+Offline end-to-end benchmark. Starts the stand-in services from fakes.py,
+runs server_http.py against them in a scratch directory, posts synthetic
+frames to /plants/health at a target rate and waits for every pipeline run
+to finish. Latencies come from the client (ingest) and from the pipeline's
+own JSON span logs (end-to-end and per stage).
+
+    python bench/run_bench.py --scenario steady
+    python bench/run_bench.py --scenario burst --rate 8 --duration 20
+    python bench/run_bench.py --compare bench/results/a.json bench/results/b.json
+
+Reports are written to bench/results/<scenario>-<timestamp>.json.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import signal
+import socket
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from fakes import FakeConfig, FakeServices  # noqa: E402
+from synth_images import frame_jpeg_bytes, parse_resolution  # noqa: E402
+
+RESULTS_DIR = BENCH_DIR / "results"
+
+# Rough real-world latencies (seconds) for the external APIs
+DEFAULT_LATENCY = {"openai": 1.2, "nominatim": 0.15, "youtube": 0.3, "transcript": 0.2, "weather": 0.1}
+
+SCENARIOS = {
+    "smoke":  {"rate": 0.5, "duration": 6,  "resolution": "vga",   "cameras": 1},
+    "steady": {"rate": 1.0, "duration": 60, "resolution": "720p",  "cameras": 3},
+    "burst":  {"rate": 5.0, "duration": 10, "resolution": "720p",  "cameras": 3},
+    "hires":  {"rate": 0.5, "duration": 60, "resolution": "pi-v2", "cameras": 3},
+    "flaky":  {"rate": 1.0, "duration": 60, "resolution": "720p",  "cameras": 3,
+               "latency": {"openai": 2.5}, "error_rate": {"openai": 0.1, "weather": 0.2}},
+    # best-of-N selection on: bursts collapse to one diagnosis per camera window
+    "window": {"rate": 3.0, "duration": 20, "resolution": "720p",  "cameras": 3, "frame_window": 5},
+}
+
+SPECIES = ("oak", "birch", "spruce", "maple", "pine", "elm")
+
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))], 4)
+
+    return {"count": len(ordered), "mean": round(sum(ordered) / len(ordered), 4),
+            "p50": pick(50), "p95": pick(95), "p99": pick(99), "max": round(ordered[-1], 4)}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ——— resource sampling (Linux /proc; skipped elsewhere) ———
+
+def _proc_children() -> dict:
+    children = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+    return children
+
+
+def _process_tree(root_pid: int) -> list:
+    children = _proc_children()
+    tree, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _cpu_seconds(pid: int) -> float:
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0.0
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class ResourceSampler(threading.Thread):
+    """Samples RSS and CPU of some processes and all their descendants."""
+
+    def __init__(self, root_pids: list, interval: float = 0.25):
+        super().__init__(daemon=True)
+        self.root_pids = root_pids
+        self.interval = interval
+        self.peak_tree_rss = 0
+        self.peak_processes = 0
+        self._cpu_by_pid = {}
+        self._halt = threading.Event()
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(self._cpu_by_pid.values())
+
+    def run(self):
+        if not Path("/proc").is_dir():
+            return
+        while not self._halt.wait(self.interval):
+            tree = [pid for root in self.root_pids for pid in _process_tree(root)]
+            self.peak_processes = max(self.peak_processes, len(tree))
+            self.peak_tree_rss = max(self.peak_tree_rss, sum(_rss_bytes(p) for p in tree))
+            for pid in tree:
+                # short-lived children are only seen while alive; keep the last reading
+                self._cpu_by_pid[pid] = max(self._cpu_by_pid.get(pid, 0.0), _cpu_seconds(pid))
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+# ——— log parsing ———
+
+def read_runs(log_path: Path) -> dict:
+    """Groups the pipeline's JSON log lines by correlation ID."""
+    runs = {}
+    try:
+        lines = log_path.read_text(errors="replace").splitlines()
+    except FileNotFoundError:
+        return runs
+    for line in lines:
+        if not line.startswith("{"):
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        cid = entry.get("correlation_id")
+        if not cid or entry.get("service") != "pipeline":
+            continue
+        run = runs.setdefault(cid, {"stages": {}, "errors": 0, "total": None})
+        if entry.get("level") == "ERROR":
+            run["errors"] += 1
+        if entry.get("msg") == "span":
+            seconds = entry.get("duration_ms", 0) / 1000
+            if entry.get("stage") == "pipeline":
+                run["total"] = seconds
+            else:
+                run["stages"].setdefault(entry.get("stage"), []).append(seconds)
+    return runs
+
+
+# ——— scenario run ———
+
+def run_scenario(name: str, settings: dict, drain_timeout: float, workdir: Path) -> dict:
+    rate, duration = settings["rate"], settings["duration"]
+    width, height = parse_resolution(settings["resolution"])
+    cameras = SPECIES[:settings["cameras"]]
+
+    fakes = FakeServices(FakeConfig(latency={**DEFAULT_LATENCY, **settings.get("latency", {})},
+                                    error_rate=settings.get("error_rate", {}), seed=42)).start()
+
+    port = free_port()
+    window = float(settings.get("frame_window", 0))
+    # the adaptive cadence would skip most back-to-back frames; scenarios opt in with "cadence"
+    env = {**os.environ, **fakes.env(), "PORT": str(port), "FRAME_WINDOW_SECONDS": str(window),
+           "CADENCE_ENABLED": "1" if settings.get("cadence") else "0",
+           # likewise the per-camera API budget would turn bursts into local scoring
+           "BUDGET_ENABLED": "1" if settings.get("budget") else "0",
+           "JWT_SECRET_KEY": os.getenv("JWT_SECRET_KEY") or "bench-only-secret",
+           "FF_DATA_DIR": str(workdir / "data"), "FF_METRICS_DIR": str(workdir / "metrics")}
+    log_path = workdir / "server.log"
+    log_fh = open(log_path, "w")
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    server = subprocess.Popen([sys.executable, str(ROOT_DIR / "src" / "server_http.py")],
+                              cwd=workdir, env=env, stdout=log_fh, stderr=subprocess.STDOUT,
+                              stdin=subprocess.DEVNULL)
+    # frames are queued by server_http and run by a worker, as under main.py
+    worker = subprocess.Popen([sys.executable, str(ROOT_DIR / "src" / "pipeline.py"), "worker",
+                               "--concurrency", str(settings.get("workers", 8))],
+                              cwd=workdir, env=env, stdout=log_fh, stderr=subprocess.STDOUT,
+                              stdin=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{base}/metrics", timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+    else:
+        server.kill()
+        worker.kill()
+        raise RuntimeError(f"server_http did not start; see {log_path}")
+
+    # a small pool of distinct frames, reused round-robin
+    frames = [base64.b64encode(frame_jpeg_bytes(width, height, seed=i)).decode() for i in range(8)]
+    total = max(1, int(round(rate * duration)))
+    ingest, statuses = [], {}
+    lock = threading.Lock()
+
+    def send(i: int):
+        species = cameras[i % len(cameras)]
+        payload = {"timestamp": datetime.now(timezone.utc).isoformat(),
+                   "filename": f"{species}_bench_{i:05d}.jpg",
+                   "image_b64": frames[i % len(frames)], "species": species, "zip": "06870"}
+        t0 = time.perf_counter()
+        try:
+            status = requests.post(f"{base}/plants/health", json=payload, timeout=30).status_code
+        except requests.RequestException:
+            status = "error"
+        with lock:
+            ingest.append(time.perf_counter() - t0)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    sampler = ResourceSampler([server.pid, worker.pid])
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        for i in range(total):
+            # open-loop: send on schedule regardless of how slow responses are
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, i)
+    accepted = statuses.get(200, 0)
+
+    # Without a selection window every accepted upload produces one run. With
+    # one, the number of runs isn't known up front, so wait for things to go quiet.
+    deadline = time.perf_counter() + drain_timeout
+    done, last_change = 0, time.perf_counter()
+    finished = last_change
+    while time.perf_counter() < deadline:
+        now_done = sum(1 for r in read_runs(log_path).values() if r["total"] is not None)
+        if now_done != done:
+            done, last_change = now_done, time.perf_counter()
+            finished = last_change
+        if not window and done >= accepted:
+            break
+        if window and time.perf_counter() - last_change > window + 15:
+            break
+        time.sleep(0.5)
+
+    sampler.stop()
+    for proc in (server, worker):
+        proc.send_signal(signal.SIGINT)
+    for proc in (server, worker):
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    log_fh.close()
+    fakes.stop()
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    runs = read_runs(log_path)
+    completed = [r for r in runs.values() if r["total"] is not None]
+    stages = {}
+    for r in completed:
+        for stage, values in r["stages"].items():
+            stages.setdefault(stage, []).extend(values)
+    wall = finished - started
+    reaped_cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    cpu = max(reaped_cpu, sampler.cpu_seconds)
+
+    return {
+        "scenario": name,
+        "settings": settings,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_rev": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                  capture_output=True, text=True).stdout.strip(),
+        "requests": {"sent": total, "statuses": {str(k): v for k, v in statuses.items()},
+                     "diagnosed_per_upload": round(len(completed) / accepted, 3) if accepted else 0.0},
+        "ingest_latency_s": percentiles(ingest),
+        "pipeline_latency_s": percentiles([r["total"] for r in completed]),
+        "stage_latency_s": {stage: percentiles(v) for stage, v in sorted(stages.items())},
+        "throughput": {
+            "completed": len(completed),
+            "with_errors": sum(1 for r in completed if r["errors"]),
+            "wall_s": round(wall, 2),
+            "images_per_s": round(len(completed) / wall, 3) if wall else 0.0,
+        },
+        "resources": {
+            "cpu_s": round(cpu, 2),
+            "cpu_util": round(cpu / wall, 3) if wall else 0.0,
+            "rss_peak_tree_mb": round(sampler.peak_tree_rss / 2**20, 1),
+            "rss_peak_process_mb": round(usage_after.ru_maxrss / 1024, 1),
+            "peak_processes": sampler.peak_processes,
+        },
+        "fakes": fakes.stats(),
+    }
+
+
+# ——— comparing reports ———
+
+COMPARE_KEYS = [
+    ("ingest p95 (s)", ("ingest_latency_s", "p95")),
+    ("pipeline p50 (s)", ("pipeline_latency_s", "p50")),
+    ("pipeline p95 (s)", ("pipeline_latency_s", "p95")),
+    ("pipeline p99 (s)", ("pipeline_latency_s", "p99")),
+    ("images/s", ("throughput", "images_per_s")),
+    ("cpu s", ("resources", "cpu_s")),
+    ("rss peak tree MB", ("resources", "rss_peak_tree_mb")),
+]
+
+
+def compare(paths):
+    reports = [json.loads(Path(p).read_text()) for p in paths]
+    print(f"{'metric':<20}" + "".join(f"{Path(p).stem[:24]:>26}" for p in paths))
+    for label, (section, key) in COMPARE_KEYS:
+        values = [r.get(section, {}).get(key) for r in reports]
+        cells = []
+        for idx, v in enumerate(values):
+            cell = "-" if v is None else f"{v}"
+            if idx and v is not None and values[0] not in (None, 0):
+                cell += f" ({(v - values[0]) / values[0] * 100:+.0f}%)"
+            cells.append(f"{cell:>26}")
+        print(f"{label:<20}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark.")
+    parser.add_argument("--scenario", default="smoke", choices=sorted(SCENARIOS))
+    parser.add_argument("--rate", type=float, help="Uploads per second (overrides scenario)")
+    parser.add_argument("--duration", type=float, help="Seconds of load (overrides scenario)")
+    parser.add_argument("--resolution", help="WxH or a preset (overrides scenario)")
+    parser.add_argument("--drain-timeout", type=float, default=180,
+                        help="Seconds to wait for queued pipeline runs after the load stops")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--compare", nargs="+", metavar="REPORT")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    settings = dict(SCENARIOS[args.scenario])
+    for key in ("rate", "duration", "resolution"):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+
+    workdir = Path(tempfile.mkdtemp(prefix=f"ffbench-{args.scenario}-"))
+    print(f"Running '{args.scenario}' ({settings}) in {workdir} …")
+    report = run_scenario(args.scenario, settings, args.drain_timeout, workdir)
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    out = RESULTS_DIR / f"{args.scenario}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    out.write_text(json.dumps(report, indent=2))
+    print(json.dumps({k: report[k] for k in ("ingest_latency_s", "pipeline_latency_s",
+                                             "throughput", "resources")}, indent=2))
+    print(f"Report saved to {out}")
+    if not args.keep_workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+synth_images.py
+
+Generates foliage-like camera frames for benchmarking: a sky gradient, a
+brown trunk and a canopy of noisy green blobs, with optional blur and
+exposure shifts to mimic bad frames.
+
+    python bench/synth_images.py --out /tmp/frames --count 10 --resolution 1280x720
+"""
+
+import io
+import argparse
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Common Pi camera output sizes
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "pi-v2": (3280, 2464),
+}
+
+
+def parse_resolution(value: str):
+    if value in RESOLUTIONS:
+        return RESOLUTIONS[value]
+    w, _, h = value.lower().partition("x")
+    return int(w), int(h)
+
+
+def make_frame(width: int, height: int, seed: int = 0, blur: float = 0.0,
+               exposure: float = 1.0) -> Image.Image:
+    """Returns one synthetic RGB tree frame."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+
+    # sky: light blue fading toward the horizon
+    t = yy / max(height - 1, 1)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    img[..., 0] = 120 + 80 * t
+    img[..., 1] = 170 + 50 * t
+    img[..., 2] = 235 - 20 * t
+
+    # ground
+    ground = yy > height * 0.85
+    img[ground] = (95, 80, 55)
+
+    # trunk
+    cx = width * rng.uniform(0.4, 0.6)
+    trunk = (np.abs(xx - cx) < width * 0.035) & (yy > height * 0.45) & ~ground
+    img[trunk] = (101, 67, 33)
+
+    # canopy: overlapping ellipses of varying greens
+    for _ in range(int(rng.integers(12, 24))):
+        bx = cx + rng.normal(0, width * 0.15)
+        by = height * rng.uniform(0.15, 0.5)
+        rx = width * rng.uniform(0.06, 0.16)
+        ry = height * rng.uniform(0.06, 0.16)
+        blob = ((xx - bx) / rx) ** 2 + ((yy - by) / ry) ** 2 < 1
+        green = rng.uniform([25, 90, 20], [80, 160, 60])
+        img[blob] = green
+
+    # leaf-level texture
+    img += rng.normal(0, 12, size=img.shape)
+    img *= exposure
+    frame = Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+    if blur:
+        frame = frame.filter(ImageFilter.GaussianBlur(blur))
+    return frame
+
+
+def frame_jpeg_bytes(width: int, height: int, seed: int = 0, quality: int = 85, **kwargs) -> bytes:
+    buf = io.BytesIO()
+    make_frame(width, height, seed, **kwargs).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic foliage frames as JPEGs.")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--count", type=int, default=5)
+    parser.add_argument("--resolution", default="720p", help=f"WxH or one of {list(RESOLUTIONS)}")
+    parser.add_argument("--blur", type=float, default=0.0)
+    parser.add_argument("--exposure", type=float, default=1.0)
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    w, h = parse_resolution(args.resolution)
+    for i in range(args.count):
+        (out / f"synthetic_{w}x{h}_{i:04d}.jpg").write_bytes(
+            frame_jpeg_bytes(w, h, seed=i, blur=args.blur, exposure=args.exposure))
+    print(f"Wrote {args.count} frames ({w}x{h}) to {out}")
+
+
+if __name__ == "__main__":
+    main()
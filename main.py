@@ -8,10 +8,12 @@ PROCS = [
     [sys.executable, os.path.join(PROJECT_ROOT, 'src', 'server_http.py')],
     [sys.executable, os.path.join(PROJECT_ROOT, 'src', 'chat_api.py')],
     [sys.executable, os.path.join(PROJECT_ROOT, 'src', 'auth', 'auth_api.py')],
+    # processes the frames server_http.py queues; more can run on other nodes
+    [sys.executable, os.path.join(PROJECT_ROOT, 'src', 'pipeline.py'), 'worker'],
 ]
 
 def main():
-    print("Starting all Flask servers: server_http.py, chat_api.py, and auth_api.py ...")
+    print("Starting all Flask servers: server_http.py, chat_api.py, and auth_api.py, plus a pipeline worker ...")
     procs = []
     try:
         for cmd in PROCS:
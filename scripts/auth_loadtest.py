@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+auth_loadtest.py
+
+Hammers a running auth_api.py with concurrent login and /me requests and
+prints throughput and latency percentiles for each endpoint.
+
+    python scripts/auth_loadtest.py --username alice --password secret \
+        --concurrency 16 --duration 15
+
+The account must already exist (signup + admin approval).
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run_phase(name, concurrency, duration, make_request):
+    """Runs make_request(session) in a loop on `concurrency` threads for `duration` seconds."""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        nonlocal errors
+        session = requests.Session()
+        local_lat, local_err = [], 0
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            try:
+                ok = make_request(session)
+            except requests.RequestException:
+                ok = False
+            local_lat.append(time.perf_counter() - t0)
+            if not ok:
+                local_err += 1
+        with lock:
+            latencies.extend(local_lat)
+            errors += local_err
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+
+    total = len(latencies)
+    print(f"\n== {name} ==")
+    print(f"  requests:   {total} ({errors} errors) in {elapsed:.1f}s")
+    print(f"  throughput: {total / elapsed:.1f} req/s")
+    if latencies:
+        print(f"  latency ms: mean {statistics.mean(latencies) * 1000:.1f}"
+              f"  p50 {percentile(latencies, 50) * 1000:.1f}"
+              f"  p95 {percentile(latencies, 95) * 1000:.1f}"
+              f"  p99 {percentile(latencies, 99) * 1000:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test auth_api login and /me.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5002")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per phase")
+    args = parser.parse_args()
+
+    login_url = f"{args.base_url}/api/auth/login"
+    me_url = f"{args.base_url}/api/auth/me"
+    creds = {"username": args.username, "password": args.password}
+
+    resp = requests.post(login_url, json=creds, timeout=30)
+    if resp.status_code != 200:
+        raise SystemExit(f"Login failed ({resp.status_code}): {resp.text}")
+    headers = {"Authorization": "Bearer " + resp.json()["access_token"]}
+
+    run_phase("POST /api/auth/login", args.concurrency, args.duration,
+              lambda s: s.post(login_url, json=creds, timeout=30).status_code == 200)
+    run_phase("GET /api/auth/me", args.concurrency, args.duration,
+              lambda s: s.get(me_url, headers=headers, timeout=30).status_code == 200)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+prompt_tokens.py
+
+Prints the text prompt tokens per call for the diagnosis and chat prompts,
+comparing the previous format (full care JSON, indented chat JSON,
+timestamp inside the user text) with prompts.py. Also checks that the
+cacheable prefix is byte-identical between two calls made at different
+times. Image tokens are not included.
+
+    python scripts/prompt_tokens.py                      # bench sample care JSON
+    python scripts/prompt_tokens.py static/data/savedJson/oakCare.json
+
+Counts use tiktoken when it's installed, else ~4 characters per token.
+"""
+import sys
+import json
+import argparse
+import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.prompts import (
+    DIAGNOSIS_SYSTEM_PROMPT, chat_system_prompt, diagnosis_messages, estimate_tokens, prompt_text
+)
+
+
+def sample_care() -> dict:
+    from bench.fakes import CARE_JSON
+    return {
+        "species": "oak",
+        "recommendations": CARE_JSON,
+        "current_weather": {"temperature": 68.0, "humidity": 55, "description": "scattered clouds"},
+    }
+
+
+def legacy_diagnosis_text(recommendations: dict, when: datetime.datetime) -> str:
+    """The diagnosis prompt text as chat_with_json_and_image built it before prompts.py."""
+    user_text = (
+        "Here are the care recommendations (in JSON):\n"
+        f"{json.dumps(recommendations)}\n\n"
+        "Analyze the plant image and those recommendations, then return the required JSON.\n\n"
+        f"The current date/time is {when.isoformat()}Z.\n"
+        f"The tree's location is Lat: {recommendations.get('latitude')}, Lon: {recommendations.get('longitude')}."
+    )
+    return DIAGNOSIS_SYSTEM_PROMPT + "\n" + user_text
+
+
+def legacy_chat_text(species: str, care: dict, health: dict) -> str:
+    return (
+        f"You are a plant care assistant for a {species} tree.\n"
+        f"Use the JSON data provided below to inform your responses.\n"
+        f"You may also draw on standard {species} care practices (e.g., typical watering frequency) "
+        "to supplement the data when needed.\n\n"
+        "Care recommendations (JSON):\n```json\n" + json.dumps(care, indent=2) + "\n```\n"
+        "Current health analysis (JSON):\n```json\n" + json.dumps(health, indent=2) + "\n```"
+        "Keep answers short and consise, but still accurate"
+    )
+
+
+def stable_prefix(messages: list) -> str:
+    """System prompt plus the user text that precedes the first image."""
+    return messages[0]["content"] + json.dumps(messages[1]["content"][0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prompt tokens before/after prompts.py.")
+    parser.add_argument("care_json", nargs="?", help="savedJson/<species>Care.json (default: bench sample)")
+    args = parser.parse_args()
+
+    recs = json.loads(Path(args.care_json).read_text()) if args.care_json else sample_care()
+    recs.setdefault("latitude", 41.019)
+    recs.setdefault("longitude", -73.626)
+    when = datetime.datetime(2025, 7, 14, 15, 30)
+    later = when + datetime.timedelta(hours=1, minutes=7)
+
+    before = estimate_tokens(legacy_diagnosis_text(recs, when))
+    msgs = diagnosis_messages(recs, ["data:image/png;base64,AAAA"], when)
+    after = estimate_tokens(prompt_text(msgs))
+    same_prefix = stable_prefix(msgs) == stable_prefix(diagnosis_messages(recs, ["data:image/png;base64,BBBB"], later))
+
+    care = recs.get("recommendations", recs)
+    from bench.fakes import FakeServices
+    health = FakeServices.diagnosis_json()
+    chat_before = estimate_tokens(legacy_chat_text("oak", care, health))
+    chat_after = estimate_tokens(chat_system_prompt("oak", care, health))
+
+    print(f"{'prompt':<12}{'before':>8}{'after':>8}{'saved':>8}")
+    for name, b, a in (("diagnosis", before, after), ("chat", chat_before, chat_after)):
+        print(f"{name:<12}{b:>8}{a:>8}{(b - a) / b:>8.0%}")
+    print(f"diagnosis prefix identical across calls: {same_prefix} "
+          f"({estimate_tokens(stable_prefix(msgs))} tokens)")
+
+
+if __name__ == "__main__":
+    main()
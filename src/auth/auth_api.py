@@ -5,16 +5,34 @@ auth_api.py
 Flask auth service with admin-approved signups, JWT login,
 and manual CORS headers (no flask-cors dependency),
 all endpoints handle OPTIONS preflight and verify tokens inside handlers.
+
+Access tokens carry the user's profile and admin flag as claims, so the
+authenticated endpoints never hit the database on the hot path. Logged-out
+tokens go into a small revocation list that is cached in memory.
+Password hashing runs off the request thread (see passwords.py).
 """
 import os
-from datetime import datetime
+import sys
+import json
+import math
+import logging
+import threading
+import time
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from datetime import datetime, timezone
 from flask import Flask, request, jsonify, make_response
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import (
-    JWTManager, create_access_token, get_jwt_identity, verify_jwt_in_request
+    JWTManager, create_access_token, get_jwt, get_jwt_identity, verify_jwt_in_request
 )
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, insert, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from dotenv import load_dotenv
+from src.auth.passwords import (
+    HashingBusy, LoginThrottle, hash_password, needs_rehash, verify_password
+)
+from src.instrumentation import log_event, register_metrics
 
 # Load environment variables
 load_dotenv()
@@ -25,10 +43,40 @@ app = Flask(__name__)
 base_dir = os.path.abspath(os.path.dirname(__file__))
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(base_dir, 'auth.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-secret')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size':     int(os.getenv('AUTH_DB_POOL_SIZE', '5')),
+    'max_overflow':  int(os.getenv('AUTH_DB_MAX_OVERFLOW', '10')),
+    'pool_timeout':  int(os.getenv('AUTH_DB_POOL_TIMEOUT', '10')),
+    'pool_recycle':  1800,
+    'pool_pre_ping': True,
+    # pooled connections are shared across request threads
+    'connect_args':  {'check_same_thread': False, 'timeout': 15},
+}
+if not os.getenv('JWT_SECRET_KEY'):
+    raise SystemExit("JWT_SECRET_KEY is not set; use a long random value, shared with server_http.py")
+app.config['JWT_SECRET_KEY'] = os.environ['JWT_SECRET_KEY']
+
+# Camera registry seeded into the DB on startup
+CAMERAS_JSON = Path(base_dir).parents[1] / 'static' / 'data' / 'cameras.json'
+CAMERAS_PAGE_DEFAULT = 50
+CAMERAS_PAGE_MAX = 200
+
+# Seconds between reloads of the revocation list from the DB
+REVOCATION_CACHE_TTL = float(os.getenv('AUTH_REVOCATION_CACHE_TTL', '30'))
 
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
+register_metrics(app, "auth_api")
+login_throttle = LoginThrottle()
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers proceed while a signup/approval is being written
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute('PRAGMA busy_timeout=5000')
+    cur.execute('PRAGMA foreign_keys=ON')
+    cur.close()
 
 # Models
 class PendingSignup(db.Model):
@@ -37,21 +85,121 @@ class PendingSignup(db.Model):
     email         = db.Column(db.String(120), unique=True, nullable=False)
     first_name    = db.Column(db.String(80), nullable=False)
     last_name     = db.Column(db.String(80), nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
     requested_at  = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (db.Index('ix_pending_signup_requested_at', 'requested_at'),)
+
 class User(db.Model):
     id            = db.Column(db.Integer, primary_key=True)
     username      = db.Column(db.String(80), unique=True, nullable=False)
     email         = db.Column(db.String(120), unique=True, nullable=False)
     first_name    = db.Column(db.String(80), nullable=False)
     last_name     = db.Column(db.String(80), nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
     is_admin      = db.Column(db.Boolean, default=False, nullable=False)
 
-# Create tables
+    __table_args__ = (db.Index('ix_user_is_admin', 'is_admin'),)
+
+class Camera(db.Model):
+    id            = db.Column(db.String(64), primary_key=True)
+    name          = db.Column(db.String(120), nullable=False)
+    species       = db.Column(db.String(80), nullable=False)
+    preview_image = db.Column(db.String(255))
+    data_url      = db.Column(db.String(255))
+    lat           = db.Column(db.Float)
+    lng           = db.Column(db.Float)
+
+    def to_dict(self):
+        # same shape as the entries in cameras.json
+        return {'id': self.id, 'name': self.name, 'species': self.species,
+                'previewImage': self.preview_image, 'dataUrl': self.data_url,
+                'lat': self.lat, 'lng': self.lng}
+
+class UserCamera(db.Model):
+    user_id     = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    camera_id   = db.Column(db.String(64), db.ForeignKey('camera.id', ondelete='CASCADE'), primary_key=True)
+    assigned_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (db.Index('ix_user_camera_camera_id', 'camera_id'),)
+
+class RevokedToken(db.Model):
+    id         = db.Column(db.Integer, primary_key=True)
+    jti        = db.Column(db.String(36), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index('ix_revoked_token_expires_at', 'expires_at'),)
+
+# Create tables (and indexes missing from tables created by older versions)
 with app.app_context():
+    event.listen(db.engine, 'connect', _sqlite_pragmas)
     db.create_all()
+    for model in (PendingSignup, User, Camera, UserCamera, RevokedToken):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def sync_cameras_from_json(path=CAMERAS_JSON):
+    """Inserts cameras.json entries that aren't in the DB yet. Returns how many were added."""
+    if not path.is_file():
+        return 0
+    with open(path) as f:
+        entries = json.load(f)
+    known = {cid for (cid,) in db.session.query(Camera.id)}
+    rows = [{'id': e['id'], 'name': e.get('name', e['id']), 'species': e.get('species', ''),
+             'preview_image': e.get('previewImage'), 'data_url': e.get('dataUrl'),
+             'lat': e.get('lat'), 'lng': e.get('lng')}
+            for e in entries if e.get('id') and e['id'] not in known]
+    if rows:
+        db.session.execute(insert(Camera), rows)
+        db.session.commit()
+    return len(rows)
+
+with app.app_context():
+    sync_cameras_from_json()
+
+# Revocation list cache: jti -> expiry (unix seconds)
+_revoked = {}
+_revoked_loaded_at = 0.0
+_revoked_lock = threading.Lock()
+
+def revoked_jtis():
+    global _revoked, _revoked_loaded_at
+    now = time.time()
+    if now - _revoked_loaded_at < REVOCATION_CACHE_TTL:
+        return _revoked
+    with _revoked_lock:
+        if now - _revoked_loaded_at >= REVOCATION_CACHE_TTL:
+            cutoff = datetime.utcnow()
+            RevokedToken.query.filter(RevokedToken.expires_at < cutoff).delete()
+            db.session.commit()
+            rows = db.session.query(RevokedToken.jti, RevokedToken.expires_at).all()
+            _revoked = {
+                jti: exp.replace(tzinfo=timezone.utc).timestamp() for jti, exp in rows
+            }
+            _revoked_loaded_at = now
+    return _revoked
+
+def revoke_token(claims):
+    exp = datetime.fromtimestamp(claims['exp'], tz=timezone.utc).replace(tzinfo=None)
+    # concurrent logouts with the same token: the second insert is a no-op, not an IntegrityError
+    db.session.execute(sqlite_insert(RevokedToken)
+                       .values(jti=claims['jti'], expires_at=exp)
+                       .on_conflict_do_nothing(index_elements=['jti']))
+    db.session.commit()
+    with _revoked_lock:
+        _revoked[claims['jti']] = claims['exp']
+
+@jwt.token_in_blocklist_loader
+def is_token_revoked(_jwt_header, jwt_payload):
+    return jwt_payload['jti'] in revoked_jtis()
+
+def user_claims(user):
+    return {
+        'username':   user.username,
+        'first_name': user.first_name,
+        'last_name':  user.last_name,
+        'is_admin':   user.is_admin,
+    }
 
 # CORS helper
 def corsify(resp):
@@ -63,11 +211,30 @@ def corsify(resp):
 # Admin check
 def is_current_admin():
     # must call verify_jwt_in_request before using
-    uid = get_jwt_identity()
-    if not uid:
+    if not get_jwt_identity():
         return False
-    user = User.query.get(uid)
-    return bool(user and user.is_admin)
+    return bool(get_jwt().get('is_admin'))
+
+def busy_response(exc):
+    log_event('auth_busy', level=logging.WARNING, endpoint=request.endpoint, error=str(exc))
+    resp = corsify(jsonify(msg='Server busy, please retry shortly.'))
+    resp.headers['Retry-After'] = '1'
+    return resp, 503
+
+def find_signup_conflict(uname, email):
+    """Returns 'username', 'email' or None, checking users and pending signups in one query."""
+    taken = db.union_all(
+        db.select(PendingSignup.username, PendingSignup.email)
+          .where(or_(PendingSignup.username == uname, PendingSignup.email == email)),
+        db.select(User.username, User.email)
+          .where(or_(User.username == uname, User.email == email)),
+    )
+    rows = db.session.execute(taken).all()
+    if any(r.username == uname for r in rows):
+        return 'username'
+    if rows:
+        return 'email'
+    return None
 
 # Routes
 @app.route('/api/auth/signup', methods=['POST','OPTIONS'])
@@ -85,14 +252,19 @@ def signup_request():
     last  = data['last_name'].strip()
     pw    = data['password']
     # uniqueness
-    if PendingSignup.query.filter_by(username=uname).first() or User.query.filter_by(username=uname).first():
+    conflict = find_signup_conflict(uname, email)
+    if conflict == 'username':
         return corsify(jsonify(msg='Username already taken.')), 400
-    if PendingSignup.query.filter_by(email=email).first() or User.query.filter_by(email=email).first():
+    if conflict == 'email':
         return corsify(jsonify(msg='Email already registered.')), 400
     # queue
+    try:
+        pw_hash = hash_password(pw)
+    except HashingBusy as e:
+        return busy_response(e)
     ps = PendingSignup(username=uname, email=email,
                        first_name=first, last_name=last,
-                       password_hash=generate_password_hash(pw))
+                       password_hash=pw_hash)
     db.session.add(ps)
     db.session.commit()
     return corsify(jsonify(msg='Signup request queued; await admin approval.')), 202
@@ -106,12 +278,43 @@ def login():
     pw    = data.get('password','')
     if not uname or not pw:
         return corsify(jsonify(msg='Username and password required.')), 400
+    # refuse before running the KDF so failed attempts can't amplify CPU load
+    ip = request.remote_addr or 'unknown'
+    wait = login_throttle.retry_after(ip, uname)
+    if wait:
+        resp = corsify(jsonify(msg='Too many failed login attempts. Try again later.'))
+        resp.headers['Retry-After'] = str(math.ceil(wait))
+        return resp, 429
     user = User.query.filter_by(username=uname).first()
-    if not user or not check_password_hash(user.password_hash, pw):
+    try:
+        ok = bool(user) and verify_password(user.password_hash, pw)
+    except HashingBusy as e:
+        return busy_response(e)
+    if not ok:
+        login_throttle.record_failure(ip, uname)
         return corsify(jsonify(msg='Invalid credentials.')), 401
-    token = create_access_token(identity=user.id)
+    login_throttle.reset(ip, uname)
+    # transparently upgrade hashes made with older cost parameters
+    if needs_rehash(user.password_hash):
+        try:
+            user.password_hash = hash_password(pw)
+            db.session.commit()
+        except HashingBusy:
+            pass
+    token = create_access_token(identity=str(user.id), additional_claims=user_claims(user))
     return corsify(jsonify(access_token=token)), 200
 
+@app.route('/api/auth/logout', methods=['POST','OPTIONS'])
+def logout():
+    if request.method == 'OPTIONS':
+        return corsify(make_response()), 200
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return corsify(jsonify(msg='Missing or invalid token.')), 401
+    revoke_token(get_jwt())
+    return corsify(jsonify(msg='Logged out.')), 200
+
 @app.route('/api/auth/me', methods=['GET','OPTIONS'])
 def me():
     if request.method == 'OPTIONS':
@@ -121,12 +324,12 @@ def me():
         verify_jwt_in_request()
     except Exception:
         return corsify(jsonify(msg='Missing or invalid token.')), 401
-    user = User.query.get(get_jwt_identity())
+    claims = get_jwt()
     return corsify(jsonify(
-        username   = user.username,
-        first_name = user.first_name,
-        last_name  = user.last_name,
-        is_admin   = user.is_admin
+        username   = claims.get('username'),
+        first_name = claims.get('first_name'),
+        last_name  = claims.get('last_name'),
+        is_admin   = bool(claims.get('is_admin'))
     )), 200
 
 @app.route('/api/auth/signup-requests', methods=['GET','OPTIONS'])
@@ -161,11 +364,12 @@ def approve_signup():
     p = PendingSignup.query.filter_by(username=uname).first()
     if not p:
         return corsify(jsonify(msg='Request not found.')), 404
-    # migrate
+    # migrate (the first approved user becomes admin)
+    has_admin = db.session.query(db.exists().where(User.is_admin.is_(True))).scalar()
     u = User(username=p.username, email=p.email,
              first_name=p.first_name, last_name=p.last_name,
              password_hash=p.password_hash,
-             is_admin=(User.query.filter_by(is_admin=True).count()==0))
+             is_admin=not has_admin)
     db.session.add(u)
     db.session.delete(p)
     db.session.commit()
@@ -190,5 +394,126 @@ def reject_signup():
     db.session.commit()
     return corsify(jsonify(msg=f'Rejected {uname}.' )), 200
 
+def parse_assignment(data):
+    """Validates a bulk (un)assign body; returns (users, camera_ids, None), or (None, None, error response)."""
+    usernames = data.get('usernames') or ([data['username']] if data.get('username') else [])
+    camera_ids = data.get('camera_ids') or ([data['camera_id']] if data.get('camera_id') else [])
+    if not usernames or not camera_ids:
+        return None, None, (corsify(jsonify(msg='usernames and camera_ids are required.')), 400)
+    usernames = {str(u).strip() for u in usernames}
+    camera_ids = {str(c).strip() for c in camera_ids}
+    users = User.query.filter(User.username.in_(usernames)).all()
+    found_cams = {cid for (cid,) in db.session.query(Camera.id).filter(Camera.id.in_(camera_ids))}
+    missing_users = sorted(usernames - {u.username for u in users})
+    missing_cams = sorted(camera_ids - found_cams)
+    if missing_users or missing_cams:
+        return None, None, (corsify(jsonify(msg='Unknown users or cameras.',
+                                            users=missing_users, cameras=missing_cams)), 404)
+    return users, camera_ids, None
+
+@app.route('/api/cameras', methods=['GET','OPTIONS'])
+def list_cameras():
+    """
+    Cameras visible to the caller (admins see every camera), keyset-paginated:
+      ?limit=<n>&cursor=<last camera id of previous page>
+    """
+    if request.method == 'OPTIONS':
+        return corsify(make_response()), 200
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return corsify(jsonify(msg='Missing or invalid token.')), 401
+    try:
+        limit = min(max(int(request.args.get('limit', CAMERAS_PAGE_DEFAULT)), 1), CAMERAS_PAGE_MAX)
+    except ValueError:
+        return corsify(jsonify(msg='limit must be an integer.')), 400
+    cursor = request.args.get('cursor')
+
+    q = Camera.query
+    if not is_current_admin():
+        q = q.join(UserCamera, UserCamera.camera_id == Camera.id) \
+             .filter(UserCamera.user_id == int(get_jwt_identity()))
+    if cursor:
+        q = q.filter(Camera.id > cursor)
+    page = q.order_by(Camera.id).limit(limit + 1).all()
+    next_cursor = page[limit - 1].id if len(page) > limit else None
+    return corsify(jsonify(cameras=[c.to_dict() for c in page[:limit]],
+                           next_cursor=next_cursor)), 200
+
+@app.route('/api/cameras/<camera_id>', methods=['GET','OPTIONS'])
+def get_camera(camera_id):
+    if request.method == 'OPTIONS':
+        return corsify(make_response()), 200
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return corsify(jsonify(msg='Missing or invalid token.')), 401
+    q = Camera.query.filter(Camera.id == camera_id)
+    if not is_current_admin():
+        q = q.join(UserCamera, UserCamera.camera_id == Camera.id) \
+             .filter(UserCamera.user_id == int(get_jwt_identity()))
+    cam = q.first()
+    if not cam:
+        return corsify(jsonify(msg='Camera not found.')), 404
+    return corsify(jsonify(cam.to_dict())), 200
+
+@app.route('/api/cameras/assign', methods=['POST','OPTIONS'])
+def assign_cameras():
+    """Body: {"usernames": [...], "camera_ids": [...]}; assigns every pair in one transaction."""
+    if request.method == 'OPTIONS':
+        return corsify(make_response()), 200
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return corsify(jsonify(msg='Missing or invalid token.')), 401
+    if not is_current_admin():
+        return corsify(jsonify(msg='Forbidden')), 403
+    users, camera_ids, error = parse_assignment(request.get_json(force=True))
+    if error:
+        return error
+    user_ids = [u.id for u in users]
+    existing = set(db.session.query(UserCamera.user_id, UserCamera.camera_id)
+                   .filter(UserCamera.user_id.in_(user_ids), UserCamera.camera_id.in_(camera_ids)))
+    now = datetime.utcnow()
+    rows = [{'user_id': uid, 'camera_id': cid, 'assigned_at': now}
+            for uid in user_ids for cid in camera_ids if (uid, cid) not in existing]
+    if rows:
+        db.session.execute(insert(UserCamera), rows)
+    db.session.commit()
+    return corsify(jsonify(msg=f'Assigned {len(rows)} camera(s).', assigned=len(rows))), 200
+
+@app.route('/api/cameras/unassign', methods=['POST','OPTIONS'])
+def unassign_cameras():
+    if request.method == 'OPTIONS':
+        return corsify(make_response()), 200
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return corsify(jsonify(msg='Missing or invalid token.')), 401
+    if not is_current_admin():
+        return corsify(jsonify(msg='Forbidden')), 403
+    users, camera_ids, error = parse_assignment(request.get_json(force=True))
+    if error:
+        return error
+    removed = UserCamera.query.filter(
+        UserCamera.user_id.in_([u.id for u in users]),
+        UserCamera.camera_id.in_(camera_ids),
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return corsify(jsonify(msg=f'Unassigned {removed} camera(s).', unassigned=removed)), 200
+
+@app.route('/api/cameras/sync', methods=['POST','OPTIONS'])
+def sync_cameras():
+    if request.method == 'OPTIONS':
+        return corsify(make_response()), 200
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return corsify(jsonify(msg='Missing or invalid token.')), 401
+    if not is_current_admin():
+        return corsify(jsonify(msg='Forbidden')), 403
+    added = sync_cameras_from_json()
+    return corsify(jsonify(msg=f'Added {added} camera(s) from cameras.json.', added=added)), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5002)
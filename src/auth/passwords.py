@@ -0,0 +1,134 @@
+"""
+passwords.py
+
+Password hashing for auth_api.py.
+
+werkzeug's KDFs are deliberately slow, so they run on a small bounded
+thread pool instead of the request thread: at most AUTH_HASH_WORKERS
+hashes run at once and at most AUTH_HASH_QUEUE may be waiting. When the
+queue is full callers get HashingBusy right away rather than piling up.
+LoginThrottle caps failed logins per IP and per (username, IP) so a burst
+of bad passwords can't be used to burn CPU on the KDF, without letting
+anyone lock a user out by failing logins for them from one address. A much
+looser cap per username catches guessing spread over many addresses.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# ——— Tunables (per deployment) ———
+# e.g. "scrypt:32768:8:1" (werkzeug default) or "pbkdf2:sha256:600000" on small boards
+HASH_METHOD  = os.getenv('AUTH_HASH_METHOD', 'scrypt:32768:8:1')
+HASH_WORKERS = int(os.getenv('AUTH_HASH_WORKERS', '2'))
+HASH_QUEUE   = int(os.getenv('AUTH_HASH_QUEUE', '16'))
+HASH_TIMEOUT = float(os.getenv('AUTH_HASH_TIMEOUT', '10'))
+
+MAX_FAILED_PER_USER = int(os.getenv('AUTH_MAX_FAILED_LOGINS', '5'))
+MAX_FAILED_PER_IP   = int(os.getenv('AUTH_MAX_FAILED_LOGINS_PER_IP', '20'))
+MAX_FAILED_PER_ACCOUNT = int(os.getenv('AUTH_MAX_FAILED_LOGINS_PER_ACCOUNT', '50'))
+FAILED_WINDOW       = float(os.getenv('AUTH_FAILED_LOGIN_WINDOW', '300'))
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full or a hash took too long."""
+
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='pwhash')
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+
+
+def _run_bounded(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy('Password hashing queue is full.')
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _f: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeout:
+        raise HashingBusy('Password hashing timed out.')
+
+
+def _method_prefix(pw_hash):
+    return pw_hash.split('$', 1)[0]
+
+
+# werkzeug fills in default cost parameters, so derive the canonical prefix once
+_CURRENT_PREFIX = _method_prefix(generate_password_hash('', method=HASH_METHOD, salt_length=1))
+
+
+def hash_password(password):
+    return _run_bounded(generate_password_hash, password, HASH_METHOD)
+
+
+def verify_password(pw_hash, password):
+    return _run_bounded(check_password_hash, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """True if pw_hash was made with a different method or cost than HASH_METHOD."""
+    return _method_prefix(pw_hash) != _CURRENT_PREFIX
+
+
+class LoginThrottle:
+    """Sliding-window counter of failed logins keyed by IP, by (username, IP) and by username."""
+
+    def __init__(self, max_per_user=MAX_FAILED_PER_USER, max_per_ip=MAX_FAILED_PER_IP,
+                 max_per_account=MAX_FAILED_PER_ACCOUNT, window=FAILED_WINDOW):
+        self.limits = {'user': max_per_user, 'ip': max_per_ip, 'account': max_per_account}
+        self.window = window
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _trim(self, key, now):
+        q = self._failures.get(key)
+        while q and now - q[0] > self.window:
+            q.popleft()
+        if q is not None and not q:
+            del self._failures[key]
+            return None
+        return q
+
+    def _sweep(self, now):
+        # drop idle keys so the table doesn't grow without bound
+        if now - self._last_sweep < self.window:
+            return
+        for key in list(self._failures):
+            self._trim(key, now)
+        self._last_sweep = now
+
+    @staticmethod
+    def _keys(ip, username):
+        # the per-user key includes the IP: failures from one address never lock the account elsewhere;
+        # the account key, with its higher limit, is for guessing spread over many addresses
+        return ('ip', ip), ('user', username.lower(), ip), ('account', username.lower())
+
+    def retry_after(self, ip, username):
+        """Seconds until another attempt is allowed, or 0 if allowed now."""
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            self._sweep(now)
+            for key in self._keys(ip, username):
+                q = self._trim(key, now)
+                if q and len(q) >= self.limits[key[0]]:
+                    wait = max(wait, self.window - (now - q[0]))
+        return wait
+
+    def record_failure(self, ip, username):
+        now = time.monotonic()
+        with self._lock:
+            for key in self._keys(ip, username):
+                self._failures.setdefault(key, deque()).append(now)
+
+    def reset(self, ip, username):
+        # only this address's count: one good login mustn't clear a distributed attempt
+        with self._lock:
+            self._failures.pop(self._keys(ip, username)[1], None)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+batch_diagnosis.py
+
+Deferred diagnosis through the OpenAI Batch API, for work that doesn't
+need a result right away (overnight re-scoring, historic backfills).
+Batched requests are cheaper and don't count against the synchronous
+rate limits, at the cost of results arriving within the completion
+window instead of seconds.
+
+    # queue frames: geocode, care JSON, masking and encoding happen now
+    python src/batch_diagnosis.py enqueue pi_input_http/*.jpg --species oak --zip 06870
+    # upload everything pending as one or more batches
+    python src/batch_diagnosis.py submit
+    # write finished batches into finalSuggestions + history
+    python src/batch_diagnosis.py poll [--wait]
+    # submit, then poll until every batch is done
+    python src/batch_diagnosis.py run
+    python src/batch_diagnosis.py status
+
+pipeline.py --defer queues a single image the same way.
+
+Everything lives under DATA_DIR/batch:
+    pending.jsonl              request lines, exactly as uploaded
+    pending.index.jsonl        custom_id → species, image, captured_at, attempts
+    submitted/<batch_id>.jsonl uploaded input, kept until its results are in
+    batches.json               submitted batches and their index
+
+Results go through pipeline.record_diagnosis, so a backfilled frame never
+replaces a diagnosis of a newer one in finalSuggestions. Requests that
+failed with a 429/5xx, or weren't reached before the batch expired, are
+re-queued up to BATCH_MAX_ATTEMPTS times.
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import os
+import json
+import time
+import uuid
+import logging
+import datetime
+import argparse
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: the spool is used without locking
+    fcntl = None
+
+from src.pipeline import (
+    DATA_DIR, client, prepare_inputs, build_diagnosis_request, parse_diagnosis_content,
+    check_leaf_color_match, record_diagnosis, captured_at_of
+)
+from src.prompts import record_usage
+from src import budget
+from src.instrumentation import (
+    API_CALLS, API_ERRORS, counter, configure_logging, log_event, persist_metrics_on_exit,
+    set_correlation_id, span
+)
+
+BATCH_DIR     = DATA_DIR / "batch"
+PENDING       = BATCH_DIR / "pending.jsonl"
+PENDING_INDEX = BATCH_DIR / "pending.index.jsonl"
+SUBMITTED_DIR = BATCH_DIR / "submitted"
+STATE_FILE    = BATCH_DIR / "batches.json"
+
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = os.getenv("BATCH_COMPLETION_WINDOW", "24h")
+# Provider limits are 50,000 requests / 200 MB per input file; stay under them
+MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "50000"))
+MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(190 * 1024 * 1024)))
+MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "3"))
+POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "60"))
+BATCH_TOKENS_PER_REQUEST = 2000  # budget estimate: prompt + image tiles + max_tokens
+
+TERMINAL = {"completed", "failed", "expired", "cancelled"}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+log = logging.getLogger("batch_diagnosis")
+BATCH_REQUESTS = counter("ff_batch_requests_total", "Deferred diagnosis requests by outcome.")
+
+
+# ——— Spool ———
+
+@contextlib.contextmanager
+def _spool_lock():
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    with open(BATCH_DIR / "spool.lock", "a") as fh:
+        if fcntl:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _read_jsonl(path: Path) -> list:
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _append_pending(lines: list, index: list):
+    with open(PENDING, "a") as f:
+        f.writelines(line if line.endswith("\n") else line + "\n" for line in lines)
+    with open(PENDING_INDEX, "a") as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in index)
+
+
+def _load_state() -> dict:
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_state(state: dict):
+    tmp = STATE_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    os.replace(tmp, STATE_FILE)
+
+
+def enqueue(image_path: Path, species: str, zip_code: str):
+    """
+    Prepares the diagnosis request for one image and appends it to the
+    pending batch file. Returns its custom_id, or None if preparation failed
+    (including when there is no care JSON and no budget to generate one).
+    """
+    image_path = Path(image_path)
+    prepared = prepare_inputs(image_path, species, zip_code)
+    if prepared is None or prepared[1] is None:
+        return None
+    data_urls, recommendations = prepared
+
+    custom_id = f"{species}-{image_path.stem}-{uuid.uuid4().hex[:8]}"
+    # a backfilled frame is diagnosed as of when it was taken
+    taken = datetime.datetime.utcfromtimestamp(image_path.stat().st_mtime)
+    line = json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT,
+                       "body": build_diagnosis_request(data_urls, recommendations, when=taken)})
+    entry = {"custom_id": custom_id, "species": species, "image": str(image_path),
+             "captured_at": captured_at_of(image_path), "attempts": 0}
+    with _spool_lock():
+        _append_pending([line], [entry])
+    BATCH_REQUESTS.inc(outcome="queued")
+    log_event("batch_enqueued", custom_id=custom_id, species=species, image=image_path.name)
+    return custom_id
+
+
+def _chunks(lines: list):
+    """Splits request lines into groups that fit one batch input file."""
+    chunk, size = [], 0
+    for line in lines:
+        n = len(line.encode()) + 1
+        if chunk and (len(chunk) >= MAX_REQUESTS or size + n > MAX_BYTES):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(line)
+        size += n
+    if chunk:
+        yield chunk
+
+
+# ——— Submit ———
+
+def submit() -> list:
+    """Uploads everything pending as batches. Returns the new batch IDs."""
+    with _spool_lock():
+        if not PENDING.exists():
+            return []
+        with open(PENDING) as f:
+            lines = [line.rstrip("\n") for line in f if line.strip()]
+        index = {e["custom_id"]: e for e in _read_jsonl(PENDING_INDEX)}
+        PENDING.unlink()
+        PENDING_INDEX.unlink(missing_ok=True)
+
+    SUBMITTED_DIR.mkdir(parents=True, exist_ok=True)
+    batch_ids = []
+    for chunk in _chunks(lines):
+        chunk_ids = [json.loads(line)["custom_id"] for line in chunk]
+        chunk_index = {cid: index.get(cid, {"custom_id": cid}) for cid in chunk_ids}
+        # backfill priority: stops at its share of the budget, leaving the rest pending
+        allowed = 0
+        for _ in chunk:
+            try:
+                budget.acquire("openai", priority="backfill", tokens=BATCH_TOKENS_PER_REQUEST)
+            except budget.BudgetExceeded as e:
+                log.warning("%s; keeping %d requests pending", e, len(chunk) - allowed)
+                with _spool_lock():
+                    _append_pending(chunk[allowed:], [chunk_index[cid] for cid in chunk_ids[allowed:]])
+                break
+            allowed += 1
+        if not allowed:
+            continue
+        chunk = chunk[:allowed]
+        chunk_index = {cid: chunk_index[cid] for cid in chunk_ids[:allowed]}
+        input_path = SUBMITTED_DIR / f"upload-{uuid.uuid4().hex[:8]}.jsonl"
+        input_path.write_text("\n".join(chunk) + "\n")
+
+        API_CALLS.inc(api="openai_batch")
+        try:
+            with span("batch_submit", requests=len(chunk)):
+                with open(input_path, "rb") as f:
+                    uploaded = client.files.create(file=f, purpose="batch")
+                batch = client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT,
+                                              completion_window=COMPLETION_WINDOW)
+        except Exception as e:
+            API_ERRORS.inc(api="openai_batch")
+            log.error("Batch submission failed, keeping %d requests pending: %s", len(chunk), e)
+            with _spool_lock():
+                _append_pending(chunk, chunk_index.values())
+            input_path.unlink(missing_ok=True)
+            continue
+
+        os.replace(input_path, SUBMITTED_DIR / f"{batch.id}.jsonl")
+        with _spool_lock():
+            state = _load_state()
+            state[batch.id] = {"status": batch.status, "input_file_id": uploaded.id,
+                               "submitted_at": int(time.time()), "index": chunk_index}
+            _save_state(state)
+        BATCH_REQUESTS.inc(len(chunk), outcome="submitted")
+        log_event("batch_submitted", batch_id=batch.id, requests=len(chunk))
+        batch_ids.append(batch.id)
+    return batch_ids
+
+
+# ——— Poll & apply ———
+
+def _file_lines(file_id) -> list:
+    if not file_id:
+        return []
+    API_CALLS.inc(api="openai_batch")
+    try:
+        text = client.files.content(file_id).text
+    except Exception:
+        API_ERRORS.inc(api="openai_batch")
+        raise
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _apply_result(result: dict, meta: dict) -> str:
+    """Writes one batch output line back. Returns "ok", "retry" or "error"."""
+    response = result.get("response") or {}
+    status = response.get("status_code")
+    if status != 200:
+        log.warning("Batch request %s failed (%s): %s", result.get("custom_id"), status,
+                    result.get("error") or response.get("body"))
+        return "retry" if status in RETRYABLE_STATUS else "error"
+    record_usage(response.get("body", {}).get("usage"), kind="diagnosis_batch")
+    try:
+        content = response["body"]["choices"][0]["message"]["content"]
+        diagnosis = parse_diagnosis_content(content)
+    except (KeyError, IndexError, TypeError, RuntimeError) as e:
+        log.warning("Unusable batch result for %s: %s", result.get("custom_id"), e)
+        return "error"
+    check_leaf_color_match(diagnosis)
+    record_diagnosis(meta["species"], diagnosis, meta.get("image"),
+                     meta.get("captured_at"), mode="batch")
+    return "ok"
+
+
+def _finish(batch_id: str, record: dict, batch) -> dict:
+    """Applies a terminal batch's results and re-queues what's retryable."""
+    index = record["index"]
+    outcomes = {"ok": 0, "error": 0, "retry": 0}
+    seen = set()
+    for result in _file_lines(batch.output_file_id) + _file_lines(batch.error_file_id):
+        cid = result.get("custom_id")
+        if cid not in index or cid in seen:
+            continue
+        seen.add(cid)
+        outcome = _apply_result(result, index[cid])
+        outcomes[outcome] += 1
+        if outcome == "retry":
+            seen.discard(cid)
+
+    # requests without a usable answer: retry ones that may succeed next time
+    input_path = SUBMITTED_DIR / f"{batch_id}.jsonl"
+    retry_lines, retry_index = [], []
+    if batch.status != "failed" and input_path.exists():
+        with open(input_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                cid = json.loads(line)["custom_id"]
+                if cid in seen:
+                    continue
+                meta = dict(index.get(cid, {"custom_id": cid}))
+                meta["attempts"] = meta.get("attempts", 0) + 1
+                if meta["attempts"] < MAX_ATTEMPTS:
+                    retry_lines.append(line)
+                    retry_index.append(meta)
+                else:
+                    outcomes["error"] += 1
+    if retry_lines:
+        with _spool_lock():
+            _append_pending(retry_lines, retry_index)
+    outcomes["requeued"] = len(retry_lines)
+
+    for outcome, n in outcomes.items():
+        if n:
+            BATCH_REQUESTS.inc(n, outcome=outcome)
+    if batch.status == "failed":
+        log.error("Batch %s failed: %s", batch_id, getattr(batch, "errors", None))
+    else:
+        input_path.unlink(missing_ok=True)
+    log_event("batch_finished", batch_id=batch_id, status=batch.status, **outcomes)
+    return outcomes
+
+
+def poll(wait: bool = False, interval: float = POLL_SECONDS) -> dict:
+    """
+    Checks every open batch once (or until all are terminal with wait=True)
+    and applies finished ones. Returns {batch_id: status}.
+    """
+    while True:
+        with _spool_lock():
+            state = _load_state()
+        open_ids = [bid for bid, rec in state.items() if rec["status"] not in TERMINAL]
+        for batch_id in open_ids:
+            API_CALLS.inc(api="openai_batch")
+            try:
+                batch = client.batches.retrieve(batch_id)
+            except Exception as e:
+                API_ERRORS.inc(api="openai_batch")
+                log.warning("Could not check batch %s: %s", batch_id, e)
+                continue
+            record = state[batch_id]
+            if batch.status in TERMINAL:
+                with span("batch_apply", batch_id=batch_id):
+                    record["outcomes"] = _finish(batch_id, record, batch)
+            record["status"] = batch.status
+            with _spool_lock():
+                current = _load_state()
+                current[batch_id] = record
+                _save_state(current)
+            state[batch_id] = record
+
+        statuses = {bid: rec["status"] for bid, rec in state.items()}
+        if not wait or all(s in TERMINAL for s in statuses.values()):
+            return statuses
+        time.sleep(interval)
+
+
+def status() -> dict:
+    with _spool_lock():
+        state = _load_state()
+        pending = len(_read_jsonl(PENDING_INDEX))
+    return {"pending": pending,
+            "batches": {bid: {k: v for k, v in rec.items() if k != "index"} | {"requests": len(rec["index"])}
+                        for bid, rec in state.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deferred (batch) tree health diagnosis.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_enq = sub.add_parser("enqueue", help="Queue images for the next batch")
+    p_enq.add_argument("images", nargs="+", help="JPEG images to diagnose")
+    p_enq.add_argument("--species", required=True)
+    p_enq.add_argument("--zip", required=True)
+    sub.add_parser("submit", help="Upload pending requests as batches")
+    p_poll = sub.add_parser("poll", help="Apply finished batches")
+    p_poll.add_argument("--wait", action="store_true", help="Keep polling until all batches finish")
+    p_poll.add_argument("--interval", type=float, default=POLL_SECONDS)
+    p_run = sub.add_parser("run", help="Submit, then poll until done")
+    p_run.add_argument("--interval", type=float, default=POLL_SECONDS)
+    sub.add_parser("status", help="Show pending requests and batches")
+    args = parser.parse_args()
+
+    configure_logging("batch_diagnosis")
+    set_correlation_id()
+    persist_metrics_on_exit()
+
+    if args.command == "enqueue":
+        species = args.species.strip().lower()
+        queued = [enqueue(Path(p), species, args.zip.strip()) for p in args.images]
+        print(json.dumps({"queued": sum(1 for c in queued if c), "failed": sum(1 for c in queued if not c)}))
+    elif args.command == "submit":
+        print(json.dumps({"submitted": submit()}))
+    elif args.command == "poll":
+        print(json.dumps(poll(wait=args.wait, interval=args.interval)))
+    elif args.command == "run":
+        submit()
+        print(json.dumps(poll(wait=True, interval=args.interval)))
+    else:
+        print(json.dumps(status(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+budget.py
+
+Spend and quota governor for the external APIs (GPT-4o, YouTube Data API,
+OpenWeatherMap, Nominatim). Every call site asks for a grant first:
+
+    grant = budget.acquire("openai", camera="oak", priority="scheduled", tokens=1200)
+    resp = client.chat.completions.create(...)
+    grant.settle(resp.usage.total_tokens)
+
+acquire() raises BudgetExceeded instead of letting the call through once
+a limit would be crossed. pipeline.py then scores the frame locally
+(local_diagnosis), chat_api.py answers 429 with Retry-After, and the
+batch path leaves requests pending.
+
+  • Limits are calls or tokens per rolling second/minute/hour/day, globally or
+    per camera, so one camera stuck in an upload loop exhausts only its
+    own allowance. Each can be overridden by env, e.g.
+    BUDGET_OPENAI_CALLS_PER_DAY or BUDGET_OPENAI_CAMERA_CALLS_PER_HOUR
+    (0 disables that limit).
+  • Priority classes share each limit: interactive (chat) may use all of
+    it, scheduled diagnoses BUDGET_SHARE_SCHEDULED (0.9), backfill
+    BUDGET_SHARE_BACKFILL (0.6). Lower classes run out first and leave
+    headroom for the ones above.
+  • Usage lives in DATA_DIR/budget.db (SQLite), shared by every process
+    and kept across restarts. ff_budget_remaining shows what is left.
+
+    python src/budget.py            # remaining budget per limit
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import os
+import json
+import math
+import time
+import sqlite3
+import logging
+import contextlib
+from functools import lru_cache
+from dataclasses import dataclass
+
+from src.instrumentation import counter, gauge, log_event
+
+DATA_DIR = Path(os.getenv("FF_DATA_DIR", Path(__file__).resolve().parent.parent / "static" / "data"))
+BUDGET_DB = DATA_DIR / "budget.db"
+CAMERA_ENV = "FF_CAMERA_ID"
+PRIORITY_ENV = "FF_PRIORITY"
+
+PRIORITIES = ("interactive", "scheduled", "backfill")
+SHARES = {
+    "interactive": 1.0,
+    "scheduled": float(os.getenv("BUDGET_SHARE_SCHEDULED", "0.9")),
+    "backfill": float(os.getenv("BUDGET_SHARE_BACKFILL", "0.6")),
+}
+WINDOWS = {1: "SECOND", 60: "MINUTE", 3600: "HOUR", 86400: "DAY"}
+
+REMAINING = gauge("ff_budget_remaining", "Calls/tokens left in each rolling budget window.")
+DENIED = counter("ff_budget_denied_total", "API calls refused by the budget governor.")
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, api: str, limit: "Limit", camera: str = None, retry_after: float = 0):
+        self.api, self.limit, self.camera = api, limit, camera
+        self.retry_after = max(1, int(retry_after))
+        scope = f"camera {camera}" if limit.per_camera else "global"
+        super().__init__(f"{api} {limit.metric} budget exhausted ({scope}, "
+                         f"{limit.limit} per {WINDOWS[limit.window].lower()}); retry in {self.retry_after}s")
+
+
+@dataclass
+class Limit:
+    api: str
+    metric: str          # "calls" or "tokens"
+    window: int          # seconds: 1, 60, 3600 or 86400
+    limit: int
+    per_camera: bool = False
+
+    @property
+    def env_name(self) -> str:
+        scope = "CAMERA_" if self.per_camera else ""
+        return f"BUDGET_{self.api.upper()}_{scope}{self.metric.upper()}_PER_{WINDOWS[self.window]}"
+
+    def labels(self, camera: str = None) -> dict:
+        return {"api": self.api, "metric": self.metric, "window": WINDOWS[self.window].lower(),
+                "scope": camera if self.per_camera else "global"}
+
+
+DEFAULT_LIMITS = [
+    Limit("openai", "calls", 86400, 2000),
+    Limit("openai", "tokens", 86400, 3_000_000),
+    Limit("openai", "calls", 3600, 12, per_camera=True),       # a frame every 5 min
+    Limit("openai", "tokens", 86400, 300_000, per_camera=True),
+    Limit("youtube", "calls", 86400, 90),                       # search.list costs 100 of 10,000 units/day
+    Limit("openweathermap", "calls", 86400, 900),
+    Limit("openweathermap", "calls", 60, 55),
+    Limit("nominatim", "calls", 1, 1),                          # usage policy: at most 1 request/s
+]
+
+
+def limits_from_env(defaults=DEFAULT_LIMITS) -> list:
+    return [Limit(d.api, d.metric, d.window, int(os.getenv(d.env_name, d.limit)), d.per_camera)
+            for d in defaults]
+
+
+def context() -> dict:
+    """Camera and priority of the current process, as set by the pipeline worker."""
+    priority = os.getenv(PRIORITY_ENV, "scheduled")
+    return {"camera": os.getenv(CAMERA_ENV) or None,
+            "priority": priority if priority in PRIORITIES else "scheduled"}
+
+
+@dataclass
+class Grant:
+    governor: "BudgetGovernor"
+    id: int
+    api: str
+
+    def settle(self, tokens):
+        """Replaces the token estimate with what the call actually used."""
+        if self.id is not None and tokens is not None:
+            self.governor.settle(self, int(tokens))
+
+
+class BudgetGovernor:
+    def __init__(self, limits: list = None, path: Path = BUDGET_DB, enabled: bool = None):
+        self.limits = [l for l in (limits if limits is not None else limits_from_env()) if l.limit > 0]
+        self.enabled = enabled if enabled is not None else os.getenv("BUDGET_ENABLED", "1") != "0"
+        self.path = Path(path)
+        self._pruned_at = 0
+        if self.enabled:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = self._connect()
+            try:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript("""
+                    CREATE TABLE IF NOT EXISTS usage (
+                        id       INTEGER PRIMARY KEY,
+                        ts       REAL NOT NULL,
+                        api      TEXT NOT NULL,
+                        camera   TEXT,
+                        priority TEXT NOT NULL,
+                        calls    INTEGER NOT NULL,
+                        tokens   INTEGER NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS usage_api_ts ON usage (api, ts);
+                    CREATE INDEX IF NOT EXISTS usage_camera_ts ON usage (api, camera, ts);
+                """)
+            finally:
+                db.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @contextlib.contextmanager
+    def _tx(self):
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")  # check-and-record is atomic across processes
+            try:
+                yield db
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        finally:
+            db.close()
+
+    def _used(self, db, limit: Limit, camera: str, now: float):
+        since = now - limit.window
+        where, args = "api = ? AND ts >= ?", [limit.api, since]
+        if limit.per_camera:
+            where, args = where + " AND camera = ?", args + [camera]
+        used, oldest = db.execute(f"SELECT COALESCE(SUM({limit.metric}), 0), MIN(ts) FROM usage WHERE {where}",
+                                  args).fetchone()
+        return used, oldest
+
+    def acquire(self, api: str, camera: str = None, priority: str = "scheduled",
+                tokens: int = 0, calls: int = 1) -> Grant:
+        """Records the call(s) against every matching limit, or raises BudgetExceeded."""
+        if not self.enabled:
+            return Grant(self, None, api)
+        now = time.time()
+        share = SHARES.get(priority, SHARES["scheduled"])
+        need = {"calls": calls, "tokens": tokens}
+        applicable = [l for l in self.limits if l.api == api and (camera or not l.per_camera)]
+        readings = []
+        with self._tx() as db:
+            for limit in applicable:
+                used, oldest = self._used(db, limit, camera, now)
+                readings.append((limit, used))
+                # whole calls: a 1/s limit still admits one scheduled call per second
+                if used + need[limit.metric] > math.ceil(limit.limit * share):
+                    retry_after = (oldest + limit.window - now) if oldest else limit.window
+                    DENIED.inc(api=api, priority=priority)
+                    log_event("budget_denied", level=logging.WARNING, api=api, camera=camera, priority=priority,
+                              metric=limit.metric, window=limit.window, used=used, limit=limit.limit)
+                    raise BudgetExceeded(api, limit, camera, retry_after)
+            cur = db.execute("INSERT INTO usage (ts, api, camera, priority, calls, tokens) VALUES (?, ?, ?, ?, ?, ?)",
+                             (now, api, camera, priority, calls, tokens))
+            grant_id = cur.lastrowid
+            if now - self._pruned_at > 600:
+                self._pruned_at = now
+                db.execute("DELETE FROM usage WHERE ts < ?", (now - max(WINDOWS) - 60,))
+        for limit, used in readings:
+            REMAINING.set(max(0, limit.limit - used - need[limit.metric]), **limit.labels(camera))
+        return Grant(self, grant_id, api)
+
+    def settle(self, grant: Grant, tokens: int):
+        with self._tx() as db:
+            db.execute("UPDATE usage SET tokens = ? WHERE id = ?", (tokens, grant.id))
+
+    def snapshot(self) -> list:
+        """Every limit with its current use: global ones, then each camera seen in the window."""
+        if not self.enabled:
+            return []
+        now = time.time()
+        out = []
+        db = self._connect()
+        try:
+            for limit in self.limits:
+                cameras = [None]
+                if limit.per_camera:
+                    cameras = [r[0] for r in db.execute(
+                        "SELECT DISTINCT camera FROM usage WHERE api = ? AND ts >= ? AND camera IS NOT NULL",
+                        (limit.api, now - limit.window))]
+                for camera in cameras:
+                    used, _ = self._used(db, limit, camera, now)
+                    remaining = max(0, limit.limit - used)
+                    REMAINING.set(remaining, **limit.labels(camera))
+                    out.append({**limit.labels(camera), "limit": limit.limit, "used": used,
+                                "remaining": remaining, "env": limit.env_name})
+        finally:
+            db.close()
+        return out
+
+
+@lru_cache(maxsize=1)
+def default_governor() -> BudgetGovernor:
+    return BudgetGovernor()
+
+
+def acquire(api: str, camera: str = None, priority: str = "scheduled", tokens: int = 0, calls: int = 1) -> Grant:
+    return default_governor().acquire(api, camera=camera, priority=priority, tokens=tokens, calls=calls)
+
+
+def main():
+    print(json.dumps(default_governor().snapshot(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+cadence.py
+
+Adaptive per-camera diagnosis cadence for server_http.py.
+
+Cameras upload every ~10 minutes, but a tree that has been "YES / 95%" for
+weeks doesn't need a GPT-4o diagnosis each time. The scheduler decides,
+per selected frame, whether it goes to the pipeline or is only archived
+(every frame stays in pi_input_http either way):
+
+  • Each new diagnosis (finalSuggestions/<species>Rec.json) updates the
+    camera's health history. Diagnoses are stored per species, so cameras
+    watching the same species follow the same health readings (their
+    drift and weather triggers stay per camera). A stable, healthy tree has its interval
+    multiplied by CADENCE_GROWTH, up to CADENCE_MAX_SECONDS. An unhealthy
+    or changing tree drops back to CADENCE_MIN_SECONDS.
+  • Between diagnoses, the frame's local metrics (mean leaf colour and
+    foliage coverage, from frame_select) are compared with the frame that
+    was last diagnosed. Drift past the thresholds diagnoses right away and
+    resets the interval.
+  • With OPENWEATHERMAP_API_KEY set, a sharp temperature or humidity change
+    since the last diagnosis does the same. Readings are cached per ZIP for
+    CADENCE_WEATHER_TTL.
+
+State survives restarts in DATA_DIR/cadence.json. The admin view is
+GET /api/admin/cadence on server_http.py.
+"""
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+from pathlib import Path
+from dataclasses import dataclass, asdict, field
+
+import requests
+
+from src import budget
+from src.instrumentation import API_CALLS, API_ERRORS, counter, gauge, log_event
+
+DATA_DIR = Path(os.getenv("FF_DATA_DIR", Path(__file__).resolve().parent.parent / "static" / "data"))
+STATE_FILE = DATA_DIR / "cadence.json"
+FINAL_DIR = DATA_DIR / "finalSuggestions"
+
+OPENWEATHERMAP_URL = os.getenv("OPENWEATHERMAP_URL", "http://api.openweathermap.org/data/2.5/weather")
+
+DECISIONS = counter("ff_cadence_decisions_total", "Selected frames by cadence decision and reason.")
+INTERVAL = gauge("ff_cadence_interval_seconds", "Current diagnosis interval per camera.")
+
+
+@dataclass
+class CadencePolicy:
+    enabled: bool = True
+    min_seconds: float = 600            # the Pis' upload rate: diagnose every frame
+    max_seconds: float = 6 * 3600
+    growth: float = 2.0                 # interval multiplier per stable diagnosis
+    stable_health: float = 85           # percentage at/above which a tree can be "stable"
+    stable_delta: float = 5             # max percentage swing across the window
+    stable_window: int = 3              # diagnoses that must agree
+    color_drift: float = 18             # RGB distance of mean leaf colour
+    coverage_drift: float = 0.08        # absolute change in foliage coverage
+    weather_temp_delta: float = 15      # °F
+    weather_humidity_delta: float = 30  # percentage points
+    weather_ttl: float = 1800
+
+    @classmethod
+    def from_env(cls) -> "CadencePolicy":
+        def num(name, default):
+            return float(os.getenv(name, default))
+        return cls(
+            enabled=os.getenv("CADENCE_ENABLED", "1") != "0",
+            min_seconds=num("CADENCE_MIN_SECONDS", cls.min_seconds),
+            max_seconds=num("CADENCE_MAX_SECONDS", cls.max_seconds),
+            growth=num("CADENCE_GROWTH", cls.growth),
+            stable_health=num("CADENCE_STABLE_HEALTH", cls.stable_health),
+            stable_delta=num("CADENCE_STABLE_DELTA", cls.stable_delta),
+            stable_window=int(num("CADENCE_STABLE_WINDOW", cls.stable_window)),
+            color_drift=num("CADENCE_COLOR_DRIFT", cls.color_drift),
+            coverage_drift=num("CADENCE_COVERAGE_DRIFT", cls.coverage_drift),
+            weather_temp_delta=num("CADENCE_WEATHER_TEMP_DELTA", cls.weather_temp_delta),
+            weather_humidity_delta=num("CADENCE_WEATHER_HUMIDITY_DELTA", cls.weather_humidity_delta),
+            weather_ttl=num("CADENCE_WEATHER_TTL", cls.weather_ttl),
+        )
+
+
+@dataclass
+class CameraCadence:
+    interval: float = 0
+    reason: str = "new camera"
+    last_diagnosed_at: float = 0        # when a frame was last sent for diagnosis
+    last_result_at: str = ""            # captured_at of the last diagnosis seen
+    health: list = field(default_factory=list)   # recent percentages, oldest first
+    healthy: str = ""
+    baseline: dict = None               # leaf_rgb/coverage of the last diagnosed frame
+    weather: dict = None                # reading at the last diagnosis
+    pinned: float = None                # admin override, seconds
+    species: str = None
+    diagnosed: int = 0
+    skipped: int = 0
+
+    def next_due(self) -> float:
+        return self.last_diagnosed_at + (self.pinned or self.interval)
+
+
+UNCHANGED = object()   # configure(): leave the pin as it is
+
+
+class CadenceScheduler:
+    def __init__(self, policy: CadencePolicy = None, state_file: Path = STATE_FILE):
+        self.policy = policy or CadencePolicy.from_env()
+        self.state_file = Path(state_file)
+        self._lock = threading.Lock()
+        self._weather = {}   # zip -> (fetched_at, reading)
+        self.cameras = self._load()
+
+    # ——— persistence ———
+
+    def _load(self) -> dict:
+        try:
+            with open(self.state_file) as f:
+                raw = json.load(f)
+            return {cid: CameraCadence(**data) for cid, data in raw.items()}
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return {}
+
+    def _save(self):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps({cid: asdict(c) for cid, c in self.cameras.items()}))
+        os.replace(tmp, self.state_file)
+
+    # ——— inputs ———
+
+    def _refresh_health(self, cam: CameraCadence):
+        """Folds in a new diagnosis from finalSuggestions and adapts the interval."""
+        if not cam.species:
+            return
+        try:
+            # pipeline.py writes the lowercased species; registry/metadata may capitalise it
+            with open(FINAL_DIR / f"{cam.species.strip().lower()}Rec.json") as f:
+                rec = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        captured = rec.get("captured_at") or rec.get("timestamp") or ""
+        if not captured or captured <= cam.last_result_at:
+            return
+        cam.last_result_at = captured
+        try:
+            cam.health = (cam.health + [float(rec.get("percentage"))])[-self.policy.stable_window:]
+        except (TypeError, ValueError):
+            pass
+        cam.healthy = str(rec.get("healthy", "")).upper()
+
+        p = self.policy
+        recent = cam.health
+        stable = (cam.healthy == "YES" and len(recent) >= p.stable_window
+                  and min(recent) >= p.stable_health and max(recent) - min(recent) <= p.stable_delta)
+        if stable:
+            cam.interval = min(p.max_seconds, max(cam.interval, p.min_seconds) * p.growth)
+            cam.reason = f"stable at {recent[-1]:.0f}%"
+        else:
+            cam.interval = p.min_seconds
+            if cam.healthy == "NO" or (recent and recent[-1] < p.stable_health):
+                cam.reason = "unhealthy"
+            elif len(recent) < p.stable_window:
+                cam.reason = "building history"
+            else:
+                cam.reason = "health changing"
+
+    def _drift(self, cam: CameraCadence, metrics: dict):
+        if not (cam.baseline and metrics):
+            return None
+        p = self.policy
+        old, new = cam.baseline.get("leaf_rgb"), metrics.get("leaf_rgb")
+        if old and new and math.dist(old, new) >= p.color_drift:
+            return f"leaf colour drift {math.dist(old, new):.0f}"
+        if abs(metrics.get("coverage", 0) - cam.baseline.get("coverage", 0)) >= p.coverage_drift:
+            return "foliage coverage drift"
+        return None
+
+    def _current_weather(self, zip_code):
+        key = os.getenv("OPENWEATHERMAP_API_KEY")
+        if not (key and zip_code):
+            return None
+        cached = self._weather.get(zip_code)
+        if cached and time.time() - cached[0] < self.policy.weather_ttl:
+            return cached[1]
+        try:
+            budget.acquire("openweathermap", priority="scheduled")
+            API_CALLS.inc(api="openweathermap")
+            resp = requests.get(OPENWEATHERMAP_URL, timeout=5,
+                                params={"zip": f"{zip_code},us", "appid": key, "units": "imperial"})
+            resp.raise_for_status()
+            main = resp.json()["main"]
+            reading = {"temp": float(main["temp"]), "humidity": float(main["humidity"])}
+        except Exception as e:
+            if not isinstance(e, budget.BudgetExceeded):
+                API_ERRORS.inc(api="openweathermap")
+            log_event("cadence_weather_failed", level=logging.WARNING, zip=zip_code, error=str(e))
+            reading = cached[1] if cached else None
+        self._weather[zip_code] = (time.time(), reading)
+        return reading
+
+    def _weather_change(self, cam: CameraCadence, reading):
+        if not (cam.weather and reading):
+            return None
+        p = self.policy
+        if abs(reading["temp"] - cam.weather["temp"]) >= p.weather_temp_delta:
+            return f"temperature change {reading['temp'] - cam.weather['temp']:+.0f}°F"
+        if abs(reading["humidity"] - cam.weather["humidity"]) >= p.weather_humidity_delta:
+            return f"humidity change {reading['humidity'] - cam.weather['humidity']:+.0f}%"
+        return None
+
+    # ——— decision ———
+
+    def should_diagnose(self, camera_id: str, meta: dict = None, metrics: dict = None, now: float = None) -> bool:
+        """
+        True if this camera's selected frame should go to the pipeline now.
+        Call once per frame that frame_select hands on.
+        """
+        meta = meta or {}
+        now = now or time.time()
+        if not self.policy.enabled:
+            DECISIONS.inc(decision="diagnose", reason="disabled")
+            return True
+
+        reading = self._current_weather(meta.get("zip"))
+        with self._lock:
+            cam = self.cameras.get(camera_id)
+            if cam is None:
+                cam = self.cameras[camera_id] = CameraCadence(interval=self.policy.min_seconds)
+            cam.species = meta.get("species") or cam.species
+            self._refresh_health(cam)
+
+            trigger = self._drift(cam, metrics) or self._weather_change(cam, reading)
+            if trigger and not cam.pinned:
+                cam.interval = self.policy.min_seconds
+                cam.reason = trigger
+            due = now >= cam.next_due()
+            diagnose = due or bool(trigger)
+            if diagnose:
+                cam.last_diagnosed_at = now
+                cam.diagnosed += 1
+                if metrics:
+                    cam.baseline = {"leaf_rgb": metrics.get("leaf_rgb"), "coverage": metrics.get("coverage")}
+                if reading:
+                    cam.weather = reading
+            else:
+                cam.skipped += 1
+            INTERVAL.set(cam.pinned or cam.interval, camera=camera_id)
+            self._save()
+
+        reason = trigger or ("due" if due else "not due")
+        DECISIONS.inc(decision="diagnose" if diagnose else "skip", reason=reason.split(" ")[0])
+        log_event("cadence_decision", camera=camera_id, diagnose=diagnose, reason=reason,
+                  interval_s=cam.pinned or cam.interval, correlation_id=meta.get("correlation_id"))
+        return diagnose
+
+    # ——— admin ———
+
+    def snapshot(self, now: float = None) -> list:
+        now = now or time.time()
+        with self._lock:
+            for cam in self.cameras.values():
+                self._refresh_health(cam)
+            return [{
+                "camera_id": cid,
+                "species": cam.species,
+                "interval_seconds": cam.pinned or cam.interval,
+                "pinned": cam.pinned is not None,
+                "reason": "pinned by admin" if cam.pinned else cam.reason,
+                "health": cam.health,
+                "healthy": cam.healthy,
+                "last_diagnosed_at": cam.last_diagnosed_at or None,
+                "next_due_in_seconds": max(0, round(cam.next_due() - now)),
+                "diagnosed": cam.diagnosed,
+                "skipped": cam.skipped,
+            } for cid, cam in sorted(self.cameras.items())]
+
+    def configure(self, camera_id: str, pinned=UNCHANGED, diagnose_next: bool = False):
+        """Pins a camera's interval (None = adaptive) and/or makes its next frame due."""
+        with self._lock:
+            cam = self.cameras.setdefault(camera_id, CameraCadence(interval=self.policy.min_seconds))
+            if pinned is not UNCHANGED:
+                cam.pinned = float(pinned) if pinned else None
+            if diagnose_next:
+                cam.last_diagnosed_at = 0
+            self._save()
+
+    def policy_dict(self) -> dict:
+        return asdict(self.policy)
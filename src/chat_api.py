@@ -9,12 +9,18 @@ Responds based on provided care + health JSON context, with optional best-practi
 - Logging for auditing.
 """
 import os
+import sys
 import json
 import logging
+from pathlib import Path
 from flask import Flask, request, jsonify, abort
 from flask_cors import CORS
 from openai import OpenAI
 from dotenv import load_dotenv
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.instrumentation import API_CALLS, API_ERRORS, configure_logging, register_metrics, span
+from src.prompts import chat_system_prompt, estimate_tokens, record_usage
+from src import budget
 
 # ——— Load environment & keys ———
 load_dotenv()
@@ -30,7 +36,8 @@ MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "512"))
 # ——— Initialize Flask + CORS + Logging ———
 app = Flask(__name__)
 CORS(app)
-logging.basicConfig(level=logging.INFO)
+configure_logging("chat_api")
+register_metrics(app, "chat_api")
 logger = logging.getLogger("chat_api")
 
 # ——— OpenAI client ———
@@ -66,18 +73,10 @@ def camera_chat(camera_id: str):
     health_json = {k: v for k, v in ctx.items() if k not in ("species", "recommendations", "care_recommendations")}
 
     species = ctx.get("species", camera_id)
-    care_str = json.dumps(care_json, indent=2)
-    health_str = json.dumps(health_json, indent=2)
 
-    # Construct system prompt with JSON and best-practice guidance
-    system_msg = (
-        f"You are a plant care assistant for a {species} tree.\n"
-        f"Use the JSON data provided below to inform your responses.\n"
-        f"You may also draw on standard {species} care practices (e.g., typical watering frequency) to supplement the data when needed.\n\n"
-        "Care recommendations (JSON):\n```json\n" + care_str + "\n```\n"
-        "Current health analysis (JSON):\n```json\n" + health_str + "\n```"
-        "Keep answers short and consise, but still accurate"
-    )
+    # Static guidance first, then species care, then the latest diagnosis,
+    # so the shared prefix stays identical across chats (prompt caching)
+    system_msg = chat_system_prompt(species, care_json, health_json)
 
     messages = [
         {"role": "system", "content": system_msg},
@@ -86,18 +85,32 @@ def camera_chat(camera_id: str):
 
     logger.info("Request [%s]: %s", camera_id, user_msg)
     try:
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=messages,
-            temperature=TEMPERATURE,
-            max_tokens=MAX_TOKENS,
-            top_p=1
-        )
+        # interactive: may use the whole budget that diagnoses leave headroom in
+        grant = budget.acquire("openai", priority="interactive",
+                               tokens=estimate_tokens(system_msg + user_msg) + MAX_TOKENS)
+    except budget.BudgetExceeded as e:
+        logger.warning("Chat refused [%s]: %s", camera_id, e)
+        resp = jsonify({"error": "The AI budget is used up for now. Please try again later."})
+        resp.headers["Retry-After"] = str(e.retry_after)
+        return resp, 429
+    API_CALLS.inc(api="openai")
+    try:
+        with span("chat_completion", camera=camera_id):
+            resp = client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+                top_p=1
+            )
+        record_usage(getattr(resp, "usage", None), kind="chat")
+        grant.settle(getattr(getattr(resp, "usage", None), "total_tokens", None))
         reply = resp.choices[0].message.content.strip()
         logger.info("Reply [%s]: %s", camera_id, reply)
         return jsonify({"reply": reply})
 
     except Exception:
+        API_ERRORS.inc(api="openai")
         logger.exception("OpenAI API error")
         return jsonify({"error": "AI service error. Please try later."}), 500
 
@@ -0,0 +1,184 @@
+"""
+color_names.py
+
+Human-readable names for hex colours, e.g. for the seasonal "Leaf color" /
+"Trunk color" palettes in the care JSON and the observed/expected leaf
+colours in each diagnosis.
+
+webcolors.hex_to_name only knows exact CSS3 values, so almost every real
+leaf colour came back unnamed. Here each colour gets the perceptually
+nearest name instead: the CSS3 names plus a horticultural set (sage, moss,
+russet, bark…) are converted to CIE Lab once, and lookups are one NumPy
+distance matrix per batch (colours × ~180 names). Both 5×4 palettes of a
+care JSON are named in one call in well under a millisecond.
+
+    name_color("#5a3d2b")                       → "bark brown"
+    name_palette({"Spring": ["#a4c639", ...]})  → {"Spring": ["yellowgreen", ...]}
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from webcolors import names as css_names, name_to_hex
+
+# Colours gardeners and arborists use for foliage and bark that CSS3 lacks
+HORTICULTURAL = {
+    "sage green": "#9caf88",
+    "moss green": "#8a9a5b",
+    "fern green": "#4f7942",
+    "hunter green": "#355e3b",
+    "pine green": "#01796f",
+    "myrtle green": "#21421e",
+    "bottle green": "#006a4e",
+    "juniper": "#6d9292",
+    "emerald": "#50c878",
+    "jade": "#00a86b",
+    "avocado": "#568203",
+    "pistachio": "#93c572",
+    "apple green": "#8db600",
+    "pea green": "#8eab12",
+    "celadon": "#ace1af",
+    "lichen": "#b5c3a0",
+    "chlorotic yellow": "#d6d36b",
+    "straw": "#e4d96f",
+    "buff": "#f0dc82",
+    "mustard": "#ffdb58",
+    "amber": "#ffbf00",
+    "ochre": "#cc7722",
+    "pumpkin": "#ff7518",
+    "burnt orange": "#cc5500",
+    "copper": "#b87333",
+    "bronze": "#cd7f32",
+    "rust": "#b7410e",
+    "russet": "#80461b",
+    "mahogany": "#c04000",
+    "scarlet": "#ff2400",
+    "claret": "#7f1734",
+    "burgundy": "#800020",
+    "wine": "#722f37",
+    "chestnut": "#954535",
+    "sepia": "#704214",
+    "walnut": "#5d432c",
+    "bark brown": "#5c4033",
+    "raw umber": "#826644",
+    "umber": "#635147",
+    "taupe": "#483c32",
+    "charcoal": "#36454f",
+    "ash grey": "#b2beb5",
+    "birch white": "#e8e4d8",
+}
+
+
+def _srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """(N, 3) sRGB in 0..255 → (N, 3) CIE Lab (D65)."""
+    c = rgb / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124564, 0.2126729, 0.0193339],
+                        [0.3575761, 0.7151522, 0.1191920],
+                        [0.1804375, 0.0721750, 0.9503041]])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+def _hex_to_rgb(hexes) -> np.ndarray:
+    """(N, 3) float array; rows for unparseable values are NaN."""
+    out = np.full((len(hexes), 3), np.nan)
+    for i, h in enumerate(hexes):
+        s = str(h).strip().lstrip("#") if h is not None else ""
+        if len(s) == 3:
+            s = "".join(ch * 2 for ch in s)
+        if len(s) == 6:
+            try:
+                out[i] = [int(s[j:j + 2], 16) for j in (0, 2, 4)]
+            except ValueError:
+                pass
+    return out
+
+
+@lru_cache(maxsize=1)
+def _index():
+    """(names, Lab array) for CSS3 + HORTICULTURAL, built once per process."""
+    table = {}
+    for name in css_names("css3"):
+        hex_value = name_to_hex(name, spec="css3")
+        # one name per value: gray/grey, aqua/cyan, fuchsia/magenta
+        if hex_value not in table.values():
+            table[name] = hex_value
+    table.update(HORTICULTURAL)
+    names = list(table)
+    return names, _srgb_to_lab(_hex_to_rgb([table[n] for n in names]))
+
+
+def nearest(hexes) -> list:
+    """
+    [(name, ΔE76)] for each hex colour, in order; (None, None) for values
+    that aren't #RGB/#RRGGBB. One vectorised pass for the whole list.
+    """
+    hexes = list(hexes)
+    if not hexes:
+        return []
+    names, lab_index = _index()
+    rgb = _hex_to_rgb(hexes)
+    valid = ~np.isnan(rgb).any(axis=1)
+    out = [(None, None)] * len(hexes)
+    if valid.any():
+        lab = _srgb_to_lab(rgb[valid])
+        d2 = ((lab[:, None, :] - lab_index[None, :, :]) ** 2).sum(axis=2)
+        best = d2.argmin(axis=1)
+        dist = np.sqrt(d2[np.arange(len(best)), best])
+        for i, b, d in zip(np.flatnonzero(valid), best, dist):
+            out[i] = (names[b], round(float(d), 1))
+    return out
+
+
+def name_color(hex_color) -> str:
+    """Nearest name for one hex colour, or None if it isn't one."""
+    return nearest([hex_color])[0][0]
+
+
+def palette_mask(rgb: np.ndarray, palette, max_delta_e: float) -> np.ndarray:
+    """
+    Boolean mask over an (..., 3) sRGB pixel array: True where the pixel is
+    within max_delta_e (ΔE76) of any palette colour. Unusable palette entries
+    are ignored; an empty palette matches nothing.
+    """
+    shape = rgb.shape[:-1]
+    colours = _hex_to_rgb(list(palette))
+    colours = colours[~np.isnan(colours).any(axis=1)]
+    if not len(colours):
+        return np.zeros(shape, dtype=bool)
+    lab = _srgb_to_lab(rgb.reshape(-1, 3).astype(np.float64))
+    ref = _srgb_to_lab(colours)
+    d2 = ((lab[:, None, :] - ref[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+    return (d2 <= max_delta_e ** 2).reshape(shape)
+
+
+def name_palette(palette):
+    """
+    Same structure as the palette (dicts/lists of hex strings, any nesting),
+    with each hex replaced by its nearest name, named in one batched call.
+    """
+    flat = []
+
+    def collect(node):
+        if isinstance(node, dict):
+            for v in node.values():
+                collect(v)
+        elif isinstance(node, (list, tuple)):
+            for v in node:
+                collect(v)
+        else:
+            flat.append(node)
+
+    collect(palette)
+    named = iter(name for name, _ in nearest(flat))
+
+    def rebuild(node):
+        if isinstance(node, dict):
+            return {k: rebuild(v) for k, v in node.items()}
+        if isinstance(node, (list, tuple)):
+            return [rebuild(v) for v in node]
+        return next(named)
+
+    return rebuild(palette)
@@ -0,0 +1,187 @@
+"""
+foliage.py
+
+Shared foliage helpers that don't need API keys, so they can run in the
+upload server as well as in the pipeline.
+"""
+
+import os
+import math
+
+import numpy as np
+from PIL import Image
+
+# Vision-model tiling (OpenAI "high" detail): the image is fit inside
+# 2048x2048, its short side is scaled down to 768, then billed per 512px tile.
+TILE_SIZE = 512
+MAX_SIDE = 2048
+SHORT_SIDE = 768
+
+ROI_PADDING = float(os.getenv("ROI_PADDING", "0.06"))            # fraction of the box size
+ROI_MIN_FRACTION = float(os.getenv("ROI_MIN_FRACTION", "0.02"))  # row/col leaf share to count
+ROI_MAX_REGIONS = int(os.getenv("ROI_MAX_REGIONS", "3"))
+ROI_MIN_GAP = float(os.getenv("ROI_MIN_GAP", "0.08"))            # gap (fraction of width) between canopies
+
+
+def leaf_mask(img_rgb: Image.Image) -> np.ndarray:
+    """
+    Boolean HxW mask of "green foliage" pixels, from the image's HSV values.
+    """
+    hsv_arr = np.asarray(img_rgb.convert("HSV")).astype(np.int16)
+
+    H = hsv_arr[:, :, 0]  # 0–255
+    S = hsv_arr[:, :, 1]
+    V = hsv_arr[:, :, 2]
+
+    # Broad "green" band: 30 < H < 140
+    hue_mask = (H > 30) & (H < 140)
+    sat_mask = (S > 20)   # somewhat saturated
+    val_mask = (V > 20)   # not too dark
+
+    return hue_mask & sat_mask & val_mask
+
+
+def load_preview(image_path, max_side: int = 512) -> Image.Image:
+    """Opens an image reduced to about max_side pixels (JPEG draft mode decodes at low res directly)."""
+    img = Image.open(image_path)
+    img.draft("RGB", (max_side, max_side))
+    img = img.convert("RGB")
+    img.thumbnail((max_side, max_side))
+    return img
+
+
+def frame_metrics(img_rgb: Image.Image) -> dict:
+    """
+    Cheap local quality/colour metrics for one frame:
+      sharpness – variance of the Laplacian of the luma channel
+      exposure  – 0..1, 1 when mean luma is mid-grey and nothing clips
+      coverage  – fraction of pixels in the leaf mask
+      leaf_rgb  – mean colour of the leaf pixels (None if there are none)
+    """
+    arr = np.asarray(img_rgb, dtype=np.float32)
+    luma = arr[..., 0] * 0.299 + arr[..., 1] * 0.587 + arr[..., 2] * 0.114
+
+    lap = (luma[:-2, 1:-1] + luma[2:, 1:-1] + luma[1:-1, :-2] + luma[1:-1, 2:]
+           - 4 * luma[1:-1, 1:-1])
+    sharpness = float(lap.var()) if lap.size else 0.0
+
+    mean = float(luma.mean()) / 255
+    clipped = float(((luma < 5) | (luma > 250)).mean())
+    exposure = max(0.0, 1 - abs(mean - 0.5) * 2) * (1 - clipped)
+
+    mask = leaf_mask(img_rgb)
+    coverage = float(mask.mean())
+    leaf_rgb = [round(float(c), 1) for c in arr[mask].mean(axis=0)] if mask.any() else None
+
+    return {"sharpness": sharpness, "exposure": exposure, "coverage": coverage, "leaf_rgb": leaf_rgb}
+
+
+def _model_scale(width: float, height: float) -> float:
+    scale = min(1.0, MAX_SIDE / max(width, height))
+    return scale * min(1.0, SHORT_SIDE / (min(width, height) * scale))
+
+
+def vision_tiles(width: int, height: int) -> int:
+    """Number of 512px tiles the vision model bills for a width x height image."""
+    if width <= 0 or height <= 0:
+        return 0
+    scale = _model_scale(width, height)
+    return math.ceil(width * scale / TILE_SIZE) * math.ceil(height * scale / TILE_SIZE)
+
+
+def _runs(on: np.ndarray, min_gap: int):
+    """(start, stop) index runs of True values, merging runs separated by < min_gap."""
+    idx = np.flatnonzero(on)
+    if idx.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(idx) >= max(min_gap, 1))
+    starts = np.concatenate(([idx[0]], idx[breaks + 1]))
+    stops = np.concatenate((idx[breaks], [idx[-1]])) + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def _pad(box, width: int, height: int, padding: float):
+    x0, y0, x1, y1 = box
+    px, py = int((x1 - x0) * padding), int((y1 - y0) * padding)
+    return max(0, x0 - px), max(0, y0 - py), min(width, x1 + px), min(height, y1 + py)
+
+
+def _grow(lo: int, hi: int, new_len: int, limit: int):
+    """Widens [lo, hi) to new_len around its centre, shifted to stay inside [0, limit)."""
+    new_len = min(new_len, limit)
+    lo = max(0, min(lo - (new_len - (hi - lo)) // 2, limit - new_len))
+    return lo, lo + new_len
+
+
+def snap_to_tiles(box, width: int, height: int):
+    """
+    Expands box to fill the tiles it already pays for, so the crop keeps as
+    much context as possible without costing an extra tile.
+    """
+    x0, y0, x1, y1 = box
+    bw, bh = x1 - x0, y1 - y0
+    tiles = vision_tiles(bw, bh)
+    scale = _model_scale(bw, bh)
+    cols = math.ceil(bw * scale / TILE_SIZE)
+    rows = math.ceil(bh * scale / TILE_SIZE)
+    nx0, nx1 = _grow(x0, x1, int(cols * TILE_SIZE / scale), width)
+    ny0, ny1 = _grow(y0, y1, int(rows * TILE_SIZE / scale), height)
+    # growing changes the model-side scale; keep the snap only if it's free
+    if vision_tiles(nx1 - nx0, ny1 - ny0) <= tiles:
+        return nx0, ny0, nx1, ny1
+    return box
+
+
+def foliage_boxes(mask: np.ndarray, min_fraction: float = ROI_MIN_FRACTION,
+                  max_regions: int = ROI_MAX_REGIONS, min_gap: float = ROI_MIN_GAP):
+    """
+    Bounding boxes (x0, y0, x1, y1) of the foliage in a leaf mask, from row
+    and column projections. Returns [union box] plus, when the canopy splits
+    into separate clumps along x, one box per clump (at most max_regions).
+    Empty list when there's no foliage.
+    """
+    height, width = mask.shape
+    col_on = mask.mean(axis=0) > min_fraction
+    row_on = mask.mean(axis=1) > min_fraction
+    if not col_on.any() or not row_on.any():
+        return []
+    rows = np.flatnonzero(row_on)
+    cols = np.flatnonzero(col_on)
+    union = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+    regions = []
+    col_runs = _runs(col_on, int(min_gap * width))
+    if 1 < len(col_runs) <= max_regions:
+        for c0, c1 in col_runs:
+            sub_rows = np.flatnonzero(mask[:, c0:c1].mean(axis=1) > min_fraction)
+            if sub_rows.size:
+                regions.append((c0, int(sub_rows[0]), c1, int(sub_rows[-1]) + 1))
+    return [union] + regions
+
+
+def plan_crops(mask: np.ndarray, padding: float = ROI_PADDING):
+    """
+    Chooses the crop boxes to send for a frame: the padded, tile-snapped
+    foliage box, or several canopy boxes if together they need fewer tiles.
+    Returns (boxes, tiles_before, tiles_after).
+    """
+    height, width = mask.shape
+    full = vision_tiles(width, height)
+    boxes = foliage_boxes(mask)
+    if not boxes:
+        return [(0, 0, width, height)], full, full
+
+    def prepare(box):
+        return snap_to_tiles(_pad(box, width, height, padding), width, height)
+
+    union = [prepare(boxes[0])]
+    best = union
+    if len(boxes) > 2:
+        split = [prepare(b) for b in boxes[1:]]
+        if sum(vision_tiles(b[2] - b[0], b[3] - b[1]) for b in split) < vision_tiles(
+                union[0][2] - union[0][0], union[0][3] - union[0][1]):
+            best = split
+    after = sum(vision_tiles(b[2] - b[0], b[3] - b[1]) for b in best)
+    if after > full:
+        return [(0, 0, width, height)], full, full
+    return best, full, after
@@ -0,0 +1,129 @@
+"""
+frame_select.py
+
+Best-of-N frame selection for server_http.py.
+
+Frames from one camera are collected for FRAME_WINDOW_SECONDS after the
+first one arrives. Each is scored locally (sharpness, exposure and foliage
+coverage from the leaf mask) as it comes in, only the best so far is kept,
+and when the window closes that frame alone is handed on for geocoding and
+diagnosis. Every frame stays archived on disk either way.
+"""
+
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from src.foliage import frame_metrics, load_preview
+from src.instrumentation import counter, log_event
+
+WINDOW_SECONDS = float(os.getenv("FRAME_WINDOW_SECONDS", "60"))
+WINDOW_MAX_FRAMES = int(os.getenv("FRAME_WINDOW_MAX_FRAMES", "12"))
+
+# Laplacian variance at which a frame counts as "half sharp"
+SHARPNESS_MIDPOINT = float(os.getenv("FRAME_SHARPNESS_MIDPOINT", "150"))
+# Foliage coverage that earns the full coverage score
+COVERAGE_TARGET = float(os.getenv("FRAME_COVERAGE_TARGET", "0.35"))
+WEIGHTS = {"sharpness": 0.45, "exposure": 0.25, "coverage": 0.30}
+
+FRAMES = counter("ff_frames_total", "Uploaded frames by selection outcome.")
+
+
+def score_metrics(metrics: dict) -> float:
+    """Folds frame_metrics() output into a single 0..1 quality score."""
+    sharp = metrics["sharpness"] / (metrics["sharpness"] + SHARPNESS_MIDPOINT)
+    cover = min(metrics["coverage"] / COVERAGE_TARGET, 1.0)
+    return (WEIGHTS["sharpness"] * sharp
+            + WEIGHTS["exposure"] * metrics["exposure"]
+            + WEIGHTS["coverage"] * cover)
+
+
+def score_frame(image_path) -> dict:
+    metrics = frame_metrics(load_preview(image_path))
+    metrics["score"] = score_metrics(metrics)
+    return metrics
+
+
+@dataclass
+class _Window:
+    best_path: object = None
+    best_meta: dict = None
+    best_metrics: dict = None
+    frames: int = 0
+    timer: threading.Timer = None
+    scores: list = field(default_factory=list)
+
+
+class FrameWindow:
+    """
+    Per-camera collection windows.
+
+        window = FrameWindow(on_select=lambda camera_id, path, meta, metrics: ...)
+        window.add("oak", Path("pi_input_http/oak_1.jpg"), {"species": "oak"})
+
+    on_select runs on a timer thread (or inline when the window is disabled
+    with interval 0). Frames that fail to score are passed through so a
+    decoding problem never silently drops a camera.
+    """
+
+    def __init__(self, on_select, interval: float = WINDOW_SECONDS, max_frames: int = WINDOW_MAX_FRAMES):
+        self.on_select = on_select
+        self.interval = interval
+        self.max_frames = max_frames
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def add(self, camera_id: str, image_path, meta: dict = None):
+        meta = meta or {}
+        if self.interval <= 0:
+            FRAMES.inc(outcome="selected")
+            self.on_select(camera_id, image_path, meta, None)
+            return
+
+        try:
+            metrics = score_frame(image_path)
+        except Exception as e:
+            log_event("frame_score_failed", level=logging.WARNING, camera=camera_id,
+                      path=str(image_path), error=str(e))
+            FRAMES.inc(outcome="selected")
+            self.on_select(camera_id, image_path, meta, None)
+            return
+
+        flush_now = False
+        with self._lock:
+            win = self._windows.get(camera_id)
+            if win is None:
+                win = self._windows[camera_id] = _Window()
+                win.timer = threading.Timer(self.interval, self.close, args=(camera_id,))
+                win.timer.daemon = True
+                win.timer.start()
+            win.frames += 1
+            win.scores.append(round(metrics["score"], 3))
+            if win.best_metrics is None or metrics["score"] > win.best_metrics["score"]:
+                win.best_path, win.best_meta, win.best_metrics = image_path, meta, metrics
+            flush_now = win.frames >= self.max_frames
+
+        if flush_now:
+            self.close(camera_id)
+
+    def close(self, camera_id: str):
+        """Ends camera_id's window and hands its best frame to on_select."""
+        with self._lock:
+            win = self._windows.pop(camera_id, None)
+        if win is None:
+            return
+        win.timer.cancel()
+        FRAMES.inc(outcome="selected")
+        FRAMES.inc(win.frames - 1, outcome="discarded")
+        log_event("frame_selected", camera=camera_id, path=str(win.best_path),
+                  frames=win.frames, scores=win.scores,
+                  score=round(win.best_metrics["score"], 3),
+                  correlation_id=win.best_meta.get("correlation_id"))
+        self.on_select(camera_id, win.best_path, win.best_meta, win.best_metrics)
+
+    def close_all(self):
+        with self._lock:
+            cameras = list(self._windows)
+        for camera_id in cameras:
+            self.close(camera_id)
@@ -0,0 +1,391 @@
+"""
+instrumentation.py
+
+Lightweight timing spans, metrics and structured logs shared by the
+pipeline and the Flask services.
+
+    with span("geocode"):
+        lat, lon = get_location_from_zip(zip_code)
+
+    @span("weather")
+    def get_weather_data(lat, lon): ...
+
+Metrics live in-process and are rendered in Prometheus text format by the
+/metrics route that register_metrics(app, ...) adds. Pipeline runs are
+short-lived subprocesses, so they call persist_metrics_on_exit(); their
+counts are merged into a shared file under METRICS_DIR on exit. The queue
+worker lives as long as the services, so it also calls flush_metrics()
+after each job. server_http's /metrics folds that file into its output
+(only that one, so Prometheus scraping every service counts each pipeline
+run once).
+
+Logs are one JSON object per line and carry the correlation ID of the
+image being processed (FF_CORRELATION_ID is passed down to subprocesses).
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import bisect
+import logging
+import threading
+import contextvars
+import functools
+from pathlib import Path
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: shared metrics file is written without locking
+    fcntl = None
+
+METRICS_DIR = Path(os.getenv("FF_METRICS_DIR", Path(__file__).resolve().parent.parent / "metrics"))
+SHARED_METRICS_FILE = METRICS_DIR / "shared.json"
+CORRELATION_ENV = "FF_CORRELATION_ID"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20)
+
+_lock = threading.Lock()
+_registry = {}
+
+
+# ——— Metrics ———
+
+def _label_key(labels: dict) -> str:
+    return json.dumps(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._series = {}
+
+    def snapshot(self) -> dict:
+        with _lock:
+            return {"type": self.kind, "help": self.help, "buckets": None,
+                    "series": json.loads(json.dumps(self._series))}
+
+    def clear(self):
+        with _lock:
+            self._series.clear()
+
+    def take(self) -> dict:
+        """snapshot() and clear() in one step, so concurrent updates land in the next take."""
+        with _lock:
+            snap = {"type": self.kind, "help": self.help, "buckets": None, "series": self._series}
+            self._series = {}
+        return snap
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self._series[_label_key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with _lock:
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            idx = bisect.bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                state["counts"][idx] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def snapshot(self) -> dict:
+        snap = super().snapshot()
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+    def take(self) -> dict:
+        snap = super().take()
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+
+def _get_or_create(cls, name, help_text, **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help_text, **kwargs)
+    if not isinstance(metric, cls):
+        raise ValueError(f"Metric {name} already registered as {metric.kind}")
+    return metric
+
+
+def counter(name: str, help_text: str) -> Counter:
+    return _get_or_create(Counter, name, help_text)
+
+
+def gauge(name: str, help_text: str) -> Gauge:
+    return _get_or_create(Gauge, name, help_text)
+
+
+def histogram(name: str, help_text: str, buckets=LATENCY_BUCKETS) -> Histogram:
+    return _get_or_create(Histogram, name, help_text, buckets=buckets)
+
+
+STAGE_SECONDS = histogram("ff_stage_duration_seconds", "Duration of pipeline and recommendation stages.")
+CACHE_HITS = counter("ff_cache_hits_total", "Cache lookups served from cache.")
+CACHE_MISSES = counter("ff_cache_misses_total", "Cache lookups that had to be computed.")
+API_CALLS = counter("ff_api_calls_total", "Calls made to external APIs.")
+API_ERRORS = counter("ff_api_errors_total", "Failed calls to external APIs.")
+PAYLOAD_BYTES = histogram("ff_payload_bytes", "Size of uploaded images and model payloads.", SIZE_BUCKETS)
+HTTP_SECONDS = histogram("ff_http_request_duration_seconds", "Flask request latency.")
+
+
+# ——— Cross-process aggregation ———
+
+def _local_snapshot() -> dict:
+    with _lock:
+        metrics = list(_registry.values())
+    return {m.name: m.snapshot() for m in metrics}
+
+
+def _merge_into(target: dict, snap: dict):
+    for name, data in snap.items():
+        cur = target.setdefault(name, {"type": data["type"], "help": data["help"],
+                                       "buckets": data["buckets"], "series": {}})
+        for key, value in data["series"].items():
+            if data["type"] == "gauge" or key not in cur["series"]:
+                cur["series"][key] = json.loads(json.dumps(value))
+            elif data["type"] == "counter":
+                cur["series"][key] += value
+            else:
+                old = cur["series"][key]
+                old["counts"] = [a + b for a, b in zip(old["counts"], value["counts"])]
+                old["sum"] += value["sum"]
+                old["count"] += value["count"]
+
+
+class _SharedFileLock:
+    def __init__(self, exclusive: bool):
+        self.exclusive = exclusive
+        self._fh = None
+
+    def __enter__(self):
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        self._fh = open(METRICS_DIR / "shared.lock", "a")
+        if fcntl:
+            fcntl.flock(self._fh, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+        self._fh.close()
+        return False
+
+
+def _read_shared() -> dict:
+    try:
+        with open(SHARED_METRICS_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def flush_metrics():
+    """Moves this process's metrics into the shared file; safe to call while other threads record."""
+    with _lock:
+        metrics = list(_registry.values())
+    snap = {m.name: m.take() for m in metrics}
+    if not any(data["series"] for data in snap.values()):
+        return
+    try:
+        with _SharedFileLock(exclusive=True):
+            shared = _read_shared()
+            _merge_into(shared, snap)
+            tmp = SHARED_METRICS_FILE.with_suffix(".tmp")
+            tmp.write_text(json.dumps(shared))
+            os.replace(tmp, SHARED_METRICS_FILE)
+    except OSError as e:
+        logging.getLogger("instrumentation").warning("Could not flush metrics: %s", e)
+        # put them back for the next flush; what was recorded meanwhile is newer
+        with _lock:
+            _merge_into(snap, {m.name: {**snap[m.name], "series": m._series} for m in metrics})
+            for m in metrics:
+                m._series = snap[m.name]["series"]
+
+
+def persist_metrics_on_exit():
+    atexit.register(flush_metrics)
+
+
+# ——— Prometheus exposition ———
+
+def _fmt_labels(key: str, extra=()) -> str:
+    pairs = [tuple(p) for p in json.loads(key)] + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt_num(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(include_shared: bool = True) -> str:
+    merged = {}
+    if include_shared:
+        try:
+            with _SharedFileLock(exclusive=False):
+                _merge_into(merged, _read_shared())
+        except OSError:
+            pass
+    _merge_into(merged, _local_snapshot())
+
+    lines = []
+    for name in sorted(merged):
+        data = merged[name]
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        for key, value in sorted(data["series"].items()):
+            if data["type"] != "histogram":
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_num(value)}")
+                continue
+            running = 0
+            for bound, count in zip(data["buckets"], value["counts"]):
+                running += count
+                lines.append(f"{name}_bucket{_fmt_labels(key, [('le', _fmt_num(float(bound)))])} {running}")
+            lines.append(f"{name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_num(float(value['sum']))}")
+            lines.append(f"{name}_count{_fmt_labels(key)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def register_metrics(app, service: str, include_shared: bool = False):
+    """
+    Adds request timing and a Prometheus /metrics route to a Flask app.
+    include_shared adds the metrics of pipeline/worker/batch processes;
+    exactly one service should set it.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g._ff_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(resp):
+        started = getattr(g, "_ff_started", None)
+        if started is not None and request.endpoint != "metrics":
+            HTTP_SECONDS.observe(time.perf_counter() - started, service=service,
+                                 endpoint=request.endpoint or "unknown",
+                                 method=request.method, status=resp.status_code)
+        return resp
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render_prometheus(include_shared), mimetype="text/plain; version=0.0.4")
+
+
+# ——— Correlation IDs & structured logs ———
+
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def set_correlation_id(cid: str = None) -> str:
+    """Uses cid, else FF_CORRELATION_ID from the parent process, else a fresh ID."""
+    cid = cid or os.getenv(CORRELATION_ENV) or new_correlation_id()
+    _correlation_id.set(cid)
+    return cid
+
+
+def get_correlation_id():
+    return _correlation_id.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        cid = get_correlation_id()
+        if cid:
+            entry["correlation_id"] = cid
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(service: str, level: str = None):
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter(service))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level or os.getenv("LOG_LEVEL", "INFO"))
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    logging.getLogger("ff").log(level, event, extra={"fields": fields})
+
+
+class span:
+    """Times a block or function, records it in STAGE_SECONDS and logs one JSON line."""
+
+    def __init__(self, stage: str, **fields):
+        self.stage = stage
+        self.fields = fields
+        self.duration = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        status = "error" if exc_type else "ok"
+        STAGE_SECONDS.observe(self.duration, stage=self.stage, status=status)
+        log_event("span", stage=self.stage, status=status,
+                  duration_ms=round(self.duration * 1000, 2), **self.fields)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(self.stage, **self.fields):
+                return fn(*args, **kwargs)
+        return wrapper
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+job_queue.py
+
+Durable work queue between ingestion (server_http.py) and processing
+(`python src/pipeline.py worker`), so frames received on one box can be
+diagnosed by workers on any number of others.
+
+Delivery is at-least-once:
+
+  • enqueue() takes an idempotency key. A job whose key is already queued,
+    running, done or dead-lettered isn't added again, so a Pi retrying an
+    upload doesn't produce a second diagnosis.
+  • claim() leases a job for QUEUE_VISIBILITY_SECONDS. A worker that dies
+    mid-job simply stops extending its lease; the job becomes visible
+    again and another worker picks it up.
+  • ack() completes it. fail() puts it back with exponential backoff, or
+    dead-letters it once it has been attempted max_attempts times (or at
+    once, for permanent failures). Leases that expire on the last attempt
+    are dead-lettered too.
+
+Backends are picked by PIPELINE_QUEUE_URL's scheme. sqlite:// (the
+default, DATA_DIR/queue.db) is built in and suits workers on the same host
+or on a shared volume with working POSIX locks. Other backends (e.g. Redis)
+register themselves with @register_backend("redis") and implement
+JobQueue.
+
+    python src/job_queue.py stats
+    python src/job_queue.py dead
+    python src/job_queue.py requeue <job_id>
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import os
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import contextlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from src.instrumentation import counter, gauge, log_event
+
+DATA_DIR = Path(os.getenv("FF_DATA_DIR", Path(__file__).resolve().parent.parent / "static" / "data"))
+QUEUE_URL = os.getenv("PIPELINE_QUEUE_URL", f"sqlite://{(DATA_DIR / 'queue.db').resolve()}")
+VISIBILITY_SECONDS = float(os.getenv("QUEUE_VISIBILITY_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+RETRY_SECONDS = float(os.getenv("QUEUE_RETRY_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.getenv("QUEUE_RETRY_MAX_SECONDS", "1800"))
+RETENTION_SECONDS = float(os.getenv("QUEUE_RETENTION_SECONDS", str(7 * 86400)))
+
+JOBS = counter("ff_queue_jobs_total", "Queue job events (enqueued, duplicate, claimed, acked, retried, dead).")
+DEPTH = gauge("ff_queue_depth", "Jobs in the pipeline queue by state.")
+
+
+@dataclass
+class Job:
+    id: int
+    key: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+    lease: str = None
+
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_MAX_SECONDS, RETRY_SECONDS * 2 ** max(0, attempts - 1))
+
+
+class JobQueue(ABC):
+    """
+    What server_http.py and the worker need from a queue backend. A backend
+    that leaves any of it out fails when it is created, not on first use.
+    """
+
+    @abstractmethod
+    def enqueue(self, key: str, payload: dict, max_attempts: int = MAX_ATTEMPTS):
+        """Returns (job_id, added); added is False if the key was already queued."""
+
+    @abstractmethod
+    def claim(self, worker: str, visibility: float = VISIBILITY_SECONDS):
+        """Leases the next visible job, or returns None."""
+
+    @abstractmethod
+    def extend(self, job: Job, visibility: float = VISIBILITY_SECONDS) -> bool:
+        """Pushes the lease out; False if it was lost to another worker."""
+
+    @abstractmethod
+    def ack(self, job: Job) -> bool:
+        """Completes the job; False if its lease was lost."""
+
+    @abstractmethod
+    def fail(self, job: Job, error: str, permanent: bool = False) -> str:
+        """Retries or dead-letters the job; returns its new state."""
+
+    @abstractmethod
+    def requeue(self, job_id: int) -> bool:
+        """Moves a dead-lettered job back to ready with a fresh attempt count."""
+
+    @abstractmethod
+    def dead_letters(self, limit: int = 100) -> list:
+        """Dead-lettered jobs, most recent first."""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Jobs per state, plus the age of the oldest ready one."""
+
+    @abstractmethod
+    def purge(self, older_than: float = RETENTION_SECONDS) -> int:
+        """Drops finished jobs (and their keys) older than the retention period."""
+
+
+BACKENDS = {}
+
+
+def register_backend(scheme: str):
+    def deco(cls):
+        BACKENDS[scheme] = cls
+        return cls
+    return deco
+
+
+def open_queue(url: str = None) -> JobQueue:
+    url = url or QUEUE_URL
+    scheme = url.split("://", 1)[0]
+    if scheme not in BACKENDS:
+        raise ValueError(f"No queue backend for '{scheme}://' (have: {', '.join(sorted(BACKENDS))})")
+    return BACKENDS[scheme](url)
+
+
+@register_backend("sqlite")
+class SQLiteQueue(JobQueue):
+    """
+    One table; a job is ready, leased, done or dead. Claims run in an
+    IMMEDIATE transaction, so concurrent workers never lease the same job.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            key          TEXT NOT NULL UNIQUE,
+            payload      TEXT NOT NULL,
+            state        TEXT NOT NULL DEFAULT 'ready',
+            attempts     INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            visible_at   REAL NOT NULL,
+            lease        TEXT,
+            worker       TEXT,
+            last_error   TEXT,
+            created_at   REAL NOT NULL,
+            updated_at   REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_visible ON jobs (state, visible_at);
+    """
+
+    def __init__(self, url: str):
+        self.path = Path(url.split("://", 1)[1])
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")  # persistent: readers don't block the writer
+            db.executescript(self.SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    @contextlib.contextmanager
+    def _tx(self, immediate: bool = False):
+        # a connection per operation: safe across Flask threads and processes
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield db
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        finally:
+            db.close()
+
+    def enqueue(self, key, payload, max_attempts=MAX_ATTEMPTS):
+        now = time.time()
+        with self._tx(immediate=True) as db:
+            cur = db.execute(
+                "INSERT INTO jobs (key, payload, max_attempts, visible_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO NOTHING",
+                (key, json.dumps(payload), max_attempts, now, now, now))
+            added = cur.rowcount == 1
+            job_id = cur.lastrowid if added else db.execute(
+                "SELECT id FROM jobs WHERE key = ?", (key,)).fetchone()["id"]
+        JOBS.inc(event="enqueued" if added else "duplicate")
+        return job_id, added
+
+    def claim(self, worker, visibility=VISIBILITY_SECONDS):
+        now = time.time()
+        with self._tx(immediate=True) as db:
+            while True:
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE state IN ('ready', 'leased') AND visible_at <= ? "
+                    "ORDER BY visible_at, id LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    return None
+                if row["state"] == "leased" and row["attempts"] >= row["max_attempts"]:
+                    # its last worker never came back
+                    db.execute("UPDATE jobs SET state = 'dead', lease = NULL, last_error = ?, updated_at = ? "
+                               "WHERE id = ?", (f"lease expired on attempt {row['attempts']}", now, row["id"]))
+                    JOBS.inc(event="dead")
+                    log_event("queue_dead_letter", job=row["id"], key=row["key"], reason="lease expired")
+                    continue
+                lease = uuid.uuid4().hex
+                db.execute("UPDATE jobs SET state = 'leased', attempts = attempts + 1, lease = ?, worker = ?, "
+                           "visible_at = ?, updated_at = ? WHERE id = ?",
+                           (lease, worker, now + visibility, now, row["id"]))
+                if row["state"] == "leased":
+                    JOBS.inc(event="expired")
+                JOBS.inc(event="claimed")
+                return Job(row["id"], row["key"], json.loads(row["payload"]), row["attempts"] + 1,
+                           row["max_attempts"], lease)
+
+    def extend(self, job, visibility=VISIBILITY_SECONDS):
+        now = time.time()
+        with self._tx() as db:
+            cur = db.execute("UPDATE jobs SET visible_at = ?, updated_at = ? WHERE id = ? AND lease = ? "
+                             "AND state = 'leased'", (now + visibility, now, job.id, job.lease))
+            return cur.rowcount == 1
+
+    def ack(self, job):
+        with self._tx() as db:
+            cur = db.execute("UPDATE jobs SET state = 'done', lease = NULL, updated_at = ? "
+                             "WHERE id = ? AND lease = ?", (time.time(), job.id, job.lease))
+        if cur.rowcount == 1:
+            JOBS.inc(event="acked")
+        return cur.rowcount == 1
+
+    def fail(self, job, error, permanent=False):
+        now = time.time()
+        dead = permanent or job.attempts >= job.max_attempts
+        state = "dead" if dead else "ready"
+        visible_at = now if dead else now + retry_delay(job.attempts)
+        with self._tx() as db:
+            cur = db.execute("UPDATE jobs SET state = ?, lease = NULL, visible_at = ?, last_error = ?, "
+                             "updated_at = ? WHERE id = ? AND lease = ?",
+                             (state, visible_at, str(error)[:2000], now, job.id, job.lease))
+        if cur.rowcount != 1:
+            return "lost"
+        JOBS.inc(event="dead" if dead else "retried")
+        if dead:
+            log_event("queue_dead_letter", job=job.id, key=job.key, attempts=job.attempts, error=str(error)[:200])
+        return state
+
+    def requeue(self, job_id):
+        now = time.time()
+        with self._tx() as db:
+            cur = db.execute("UPDATE jobs SET state = 'ready', attempts = 0, visible_at = ?, updated_at = ? "
+                             "WHERE id = ? AND state = 'dead'", (now, now, job_id))
+        return cur.rowcount == 1
+
+    def dead_letters(self, limit=100):
+        with self._tx() as db:
+            rows = db.execute("SELECT id, key, payload, attempts, last_error, updated_at FROM jobs "
+                              "WHERE state = 'dead' ORDER BY updated_at DESC LIMIT ?", (limit,)).fetchall()
+        return [{**dict(r), "payload": json.loads(r["payload"])} for r in rows]
+
+    def stats(self):
+        with self._tx() as db:
+            counts = dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            oldest = db.execute("SELECT MIN(created_at) FROM jobs WHERE state = 'ready'").fetchone()[0]
+        out = {state: counts.get(state, 0) for state in ("ready", "leased", "done", "dead")}
+        for state, n in out.items():
+            DEPTH.set(n, state=state)
+        out["oldest_ready_age_s"] = round(time.time() - oldest, 1) if oldest else None
+        return out
+
+    def purge(self, older_than=RETENTION_SECONDS):
+        with self._tx() as db:
+            cur = db.execute("DELETE FROM jobs WHERE state = 'done' AND updated_at < ?",
+                             (time.time() - older_than,))
+        return cur.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the pipeline job queue.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Jobs per state")
+    p_dead = sub.add_parser("dead", help="List dead-lettered jobs")
+    p_dead.add_argument("--limit", type=int, default=100)
+    p_requeue = sub.add_parser("requeue", help="Retry a dead-lettered job")
+    p_requeue.add_argument("job_id", type=int)
+    args = parser.parse_args()
+
+    queue = open_queue()
+    if args.command == "stats":
+        print(json.dumps(queue.stats(), indent=2))
+    elif args.command == "dead":
+        print(json.dumps(queue.dead_letters(args.limit), indent=2))
+    else:
+        print(json.dumps({"requeued": queue.requeue(args.job_id)}))
+
+
+if __name__ == "__main__":
+    main()
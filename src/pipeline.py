@@ -9,11 +9,25 @@ Called by process_image.py with:
 
 1) Geocode ZIP → lat,lon.
 2) generate_tree_care_json (or load existing) via recom.py.
-3) mask_out_trunk → leaf‑only PNG.
-4) Encode leaf‑only PNG to a base64 data:URL.
-5) Send to GPT‑4o (chat_with_json_and_image) to get health JSON.
+3) mask_out_trunk → leaf‑only PNG, cropped to the foliage (crop_to_foliage).
+4) Encode the leaf‑only crop(s) to base64 data:URLs.
+5) Send to GPT‑4o (chat_with_json_and_image) to get health JSON, or score
+   locally (local_diagnosis) if budget.py says the API budget is spent.
 6) Post‑process leaf_color_match, reasons_unhealthy, etc.
-7) Write out final JSON → finalSuggestions/<species>Rec.json
+7) Write out final JSON → finalSuggestions/<species>Rec.json and append it
+   to history/<species>.jsonl (record_diagnosis).
+
+Images that don't need a result right away can go through the deferred
+batch path instead (--defer, see batch_diagnosis.py).
+
+`python src/pipeline.py worker` runs a queue worker instead (worker.py):
+it processes the frames server_http.py queues, on any node. Exit status
+is 0 on success, 1 if the diagnosis failed (worth retrying) and 2 for bad
+input.
+
+Each stage runs inside an instrumentation.span, so its duration lands in
+the shared metrics and in the JSON log line tagged with the image's
+correlation ID.
 """
 
 import sys
@@ -27,15 +41,27 @@ import argparse
 from pathlib import Path
 from dotenv import load_dotenv
 from geopy.geocoders import Nominatim
-from src.recom import generate_tree_care_json
+from src.recom import generate_tree_care_json, get_palette_color_names
+from src.color_names import nearest, palette_mask
+from src import budget
+from src.foliage import leaf_mask, plan_crops, load_preview
+from src.prompts import (
+    SEASONS, care_fields, diagnosis_messages, estimate_tokens, prompt_text, record_usage, season_for,
+    seasonal_care
+)
+from src import watering
+from src.instrumentation import (
+    API_CALLS, API_ERRORS, CACHE_HITS, CACHE_MISSES, PAYLOAD_BYTES, counter,
+    configure_logging, log_event, persist_metrics_on_exit, set_correlation_id, span
+)
 from openai import OpenAI
+import time
+import uuid
+import logging
 import datetime
 from PIL import Image
 import numpy as np
 
-
-now = datetime.datetime.utcnow()  # For timestamps
-
 # Ensure we use system certificates for OpenAI
 os.environ["SSL_CERT_FILE"] = certifi.where()
 
@@ -47,55 +73,126 @@ if not openai_api_key:
 
 client = OpenAI(api_key=openai_api_key)
 
+log = logging.getLogger("pipeline")
+PIPELINE_RUNS = counter("ff_pipeline_runs_total", "Pipeline runs by outcome.")
+VISION_TILES = counter("ff_vision_tiles_total", "Vision-model image tiles per frame, before and after ROI cropping.")
+
+ROI_ENABLED = os.getenv("ROI_ENABLED", "1") != "0"
+# local scoring (budget spent): how close to the seasonal palette a pixel must be, and how much foliage is needed
+LOCAL_MATCH_DELTA_E = float(os.getenv("LOCAL_MATCH_DELTA_E", "25"))
+LOCAL_MIN_COVERAGE = float(os.getenv("LOCAL_MIN_COVERAGE", "0.05"))
+
+# Geocoder endpoint (overridable so the benchmark can use a local stand-in)
+NOMINATIM_DOMAIN = os.getenv("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+NOMINATIM_SCHEME = os.getenv("NOMINATIM_SCHEME", "https")
+# how long a geocode waits for the 1 request/s Nominatim budget before giving up
+NOMINATIM_MAX_WAIT = float(os.getenv("NOMINATIM_MAX_WAIT", "10"))
+
 # Directories
 BASE_DIR     = Path(__file__).parent
-DATA_DIR     = BASE_DIR.parent / "static" / "data"
+DATA_DIR     = Path(os.getenv("FF_DATA_DIR", BASE_DIR.parent / "static" / "data"))
 SAVED_DIR    = DATA_DIR / "savedJson"
 FINAL_DIR    = DATA_DIR / "finalSuggestions"
+HISTORY_DIR  = DATA_DIR / "history"
+GEOCODE_CACHE = DATA_DIR / "geocode.json"   # ZIP → [lat, lon]; ZIPs don't move
 IMAGES_DIR   = BASE_DIR.parent / "static" / "images"
 SAVED_DIR.mkdir(parents=True, exist_ok=True)
 FINAL_DIR.mkdir(parents=True, exist_ok=True)
+HISTORY_DIR.mkdir(parents=True, exist_ok=True)
 IMAGES_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def mask_out_trunk(image_path: Path) -> Path:
-    """
-    Opens the tree image, converts to HSV, and keeps only "green foliage" pixels.
-    Anything non-green (e.g. brown trunk) becomes white. Saves as PNG and returns that path.
-    """
+def _leaf_only(image_path: Path):
     img_rgb = Image.open(image_path).convert("RGB")
-    img_hsv = img_rgb.convert("HSV")
-    hsv_arr = np.array(img_hsv).astype(np.int16)
-
-    H = hsv_arr[:, :, 0]  # 0–255
-    S = hsv_arr[:, :, 1]
-    V = hsv_arr[:, :, 2]
-
-    # Broad "green" band: 30 < H < 140
-    hue_mask = (H > 30) & (H < 140)
-    sat_mask = (S > 20)   # somewhat saturated
-    val_mask = (V > 20)   # not too dark
-
-    leaf_mask = hue_mask & sat_mask & val_mask
+    mask = leaf_mask(img_rgb)
 
     arr_rgb = np.array(img_rgb)
     arr_leaf = np.zeros_like(arr_rgb) + 255  # white background
-    arr_leaf[leaf_mask] = arr_rgb[leaf_mask]
+    arr_leaf[mask] = arr_rgb[mask]
+    return Image.fromarray(arr_leaf.astype(np.uint8)), mask
 
-    leaf_img = Image.fromarray(arr_leaf.astype(np.uint8))
+
+def mask_out_trunk(image_path: Path) -> Path:
+    """
+    Opens the tree image, converts to HSV, and keeps only "green foliage" pixels.
+    Anything non-green (e.g. brown trunk) becomes white. Saves as PNG and returns that path.
+    """
+    leaf_img, _ = _leaf_only(image_path)
     tmp_path = image_path.parent / f"{image_path.stem}_leaf_only.png"
     leaf_img.save(tmp_path)
     return tmp_path
 
 
+def crop_to_foliage(image_path: Path) -> list:
+    """
+    Like mask_out_trunk, but also crops the leaf-only image to the foliage
+    (or to separate canopies) so the vision model bills fewer tiles for
+    background. Saves one PNG per crop and returns their paths.
+    """
+    leaf_img, mask = _leaf_only(image_path)
+    boxes, tiles_before, tiles_after = plan_crops(mask)
+    VISION_TILES.inc(tiles_before, phase="before")
+    VISION_TILES.inc(tiles_after, phase="after")
+    log_event("roi", image=image_path.name, tiles_before=tiles_before,
+              tiles_after=tiles_after, boxes=boxes)
+
+    if len(boxes) == 1:
+        paths = [image_path.parent / f"{image_path.stem}_leaf_only.png"]
+    else:
+        paths = [image_path.parent / f"{image_path.stem}_leaf_roi{i}.png" for i in range(len(boxes))]
+    for box, path in zip(boxes, paths):
+        leaf_img.crop(box).save(path)
+    return paths
+
+
 def get_location_from_zip(zip_code: str) -> (float, float): # type: ignore
     """
-    Geocode a US ZIP to (latitude, longitude) using Nominatim.
+    Geocode a US ZIP to (latitude, longitude) using Nominatim. Answers are
+    kept in DATA_DIR/geocode.json, so each ZIP is looked up once. Waits up
+    to NOMINATIM_MAX_WAIT for the 1 request/s budget; raises
+    budget.BudgetExceeded if it is still spent.
     """
-    geolocator = Nominatim(user_agent="my_geocoder")
-    loc = geolocator.geocode(f"{zip_code}, USA")
+    try:
+        with open(GEOCODE_CACHE) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+    if zip_code in cache:
+        CACHE_HITS.inc(cache="geocode")
+        lat, lon = cache[zip_code]
+        return lat, lon
+    CACHE_MISSES.inc(cache="geocode")
+
+    deadline = time.monotonic() + NOMINATIM_MAX_WAIT
+    while True:
+        try:
+            budget.acquire("nominatim", **budget.context())
+            break
+        except budget.BudgetExceeded as e:
+            if time.monotonic() + e.retry_after > deadline:
+                raise
+            time.sleep(e.retry_after)
+
+    geolocator = Nominatim(user_agent="my_geocoder", domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME)
+    API_CALLS.inc(api="nominatim")
+    try:
+        loc = geolocator.geocode(f"{zip_code}, USA")
+    except Exception:
+        API_ERRORS.inc(api="nominatim")
+        raise
     if not loc:
         raise ValueError(f"Unable to geocode ZIP {zip_code}.")
+
+    # other workers may have added ZIPs meanwhile; a lost entry is only a repeat lookup
+    try:
+        with open(GEOCODE_CACHE) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    cache[zip_code] = [loc.latitude, loc.longitude]
+    tmp = GEOCODE_CACHE.with_name(f"{GEOCODE_CACHE.name}.{uuid.uuid4().hex[:8]}.tmp")
+    tmp.write_text(json.dumps(cache))
+    os.replace(tmp, GEOCODE_CACHE)
     return loc.latitude, loc.longitude
 
 
@@ -111,55 +208,43 @@ def encode_image_to_data_url(image_path: Path) -> str:
     return f"data:image/{ext};base64,{b64}"
 
 
-def chat_with_json_and_image(image_url: str, recommendations: dict) -> dict:
+def build_diagnosis_request(image_url, recommendations: dict, when: datetime.datetime = None) -> dict:
     """
-    Sends a multimodal chat to GPT-4o with:
-      • system prompt describing the required output schema
-      • user message containing care JSON + image_url + date/time + location
-    Returns exactly the parsed JSON object from GPT-4o.
+    Builds the chat.completions.create arguments for one diagnosis (see
+    prompts.diagnosis_messages for what goes in and in which order).
+    image_url is one data URL or a list of them (separate canopy crops of
+    the same tree); when is the frame's UTC time, default now.
+    The same body is sent synchronously or written to a batch file.
     """
-    system_prompt = (
-        "You are a helpful assistant who, when given:\n"
-        "  1) a base64-encoded image of a tree/plant\n"
-        "  2) its JSON care recommendations (including seasonal hex-color ranges)\n\n"
-        "You will return exactly one JSON object (no Markdown fences, no extra commentary) containing:\n"
-        '  • "species": the species name (string)\n'
-        '  • "healthy": "YES" or "NO"\n'
-        '  • "percentage": a percentage value (0–100) on how healthy the tree is.\n'
-        '  • "observed_leaf_color": a single hex code (e.g. "#RRGGBB") for the dominant leaf color\n'
-        '    (⚠️Ignore bark/trunk/branches—sample only leaf/foliage pixels.)\n'
-        '  • "expected_leaf_colors": an array of five hex codes for this season\'s recommended leaf colors\n'
-        '  • "reasons_unhealthy": if `"healthy" == "NO"`, an array of exactly three short strings; if `"healthy" == "YES"`, an empty array\n'
-        '  • "treatment_recommendations": an array of three strings with concrete steps to improve plant health\n'
-        "  • 'Watering Schedule': recommended watering frequency MUST BE A NUMBER. (e.g. for once a week do 7, for twice a week do 3 etc.).\n"
-        '  • "timestamp": current UTC date/time in ISO 8601 (e.g. "2025-06-02T22:39:11Z")\n\n'
-        "⚠️IMPORTANT: Do not sample trunk or brown/bark areas—focus only on green leaf pixels.\n\n"
-        "Strictly output only valid JSON—no Markdown fences, no extra keys, no commentary.\n"
-    )
-
-    recs_json_str = json.dumps(recommendations)
-
-    user_message = {
-        "role": "user",
-        "content": (
-            "Here are the care recommendations (in JSON):\n"
-            f"{recs_json_str}\n\n"
-            "Analyze the plant image and those recommendations, then return the required JSON.\n\n"
-            f"The current date/time is {now.isoformat()}Z.\n"
-            f"The tree's location is Lat: {recommendations.get('latitude')}, Lon: {recommendations.get('longitude')}."
-        ),
-        "image_url": image_url
+    image_urls = [image_url] if isinstance(image_url, str) else list(image_url)
+    messages = diagnosis_messages(recommendations, image_urls, when)
+    PAYLOAD_BYTES.observe(len(prompt_text(messages).encode()), kind="diagnosis_prompt")
+    return {
+        "model": "gpt-4o",
+        "messages": messages,
+        "response_format": {"type": "json_object"},
+        "max_tokens": 800,
     }
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            user_message
-        ],
-        response_format={"type": "json_object"},
-        max_tokens=800,
-    )
+
+def chat_with_json_and_image(image_url, recommendations: dict) -> dict:
+    """
+    Sends the diagnosis request to GPT-4o and returns exactly the parsed
+    JSON object from the reply. Raises budget.BudgetExceeded, without
+    calling the API, if the camera's or the global budget is spent.
+    """
+    request = build_diagnosis_request(image_url, recommendations)
+    estimate = estimate_tokens(prompt_text(request["messages"])) + request["max_tokens"]
+    grant = budget.acquire("openai", tokens=estimate, **budget.context())
+    API_CALLS.inc(api="openai")
+    try:
+        response = client.chat.completions.create(**request)
+    except Exception:
+        API_ERRORS.inc(api="openai")
+        raise
+    usage = getattr(response, "usage", None)
+    record_usage(usage, kind="diagnosis")
+    grant.settle(getattr(usage, "total_tokens", None))
 
     try:
         assistant_msg = response.choices[0].message
@@ -169,7 +254,11 @@ def chat_with_json_and_image(image_url: str, recommendations: dict) -> dict:
     content = getattr(assistant_msg, "content", None)
     if content is None:
         raise RuntimeError(f"No 'content' in assistant response:\n{response}")
+    return parse_diagnosis_content(content)
+
 
+def parse_diagnosis_content(content: str) -> dict:
+    """Parses the assistant's reply, tolerating a ```json fence."""
     if isinstance(content, str) and content.startswith("```json") and content.endswith("```"):
         content = content[len("```json"):-len("```")].strip()
 
@@ -188,12 +277,20 @@ def ensure_recommendations_exist(species: str, lat: float, lon: float) -> dict:
     json_path = SAVED_DIR / f"{species}Care.json"
 
     if json_path.exists():
+        CACHE_HITS.inc(cache="care_json")
         with open(json_path, "r") as f:
             info = json.load(f)
-            info["latitude"] = lat
-            info["longitude"] = lon
-            return info
-
+        if "color_names" not in info and isinstance(info.get("recommendations"), dict):
+            # saved before palettes were named; add them once
+            info["color_names"] = get_palette_color_names(info["recommendations"])
+            tmp = json_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(info, indent=2))
+            os.replace(tmp, json_path)
+        info["latitude"] = lat
+        info["longitude"] = lon
+        return info
+
+    CACHE_MISSES.inc(cache="care_json")
     info = generate_tree_care_json(
         species_name=species,
         latitude=lat,
@@ -207,72 +304,216 @@ def ensure_recommendations_exist(species: str, lat: float, lon: float) -> dict:
     return info
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Run tree care + health pipeline on a single image."
-    )
-    parser.add_argument("--image",   required=True, help="Path to the JPEG image (species_<orig>.jpg)")
-    parser.add_argument("--species", required=True, help="Species name (e.g. 'oak', 'pine')")
-    parser.add_argument("--zip",     required=True, help="5-digit US ZIP code for location")
-    args = parser.parse_args()
-
-    image_path = Path(args.image)
-    species    = args.species.strip().lower()
-    zip_code   = args.zip.strip()
-
-    if not image_path.is_file():
-        print(f"ERROR: Image not found: {image_path}")
-        return
-
-    if not (zip_code.isdigit() and len(zip_code) == 5):
-        print("ERROR: ZIP code must be exactly 5 digits.")
-        return
-
+def prepare_inputs(image_path: Path, species: str, zip_code: str):
+    """
+    Geocodes, loads the care JSON and masks/encodes the image.
+    Returns (data_urls, recommendations), or None if a stage failed
+    (the failure is logged). When the API budget is spent the frame still
+    goes on: without a location, or with recommendations None if the care
+    JSON couldn't be generated (run_pipeline then scores it locally).
+    """
     # 1) Geocode ZIP → lat, lon
     try:
-        lat, lon = get_location_from_zip(zip_code)
+        with span("geocode", zip=zip_code):
+            lat, lon = get_location_from_zip(zip_code)
+    except budget.BudgetExceeded as e:
+        log.warning("%s; continuing without a location", e)
+        lat = lon = None
     except Exception as e:
-        print(f"Geocoding error: {e}")
-        return
+        log.error("Geocoding error: %s", e)
+        return None
 
-    print(f"\n>> [Pipeline] Ensuring care JSON for '{species}' at ZIP {zip_code} ({lat:.5f}, {lon:.5f}) …")
     try:
-        recommendations = ensure_recommendations_exist(species, lat, lon)
+        with span("care_json", species=species):
+            recommendations = ensure_recommendations_exist(species, lat, lon)
+    except budget.BudgetExceeded as e:
+        log.warning("%s; no care guide for %s yet", e, species)
+        recommendations = None
     except Exception as e:
-        print(f"Failed to get/generate recommendations: {e}")
-        return
+        log.error("Failed to get/generate recommendations: %s", e)
+        return None
 
-    print(" ↪ Care recommendations loaded.\n")
+    # 2) Mask out trunk → leaf-only image, cropped to the foliage
+    try:
+        with span("mask"):
+            leaf_paths = crop_to_foliage(image_path) if ROI_ENABLED else [mask_out_trunk(image_path)]
+    except Exception as e:
+        log.warning("Could not mask out trunk, using original image: %s", e)
+        leaf_paths = [image_path]
 
-    # 2) Mask out trunk → leaf-only image
-    print(">> [Pipeline] Masking out trunk/bark …")
+    # 3) Encode leaf-only crop(s) or original image to data URLs
     try:
-        leaf_only_path = mask_out_trunk(image_path)
+        with span("encode"):
+            data_urls = [encode_image_to_data_url(p) for p in leaf_paths]
     except Exception as e:
-        print(f"⚠️ Warning: could not mask out trunk. Using original image. ({e})")
-        leaf_only_path = image_path
+        log.error("Could not encode image: %s", e)
+        return None
+    for data_url in data_urls:
+        PAYLOAD_BYTES.observe(len(data_url), kind="image_data_url")
+    return data_urls, recommendations
 
-    print(f" ↪ Leaf-only image at {leaf_only_path.name}\n")
 
-    # 3) Encode leaf-only or original image to data URL
-    print(">> [Pipeline] Encoding image …")
+def record_diagnosis(species: str, diagnosis: dict, image_path: Path = None,
+                     captured_at: str = None, mode: str = "sync") -> Path:
+    """
+    Appends the diagnosis to history/<species>.jsonl and makes it the current
+    finalSuggestions/<species>Rec.json, unless that file already holds a
+    diagnosis of a newer frame (batch results can land out of order).
+    Also folds it into the species' watering schedule for the calendar.
+    Local scores (mode "local") only go to history: they never replace a
+    GPT-4o diagnosis, the watering calendar or the camera's cadence input.
+    Returns the finalSuggestions path.
+    """
+    captured_at = captured_at or datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    name_leaf_colors(diagnosis)
+    entry = dict(diagnosis, captured_at=captured_at, mode=mode)
+    if image_path is not None:
+        entry["image"] = Path(image_path).name
+    with open(HISTORY_DIR / f"{species}.jsonl", "a") as hist:
+        hist.write(json.dumps(entry) + "\n")
+
+    output_path = FINAL_DIR / f"{species}Rec.json"
+    if mode == "local":
+        return output_path
     try:
-        data_url = encode_image_to_data_url(leaf_only_path)
+        with open(output_path) as f:
+            current = json.load(f).get("captured_at", "")
+    except (FileNotFoundError, json.JSONDecodeError):
+        current = ""
+    if current <= captured_at:
+        tmp = output_path.with_suffix(".tmp")
+        with open(tmp, "w") as out_f:
+            json.dump(dict(diagnosis, captured_at=captured_at), out_f, indent=2)
+        os.replace(tmp, output_path)
+
+    try:
+        watering.record(species, diagnosis, captured_at)
     except Exception as e:
-        print(f"ERROR: Could not encode image: {e}")
-        return
+        log.warning("Could not update the watering calendar: %s", e)
+    return output_path
+
 
-    print(" ↪ Image encoded.\n")
+def run_pipeline(image_path: Path, species: str, zip_code: str):
+    """
+    Runs every stage for one image and returns the diagnosis dict,
+    or None if a stage failed (the failure is logged).
+    """
+    prepared = prepare_inputs(image_path, species, zip_code)
+    if prepared is None:
+        return None
+    data_urls, recommendations = prepared
+
+    # 4) Send to OpenAI for diagnosis, or score locally if the budget is spent
+    mode, diagnosis = "sync", None
+    if recommendations is not None:
+        try:
+            with span("diagnosis", model="gpt-4o"):
+                diagnosis = chat_with_json_and_image(data_urls, recommendations)
+        except budget.BudgetExceeded as e:
+            log.warning("%s; scoring locally", e)
+        except Exception as e:
+            log.error("OpenAI API error: %s", e)
+            return None
+    if diagnosis is None:
+        with span("diagnosis", model="local"):
+            diagnosis = local_diagnosis(image_path, species, recommendations or {})
+        mode = "local"
+
+    # 5) Post‑process leaf_color_match if needed
+    with span("postprocess"):
+        check_leaf_color_match(diagnosis)
 
-    # 4) Send to OpenAI for diagnosis
-    print(">> [Pipeline] Sending to OpenAI for plant health diagnosis …")
+    # 6) Write out the final JSON to finalSuggestions/{species}Rec.json + history
     try:
-        diagnosis = chat_with_json_and_image(data_url, recommendations)
+        with span("write"):
+            output_path = record_diagnosis(species, diagnosis, image_path, captured_at_of(image_path), mode=mode)
     except Exception as e:
-        print(f"OpenAI API error: {e}")
-        return
+        log.error("Failed to write final JSON: %s", e)
+        return None
 
-    # 5) Post‑process leaf_color_match if needed
+    log.info("Pipeline complete. Wrote JSON to %s", output_path)
+    return diagnosis
+
+
+def local_diagnosis(image_path: Path, species: str, recommendations: dict) -> dict:
+    """
+    Rough health estimate from the image alone, in the GPT-4o diagnosis
+    format, for when the API budget is spent. Foliage is every pixel that
+    is green or within LOCAL_MATCH_DELTA_E of this or last season's leaf
+    palette (so autumn colours and red-leaved species count); the score is
+    the share of it that matches those palettes. "healthy" is "UNKNOWN"
+    when too little foliage is visible to say. Marked "scoring": "local";
+    record_diagnosis keeps such results in history only.
+    """
+    when = datetime.datetime.utcnow()
+    season = season_for(when, recommendations.get("latitude"))
+    previous = SEASONS[(SEASONS.index(season) - 1) % len(SEASONS)]
+
+    def leaf_palette(name):
+        palette = seasonal_care(recommendations, name).get("Leaf color")
+        return palette if isinstance(palette, list) else []
+
+    expected = leaf_palette(season)
+    # leaves turn late (or early): last season's colours are no sign of trouble
+    accepted = expected + leaf_palette(previous)
+
+    img = load_preview(image_path).convert("RGB")
+    rgb = np.asarray(img)
+    on_palette = palette_mask(rgb, accepted, LOCAL_MATCH_DELTA_E)
+    foliage = on_palette | leaf_mask(img)
+    coverage = float(foliage.mean())
+
+    observed, percentage, healthy = None, None, "UNKNOWN"
+    reasons = []
+    if coverage >= LOCAL_MIN_COVERAGE:
+        observed = "#%02X%02X%02X" % tuple(int(round(c)) for c in rgb[foliage].mean(axis=0))
+        if accepted:
+            percentage = round(100 * float(on_palette[foliage].mean()))
+            healthy = "YES" if percentage >= 70 else "NO"
+            if healthy == "NO":
+                reasons = [f"Only {percentage}% of the foliage matches the {season.lower()} leaf colors"]
+        else:
+            reasons = ["No seasonal leaf colors to compare with"]
+    else:
+        reasons = [f"Too little foliage to judge ({coverage:.0%} of the frame)"]
+    if reasons:
+        reasons.append("Scored locally while the AI diagnosis budget is spent")
+    return {
+        "species": species,
+        "healthy": healthy,
+        "percentage": percentage,
+        "observed_leaf_color": observed,
+        "expected_leaf_colors": expected,
+        "foliage_coverage": round(coverage, 3),
+        "reasons_unhealthy": reasons,
+        "treatment_recommendations": [
+            "Keep to the species' watering schedule",
+            "Check the leaves in person for spots, wilting or pests",
+            "A full diagnosis will run again once the budget allows",
+        ],
+        "Watering Schedule": care_fields(recommendations).get("Watering Schedule"),
+        "timestamp": when.isoformat(timespec="seconds") + "Z",
+        "scoring": "local",
+    }
+
+
+def captured_at_of(image_path: Path) -> str:
+    """UTC ISO time the frame was saved (its mtime)."""
+    mtime = Path(image_path).stat().st_mtime
+    return datetime.datetime.utcfromtimestamp(mtime).isoformat(timespec="seconds") + "Z"
+
+
+def name_leaf_colors(diagnosis: dict):
+    """Adds observed_leaf_color_name / expected_leaf_color_names, in place (one batched lookup)."""
+    expected = diagnosis.get("expected_leaf_colors")
+    expected = expected if isinstance(expected, list) else []
+    names = [name for name, _ in nearest([diagnosis.get("observed_leaf_color")] + expected)]
+    diagnosis["observed_leaf_color_name"] = names[0]
+    diagnosis["expected_leaf_color_names"] = names[1:]
+
+
+def check_leaf_color_match(diagnosis: dict):
+    """Recomputes leaf_color_match from the observed/expected hex colors, in place."""
     observed_hex = diagnosis.get("observed_leaf_color")
     expected_list = diagnosis.get("expected_leaf_colors", [])
 
@@ -302,15 +543,53 @@ def main():
                 if mismatch_msg not in diagnosis["reasons_unhealthy"]:
                     diagnosis["reasons_unhealthy"].insert(0, mismatch_msg)
 
-    # 6) Write out the final JSON to finalSuggestions/{species}Rec.json
-    output_path = FINAL_DIR / f"{species}Rec.json"
-    try:
-        with open(output_path, "w") as out_f:
-            json.dump(diagnosis, out_f, indent=2)
-        print(f"\n✅ Pipeline complete. Wrote JSON to {output_path}")
-    except Exception as e:
-        print(f"ERROR: Failed to write final JSON: {e}")
+
+def main():
+    if sys.argv[1:2] == ["worker"]:
+        from src.worker import main as worker_main
+        return worker_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(
+        description="Run tree care + health pipeline on a single image."
+    )
+    parser.add_argument("--image",   required=True, help="Path to the JPEG image (species_<orig>.jpg)")
+    parser.add_argument("--species", required=True, help="Species name (e.g. 'oak', 'pine')")
+    parser.add_argument("--zip",     required=True, help="5-digit US ZIP code for location")
+    parser.add_argument("--defer",   action="store_true",
+                        help="Queue the image for the next batch submission instead of diagnosing now")
+    args = parser.parse_args()
+
+    image_path = Path(args.image)
+    species    = args.species.strip().lower()
+    zip_code   = args.zip.strip()
+
+    configure_logging("pipeline")
+    set_correlation_id()
+    persist_metrics_on_exit()
+
+    if not image_path.is_file():
+        log.error("Image not found: %s", image_path)
+        sys.exit(2)
+
+    if not (zip_code.isdigit() and len(zip_code) == 5):
+        log.error("ZIP code must be exactly 5 digits.")
+        sys.exit(2)
+
+    if args.defer:
+        from src.batch_diagnosis import enqueue
+        with span("pipeline", image=image_path.name, species=species, mode="deferred"):
+            custom_id = enqueue(image_path, species, zip_code)
+        PIPELINE_RUNS.inc(result="deferred" if custom_id else "error")
+        sys.exit(0 if custom_id else 1)
+
+    with span("pipeline", image=image_path.name, species=species):
+        diagnosis = run_pipeline(image_path, species, zip_code)
+    if diagnosis is None:
+        PIPELINE_RUNS.inc(result="error")
+    else:
+        PIPELINE_RUNS.inc(result="local" if diagnosis.get("scoring") == "local" else "ok")
+    sys.exit(0 if diagnosis is not None else 1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -9,11 +9,15 @@ Called by server_http.py whenever a new JPEG arrives from the Pi.
 3) Rename the JPEG to include the species.
 4) Ask for ZIP code.
 5) Call pipeline.py --image <newPath> --species <species> --zip <ZIP>.
+
+If server_http.py already knows the species and ZIP (sent by the camera
+in the upload), they're passed as --species/--zip and nothing is prompted.
 """
 
 import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import argparse
 import subprocess
 from pathlib import Path
 
@@ -33,11 +37,13 @@ PLANT_KEYWORDS = {
 }
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python3 process_image.py /path/to/image.jpg")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Hand a received camera image to pipeline.py.")
+    parser.add_argument("image", help="Path to the received JPEG")
+    parser.add_argument("--species", help="Tree species; prompted for if omitted")
+    parser.add_argument("--zip", help="5-digit ZIP code; prompted for if omitted")
+    args = parser.parse_args()
 
-    orig_path = Path(sys.argv[1])
+    orig_path = Path(args.image)
     if not orig_path.is_file():
         print(f"ERROR: File not found: {orig_path}")
         sys.exit(1)
@@ -45,23 +51,26 @@ def main():
     print(f"\n▶ Processing '{orig_path.name}' …")
 
     # 2) Prompt for species
-    while True:
+    species = (args.species or "").strip().lower()
+    while not species:
         species = input("Enter TREE SPECIES (e.g. 'oak', 'pine'): ").strip().lower()
         if species:
             break
         print(" – Please type a non‐empty species name and press ENTER.")
 
     # 4) Prompt for ZIP code
-    zip_code = input("Enter your 5-digit ZIP code for care location: ").strip()
+    zip_code = (args.zip or "").strip()
+    if not zip_code:
+        zip_code = input("Enter your 5-digit ZIP code for care location: ").strip()
     if not (zip_code.isdigit() and len(zip_code) == 5):
         print("Error: ZIP code must be exactly 5 digits.")
-        sys.exit(1)
+        sys.exit(2)
 
     # 5) Call the pipeline
     try:
         pipeline_path = Path(__file__).parent / "pipeline.py"
         subprocess.run(
-            ["python3", str(pipeline_path),
+            [sys.executable, str(pipeline_path),
              "--image", str(orig_path),
              "--species", species,
              "--zip", zip_code],
@@ -70,7 +79,7 @@ def main():
         print(f" ↪ Launched pipeline.py on '{orig_path.name}' (species={species})")
     except subprocess.CalledProcessError as e:
         print(f"❌ pipeline.py failed: {e}")
-        sys.exit(1)
+        sys.exit(e.returncode)
 
     print("✅ Finished process_image.\n")
 
@@ -0,0 +1,162 @@
+"""
+prompts.py
+
+Builds the model prompts for the diagnosis pipeline and the camera chat.
+
+Two things keep prompts small and cache-friendly:
+
+  • Only what the model needs is sent: the current season's leaf/trunk
+    palette plus the care ranges, serialized compactly. The other three
+    seasons, the Recommendations prose and the cached (stale) weather stay
+    out of the diagnosis prompt.
+  • Content is ordered from most to least stable: the static system prompt,
+    then the species/season block, then the image(s), then per-call details
+    (time, location). The prefix up to the images is byte-identical across
+    calls for the same species and season, so provider-side prefix caching
+    applies once it passes the provider's minimum length.
+
+record_usage() tracks the prompt and cached tokens each call reports.
+"""
+
+import json
+import datetime
+
+from src.instrumentation import counter, histogram
+
+SEASONS = ("Spring", "Summer", "Autumn", "Winter")
+# Northern-hemisphere meteorological seasons by month; flipped south of the equator
+_MONTH_SEASON = {12: 3, 1: 3, 2: 3, 3: 0, 4: 0, 5: 0, 6: 1, 7: 1, 8: 1, 9: 2, 10: 2, 11: 2}
+# Care fields the diagnosis uses; the seasonal palettes are narrowed to one season
+CARE_FIELDS = ("Temp", "Humidity", "Soil PH", "Watering Schedule")
+SEASONAL_FIELDS = ("Leaf color", "Trunk color")
+
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+PROMPT_TOKENS = histogram("ff_prompt_tokens", "Prompt tokens per model call.", TOKEN_BUCKETS)
+CACHED_TOKENS = counter("ff_prompt_cached_tokens_total", "Prompt tokens served from the provider's prompt cache.")
+
+DIAGNOSIS_SYSTEM_PROMPT = (
+    "You are a helpful assistant who, when given:\n"
+    "  1) one or more images of a tree/plant's foliage\n"
+    "  2) its care ranges for the current season (including hex leaf/trunk colors)\n\n"
+    "You will return exactly one JSON object (no Markdown fences, no extra commentary) containing:\n"
+    '  • "species": the species name (string)\n'
+    '  • "healthy": "YES" or "NO"\n'
+    '  • "percentage": a percentage value (0–100) on how healthy the tree is.\n'
+    '  • "observed_leaf_color": a single hex code (e.g. "#RRGGBB") for the dominant leaf color\n'
+    '    (⚠️Ignore bark/trunk/branches—sample only leaf/foliage pixels.)\n'
+    '  • "expected_leaf_colors": an array of five hex codes for this season\'s recommended leaf colors\n'
+    '  • "reasons_unhealthy": if `"healthy" == "NO"`, an array of exactly three short strings; if `"healthy" == "YES"`, an empty array\n'
+    '  • "treatment_recommendations": an array of three strings with concrete steps to improve plant health\n'
+    "  • 'Watering Schedule': recommended watering frequency MUST BE A NUMBER. (e.g. for once a week do 7, for twice a week do 3 etc.).\n"
+    '  • "timestamp": current UTC date/time in ISO 8601 (e.g. "2025-06-02T22:39:11Z")\n\n'
+    "⚠️IMPORTANT: Do not sample trunk or brown/bark areas—focus only on green leaf pixels.\n\n"
+    "Strictly output only valid JSON—no Markdown fences, no extra keys, no commentary.\n"
+)
+
+CHAT_INSTRUCTIONS = (
+    "You are a plant care assistant for a tree described below.\n"
+    "Use the JSON data provided to inform your responses.\n"
+    "You may also draw on standard care practices for the species (e.g., typical watering frequency) "
+    "to supplement the data when needed.\n"
+    "Keep answers short and concise, but still accurate.\n"
+)
+
+
+def compact_json(obj) -> str:
+    """Deterministic, whitespace-free JSON (same input → same bytes)."""
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count via tiktoken when installed, else the ~4 chars/token rule of thumb."""
+    try:
+        import tiktoken
+        return len(tiktoken.encoding_for_model("gpt-4o").encode(text))
+    except Exception:
+        return max(1, len(text) // 4)
+
+
+def season_for(when: datetime.datetime, latitude=None) -> str:
+    idx = _MONTH_SEASON[when.month]
+    if latitude is not None and float(latitude) < 0:
+        idx = (idx + 2) % 4
+    return SEASONS[idx]
+
+
+def care_fields(recommendations: dict) -> dict:
+    """The species care dict, whether or not it's wrapped the way recom.py saves it."""
+    inner = recommendations.get("recommendations")
+    return inner if isinstance(inner, dict) else recommendations
+
+
+def seasonal_care(recommendations: dict, season: str) -> dict:
+    """Care ranges plus the given season's palettes; everything else is dropped."""
+    care = care_fields(recommendations)
+    out = {k: care[k] for k in CARE_FIELDS if k in care}
+    for key in SEASONAL_FIELDS:
+        palette = care.get(key)
+        if isinstance(palette, dict) and season in palette:
+            out[key] = palette[season]
+    return out
+
+
+def diagnosis_messages(recommendations: dict, image_urls: list, when: datetime.datetime = None) -> list:
+    """Chat messages for one diagnosis, ordered stable-first (see module docstring)."""
+    when = when or datetime.datetime.utcnow()
+    lat, lon = recommendations.get("latitude"), recommendations.get("longitude")
+    species = recommendations.get("species") or care_fields(recommendations).get("species") or "unknown"
+    season = season_for(when, lat)
+
+    species_block = (
+        f"Species: {species}\n"
+        f"Season: {season}\n"
+        f"Care ranges for this season (JSON): {compact_json(seasonal_care(recommendations, season))}\n"
+        "Analyze the plant image(s) against these ranges, then return the required JSON."
+    )
+    call_block = f"Current UTC time: {when.isoformat(timespec='seconds')}Z. Location: lat {lat}, lon {lon}."
+    if len(image_urls) > 1:
+        call_block += f" The {len(image_urls)} images are separate crops of the same tree's canopy."
+
+    content = [{"type": "text", "text": species_block}]
+    content += [{"type": "image_url", "image_url": {"url": url, "detail": "high"}} for url in image_urls]
+    content.append({"type": "text", "text": call_block})
+    return [
+        {"role": "system", "content": DIAGNOSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+
+def chat_system_prompt(species: str, care: dict, health: dict) -> str:
+    """Camera chat system prompt: static instructions, then species care, then the latest diagnosis."""
+    return (
+        CHAT_INSTRUCTIONS
+        + f"Species: {species}\n"
+        + f"Care recommendations (JSON): {compact_json(care)}\n"
+        + f"Current health analysis (JSON): {compact_json(health)}\n"
+    )
+
+
+def prompt_text(messages: list) -> str:
+    """All text parts of a message list, for size/token estimates (images excluded)."""
+    parts = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(p.get("text", "") for p in content or [] if p.get("type") == "text")
+    return "\n".join(parts)
+
+
+def record_usage(usage, kind: str):
+    """Records prompt/cached tokens from a response's usage (SDK object or batch dict)."""
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+    prompt_tokens = usage.get("prompt_tokens")
+    if prompt_tokens is not None:
+        PROMPT_TOKENS.observe(prompt_tokens, kind=kind)
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    if cached:
+        CACHED_TOKENS.inc(cached, kind=kind)
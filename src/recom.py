@@ -9,7 +9,9 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from youtube_transcript_api._api import YouTubeTranscriptApi
 from openai import OpenAI
-from webcolors import hex_to_name, CSS3
+from src.instrumentation import API_CALLS, API_ERRORS, span
+from src.color_names import name_color, name_palette
+from src import budget
 import ssl
 
 requests.packages.urllib3.disable_warnings()
@@ -29,25 +31,38 @@ openWeatherMapAPIKEY = os.getenv("OPENWEATHERMAP_API_KEY")
 
 YOUTUBE_PROXY_URL = os.getenv("YOUTUBE_PROXY_URL")
 
+# Endpoint overrides so the offline benchmark (bench/) can point every
+# external call at its local stand-in servers.
+YOUTUBE_API_ENDPOINT = os.getenv("YOUTUBE_API_ENDPOINT")
+YOUTUBE_TRANSCRIPT_BASE_URL = os.getenv("YOUTUBE_TRANSCRIPT_BASE_URL")
+OPENWEATHERMAP_URL = os.getenv("OPENWEATHERMAP_URL", "http://api.openweathermap.org/data/2.5/weather")
+
+if YOUTUBE_TRANSCRIPT_BASE_URL:
+    from youtube_transcript_api import _transcripts
+    _transcripts.WATCH_URL = YOUTUBE_TRANSCRIPT_BASE_URL.rstrip("/") + "/watch?v={video_id}"
+    _transcripts.INNERTUBE_API_URL = YOUTUBE_TRANSCRIPT_BASE_URL.rstrip("/") + "/youtubei/v1/player?key={api_key}"
+
 ssl._create_default_https_context = ssl._create_unverified_context #!!!ONLY FOR TESTING NEED FIX
 
 def get_closest_color_name(hex_color):
-    """Converts a hex color code to its closest CSS3 color name."""
-    try:
-        return hex_to_name(hex_color, spec=CSS3)
-    except ValueError:
-        return "Color name not found"
+    """Name of the perceptually nearest CSS3/horticultural color (see color_names.py)."""
+    return name_color(hex_color) or "Color name not found"
+
+def get_palette_color_names(rec_data):
+    """Names for the seasonal "Leaf color"/"Trunk color" palettes, in one batched lookup."""
+    palettes = {k: rec_data[k] for k in ("Leaf color", "Trunk color") if isinstance(rec_data.get(k), dict)}
+    return name_palette(palettes)
 
 def get_youtube_transcript_text_only(video_id):
     """Fetches the transcript of a YouTube video (if available)."""
+    API_CALLS.inc(api="youtube_transcript")
     try:
-        transcript = YouTubeTranscriptApi.get_transcript(
-            video_id,
-            proxies={"http": YOUTUBE_PROXY_URL, "https": YOUTUBE_PROXY_URL}
-        )
+        proxies = {"http": YOUTUBE_PROXY_URL, "https": YOUTUBE_PROXY_URL} if YOUTUBE_PROXY_URL else None
+        transcript = YouTubeTranscriptApi.get_transcript(video_id, proxies=proxies)
         return " ".join(entry["text"] for entry in transcript).strip()
     except Exception as e:
         # Silent fail if no transcript or proxy issue
+        API_ERRORS.inc(api="youtube_transcript")
         print(f"Error fetching transcript for video {video_id}: {e}")
         return None
 
@@ -62,8 +77,11 @@ def get_youtube_id_and_transcript(species_name):
     vid_id = None
     transcript_text = None
     try:
-        youtube = build("youtube", "v3", developerKey=youtubeAPIKEY)
+        client_options = {"api_endpoint": YOUTUBE_API_ENDPOINT} if YOUTUBE_API_ENDPOINT else None
+        youtube = build("youtube", "v3", developerKey=youtubeAPIKEY, client_options=client_options)
         search_query = f"How to care for {species_name}"
+        budget.acquire("youtube", **budget.context())
+        API_CALLS.inc(api="youtube")
         results = (
             youtube.search()
                    .list(part="snippet", q=search_query, maxResults=4)
@@ -83,10 +101,15 @@ def get_youtube_id_and_transcript(species_name):
                 break
         return vid_id, transcript_text
 
+    except budget.BudgetExceeded as e:
+        print(f"Skipping YouTube: {e}")
+        return None, None
     except HttpError as e:
+        API_ERRORS.inc(api="youtube")
         print(f"YouTube Data API HTTP error: {e}")
         return None, None
     except Exception as e:
+        API_ERRORS.inc(api="youtube")
         print(f"Unexpected YouTube error: {e}")
         return None, None
     finally:
@@ -129,6 +152,9 @@ def get_recommendations_from_openai(transcript_content, species_name):
         f"Transcript: {transcript_content}"
     )
 
+    # raises BudgetExceeded: no care JSON is better than an empty one saved to disk
+    grant = budget.acquire("openai", tokens=2000, **budget.context())
+    API_CALLS.inc(api="openai")
     try:
         resp = client.chat.completions.create(
             model="gpt-4o",
@@ -137,6 +163,7 @@ def get_recommendations_from_openai(transcript_content, species_name):
                 {"role": "user",   "content": user_prompt},
             ],
         )
+        grant.settle(getattr(getattr(resp, "usage", None), "total_tokens", None))
         raw = resp.choices[0].message.content
         if raw and isinstance(raw, str):
             if raw.startswith("```json") and raw.endswith("```"):
@@ -145,6 +172,7 @@ def get_recommendations_from_openai(transcript_content, species_name):
         else:
             return "{}"
     except Exception as e:
+        API_ERRORS.inc(api="openai")
         print(f"OpenAI error: {e}")
         return "{}"
 
@@ -154,9 +182,16 @@ def get_weather_data(latitude, longitude):
         print("Warning: OPENWEATHERMAP_API_KEY not set, skipping weather.")
         return None
 
+    try:
+        budget.acquire("openweathermap", **budget.context())
+    except budget.BudgetExceeded as e:
+        print(f"Skipping weather: {e}")
+        return None
+
+    API_CALLS.inc(api="openweathermap")
     try:
         url = (
-            f"http://api.openweathermap.org/data/2.5/weather?"
+            f"{OPENWEATHERMAP_URL}?"
             f"lat={latitude}&lon={longitude}&appid={openWeatherMapAPIKEY}&units=imperial"
         )
         r = requests.get(url, timeout=10)
@@ -175,6 +210,7 @@ def get_weather_data(latitude, longitude):
             "city": city,
         }
     except Exception as e:
+        API_ERRORS.inc(api="openweathermap")
         print(f"Error fetching weather: {e}")
         return None
 
@@ -191,13 +227,15 @@ def generate_tree_care_json(
     4) Combine into one dict, save to disk, and return it.
     """
     # 1. YouTube transcript
-    vid_id, transcript = get_youtube_id_and_transcript(species_name)
+    with span("youtube", species=species_name):
+        vid_id, transcript = get_youtube_id_and_transcript(species_name)
     if not transcript:
         print("Could not find any transcript. ⚠️ Going to default")
         transcript = f"Caring for a {species_name} tree."
 
     # 2. OpenAI JSON string
-    raw_json = get_recommendations_from_openai(transcript, species_name)
+    with span("care_openai", species=species_name):
+        raw_json = get_recommendations_from_openai(transcript, species_name)
     if not raw_json:
         print("OpenAI did not return any JSON.")
         return {}
@@ -209,12 +247,15 @@ def generate_tree_care_json(
         return {}
 
     # 3. Weather lookup
-    weather = get_weather_data(latitude, longitude) or {}
+    with span("weather"):
+        # no location when the geocode budget was spent
+        weather = (get_weather_data(latitude, longitude) if latitude is not None else None) or {}
 
     # 4. Combine & save
     out = {
         "species": species_name,
         "recommendations": rec_data,
+        "color_names": get_palette_color_names(rec_data),
         "current_weather": weather,
     }
 
@@ -1,19 +1,119 @@
 # server_http.py
 
 import os
+import re
 import json
 import base64
-import subprocess
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
 from pathlib import Path
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask_cors import CORS
+from flask_jwt_extended import JWTManager, get_jwt, get_jwt_identity, verify_jwt_in_request
 import sys
-from pathlib import Path
+from dotenv import load_dotenv
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-app = Flask(__name__)
+from src.instrumentation import (
+    PAYLOAD_BYTES, configure_logging, log_event, new_correlation_id,
+    register_metrics
+)
+from src.frame_select import FrameWindow, score_frame
+from src.cadence import UNCHANGED, CadenceScheduler
+from src.job_queue import open_queue
+from src.worker import resolve_inputs
+from src import budget
+from src import watering
+from src.timelapse import FORMATS, MAX_SIDE, FrameIndex, TimelapseRenderer, parse_time
+from src.static_assets import StaticAssets
+# static/ is served by StaticAssets (hashed, precompressed), not Flask's default route
+app = Flask(__name__, static_folder=None)
+CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=["ETag", "Last-Modified"])
+load_dotenv()
+# tokens are issued by auth_api.py; same secret, so admin claims can be checked here
+if not os.getenv('JWT_SECRET_KEY'):
+    raise SystemExit("JWT_SECRET_KEY is not set (it must match auth_api.py's)")
+app.config['JWT_SECRET_KEY'] = os.environ['JWT_SECRET_KEY']
+jwt = JWTManager(app)
+configure_logging("server_http")
+# the one /metrics that also reports pipeline, worker and batch runs
+register_metrics(app, "server_http", include_shared=True)
+static_assets = StaticAssets()
+static_assets.register(app)
 
 # Directory where incoming images are saved
 PI_INPUT = Path("pi_input_http")
 PI_INPUT.mkdir(exist_ok=True)
+frame_index = FrameIndex(PI_INPUT)
+timelapse = TimelapseRenderer(PI_INPUT, index=frame_index)
+
+
+cadence = CadenceScheduler()
+job_queue = open_queue()
+
+
+def launch_pipeline(camera_id, img_path, meta, metrics):
+    """
+    Queues the frame picked by the camera's selection window for a pipeline
+    worker (python src/pipeline.py worker, on this or any other node), if
+    the camera's cadence says a diagnosis is due; otherwise the frame just
+    stays archived. The upload's camera, filename and timestamp make the
+    job key, so a re-sent upload isn't diagnosed twice. Species/ZIP missing
+    from the upload come from the camera registry (worker.resolve_inputs);
+    a frame with neither is not queued, since no worker could run it.
+    """
+    correlation_id = meta.get("correlation_id") or new_correlation_id()
+    inputs = resolve_inputs({"camera_id": camera_id, "species": meta.get("species"), "zip": meta.get("zip")})
+    if not (inputs["species"] and inputs["zip"]):
+        log_event("frame_not_queued", level=logging.WARNING, camera=camera_id,
+                  reason="no species/zip in the upload, cameras.json or PIPELINE_DEFAULT_ZIP",
+                  correlation_id=correlation_id)
+        return
+    meta = {**meta, "species": inputs["species"], "zip": inputs["zip"]}
+    if metrics is None and cadence.policy.enabled:
+        try:
+            metrics = score_frame(img_path)
+        except Exception:
+            metrics = None
+    if not cadence.should_diagnose(camera_id, meta, metrics):
+        return
+    key = f"{camera_id}/{Path(img_path).name}/{meta.get('timestamp') or ''}"
+    try:
+        job_id, added = job_queue.enqueue(key, {
+            "image": str(Path(img_path).resolve()),
+            "camera_id": camera_id,
+            "species": meta.get("species"),
+            "zip": meta.get("zip"),
+            "priority": "scheduled",
+            "correlation_id": correlation_id,
+        })
+        log_event("job_queued" if added else "job_duplicate", camera=camera_id, job=job_id,
+                  correlation_id=correlation_id)
+    except Exception as e:
+        log_event("enqueue_failed", level=logging.ERROR, camera=camera_id, error=str(e),
+                  correlation_id=correlation_id)
+
+
+frame_window = FrameWindow(on_select=launch_pipeline)
+
+
+# camera IDs name index files; both show up on the admin page
+CAMERA_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+SPECIES = re.compile(r"^[A-Za-z][A-Za-z0-9 _-]{0,63}$")
+
+
+def camera_id_for(data: dict, filename: str) -> str:
+    """
+    Camera ID from the payload, else the filename prefix (e.g. "oak" in
+    oak_pi_cam_1.jpg); None if it isn't 1-64 letters, digits, '_' or '-'.
+    """
+    if data.get("camera_id"):
+        camera_id = str(data["camera_id"])
+    else:
+        camera_id = Path(filename).stem.split("_", 1)[0] or "default"
+    return camera_id if CAMERA_ID.match(camera_id) else None
 
 @app.route("/plants/health", methods=["POST"])
 def plants_health():
@@ -22,9 +122,17 @@ def plants_health():
       {
         "timestamp": "...",
         "filename": "someName.jpg",
-        "image_b64": "<base64-encoded JPEG>"
+        "image_b64": "<base64-encoded JPEG>",
+        "camera_id": "oak",    (optional, defaults to the filename prefix)
+        "species": "oak",      (optional)
+        "zip": "06870"         (optional)
       }
-    Saves the JPEG under pi_input_http/<filename>, then spawns process_image.py.
+    Saves the JPEG under pi_input_http/<filename>, indexes it for time-lapses
+    and adds it to the camera's frame-selection window. The best frame of
+    the window is queued as a pipeline job if the camera's cadence says a
+    diagnosis is due (launch_pipeline). species/zip not sent with the upload
+    are taken from the camera registry (cameras.json, PIPELINE_DEFAULT_ZIP);
+    frames with neither are archived but not queued.
     """
     data = request.get_json(force=True)
     if not data:
@@ -36,6 +144,12 @@ def plants_health():
 
     if not (ts and name and img_b64):
         return jsonify({"error": "missing fields"}), 400
+    name = Path(str(name)).name  # never write outside PI_INPUT
+    camera_id = camera_id_for(data, name)
+    if not (name and camera_id):
+        return jsonify({"error": "invalid filename or camera_id"}), 400
+    if data.get("species") and not SPECIES.match(str(data["species"])):
+        return jsonify({"error": "invalid species"}), 400
 
     # 1) Decode & write the JPEG
     img_path = PI_INPUT / name
@@ -44,20 +158,261 @@ def plants_health():
     except Exception as e:
         return jsonify({"error": f"Failed to write image: {e}"}), 500
 
-    print(f"✅ Saved image {name} to {PI_INPUT}/")
+    # one ID follows this image through process_image.py and pipeline.py logs
+    correlation_id = new_correlation_id()
+    PAYLOAD_BYTES.observe(len(img_b64), kind="upload")
+    log_event("image_saved", filename=name, path=str(img_path), correlation_id=correlation_id)
 
-    # 2) Spawn process_image.py (in the same folder) to do the rest.
-    #    We use Popen so Flask returns immediately without waiting.
+    # 2) Let the camera's selection window decide whether this frame gets diagnosed
+    frame_index.record(camera_id, img_path, time.time())
+    frame_window.add(camera_id, img_path, {
+        "species": data.get("species"),
+        "zip": data.get("zip"),
+        "timestamp": ts,
+        "correlation_id": correlation_id,
+    })
+
+    return jsonify({"status": "ok", "camera_id": camera_id, "correlation_id": correlation_id}), 200
+
+# auth_api.py's revocation list (logged-out tokens), re-read every AUTH_REVOCATION_CACHE_TTL seconds
+AUTH_DB = Path(os.getenv("AUTH_DB_PATH", Path(__file__).resolve().parent / "auth" / "auth.db"))
+REVOCATION_CACHE_TTL = float(os.getenv("AUTH_REVOCATION_CACHE_TTL", "30"))
+_revoked = frozenset()
+_revoked_loaded_at = 0.0
+_revoked_lock = threading.Lock()
+
+
+def revoked_jtis() -> frozenset:
+    global _revoked, _revoked_loaded_at
+    now = time.time()
+    with _revoked_lock:
+        if now - _revoked_loaded_at >= REVOCATION_CACHE_TTL:
+            _revoked_loaded_at = now
+            try:
+                db = sqlite3.connect(f"file:{AUTH_DB}?mode=ro", uri=True, timeout=5)
+                try:
+                    _revoked = frozenset(jti for (jti,) in db.execute("SELECT jti FROM revoked_token"))
+                finally:
+                    db.close()
+            except sqlite3.Error as e:
+                # no auth.db yet means no tokens were ever issued; otherwise keep the last list
+                log_event("revocation_list_unavailable", level=logging.WARNING, path=str(AUTH_DB), error=str(e))
+    return _revoked
+
+
+@jwt.token_in_blocklist_loader
+def is_token_revoked(_jwt_header, jwt_payload):
+    return jwt_payload["jti"] in revoked_jtis()
+
+
+def _require_admin():
+    """None if the request carries an admin token from auth_api, else an error response."""
     try:
-        process_image_path = Path(__file__).parent / "process_image.py"
-        subprocess.Popen(
-            ["python3", str(process_image_path), str(img_path)]
-        )
-    except Exception as e:
-        print(f"❌ Error launching process_image.py: {e}")
+        verify_jwt_in_request()
+    except Exception:
+        return jsonify({"error": "Missing or invalid token."}), 401
+    if not get_jwt().get("is_admin"):
+        return jsonify({"error": "Forbidden"}), 403
+    return None
+
+
+def _require_camera(camera_id):
+    """None if the request's token may see camera_id (admin, or assigned in auth_api), else an error response."""
+    try:
+        verify_jwt_in_request()
+    except Exception:
+        return jsonify({"error": "Missing or invalid token."}), 401
+    claims = get_jwt()
+    if claims.get("is_admin"):
+        return None
+    try:
+        db = sqlite3.connect(f"file:{AUTH_DB}?mode=ro", uri=True, timeout=5)
+        try:
+            assigned = db.execute("SELECT 1 FROM user_camera WHERE user_id = ? AND camera_id = ?",
+                                  (int(get_jwt_identity()), camera_id)).fetchone()
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        log_event("camera_assignment_unavailable", level=logging.WARNING, path=str(AUTH_DB), error=str(e))
+        return jsonify({"error": "Server busy, please retry shortly."}), 503
+    if not assigned:
+        # same answer as auth_api's GET /api/cameras/<id> for someone else's camera
+        return jsonify({"error": "Camera not found."}), 404
+    return None
+
+
+@app.route("/api/admin/cadence", methods=["GET"])
+def admin_cadence():
+    """Each camera's current diagnosis interval, why, and when it's next due."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    return jsonify({"policy": cadence.policy_dict(), "cameras": cadence.snapshot()})
+
+
+@app.route("/api/admin/cadence/<camera_id>", methods=["POST"])
+def admin_cadence_update(camera_id):
+    """
+    Expects JSON: {"pinned_seconds": 3600 | null, "diagnose_next": true}
+    pinned_seconds fixes the camera's interval (null returns it to adaptive;
+    leaving it out keeps the current pin); diagnose_next makes its next
+    selected frame due.
+    """
+    denied = _require_admin()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    pinned = data.get("pinned_seconds", UNCHANGED)
+    try:
+        if pinned is not UNCHANGED and pinned is not None and float(pinned) <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({"error": "pinned_seconds must be a positive number or null"}), 400
+    cadence.configure(camera_id, pinned=pinned, diagnose_next=bool(data.get("diagnose_next")))
+    return jsonify({"camera": next(c for c in cadence.snapshot() if c["camera_id"] == camera_id)})
+
+
+@app.route("/api/admin/queue", methods=["GET"])
+def admin_queue():
+    """Pipeline queue depth per state and the most recent dead-lettered jobs."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    return jsonify({"stats": job_queue.stats(), "dead": job_queue.dead_letters(limit=50)})
+
+
+@app.route("/api/admin/queue/<int:job_id>/requeue", methods=["POST"])
+def admin_queue_requeue(job_id):
+    denied = _require_admin()
+    if denied:
+        return denied
+    if not job_queue.requeue(job_id):
+        return jsonify({"error": "no dead-lettered job with that ID"}), 404
+    return jsonify({"requeued": job_id})
+
+
+@app.route("/api/admin/budget", methods=["GET"])
+def admin_budget():
+    """Every API budget window with its use and what's left (global, then per camera)."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    return jsonify({"limits": budget.default_governor().snapshot(), "shares": budget.SHARES})
+
+
+CALENDAR_MAX_AGE = int(os.getenv("CALENDAR_MAX_AGE", "300"))
+
+
+def _calendar_cameras() -> list:
+    try:
+        with open(watering.DATA_DIR / "cameras.json") as f:
+            return [{"id": c.get("id"), "name": c.get("name"), "species": c.get("species")}
+                    for c in json.load(f)]
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def _calendar_response(fmt: str):
+    try:
+        start, end = watering.parse_range(request.args.get("from"), request.args.get("to"),
+                                          feed=(fmt == "ics"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    store = watering.load()
+    cameras_file = watering.DATA_DIR / "cameras.json"
+    cameras_mtime = int(cameras_file.stat().st_mtime) if cameras_file.exists() else 0
+    etag = hashlib.sha1(f"{store['version']}:{cameras_mtime}:{start}:{end}:{fmt}".encode()).hexdigest()[:20]
+    last_modified = max(store.get("updated_at", 0), cameras_mtime)
+
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        cameras = _calendar_cameras()
+        species_events = watering.events(store, start, end)
+        # only species that have a camera (all of them if cameras.json is missing)
+        if cameras:
+            # store keys are the lowercased species pipeline.py records
+            wanted = {str(c["species"] or "").lower() for c in cameras}
+            species_events = {s: e for s, e in species_events.items() if s in wanted}
+        if fmt == "ics":
+            resp = Response(watering.to_ics(species_events, cameras, last_modified),
+                            mimetype="text/calendar")
+        else:
+            body = {"from": start.isoformat(), "to": end.isoformat(),
+                    "cameras": cameras, "species": species_events}
+            resp = Response(json.dumps(body, separators=(",", ":")), mimetype="application/json")
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.headers["Cache-Control"] = f"public, max-age={CALENDAR_MAX_AGE}"
+    return resp
+
+
+@app.route("/api/calendar", methods=["GET"])
+def calendar():
+    """
+    Watering events per species between ?from=YYYY-MM-DD&to=YYYY-MM-DD
+    (default: this month), precomputed by watering.py as diagnoses land.
+    Send Accept: text/calendar (or use /api/calendar.ics) for iCalendar.
+    """
+    fmt = "ics" if request.accept_mimetypes.best == "text/calendar" else "json"
+    return _calendar_response(fmt)
+
+
+@app.route("/api/calendar.ics", methods=["GET"])
+def calendar_ics():
+    return _calendar_response("ics")
+
+
+TIMELAPSE_MAX_AGE = int(os.getenv("TIMELAPSE_MAX_AGE", "3600"))
+
+
+@app.route("/api/cameras/<camera_id>/timelapse", methods=["GET"])
+def camera_timelapse(camera_id):
+    """
+    Time-lapse of the camera's archived frames, for admins and users the
+    camera is assigned to (Authorization: Bearer <auth_api token>).
+      ?from=&to=   ISO date/datetime or unix seconds (default: the last 7 days)
+      ?fps=        1-30 (default 10)
+      ?format=     webp (default, animated) or mjpeg (streamed as it renders)
+      ?size=       longest side in pixels (default TIMELAPSE_MAX_SIDE)
+    """
+    now = time.time()
+    if not CAMERA_ID.match(camera_id):
+        return jsonify({"error": "invalid camera id"}), 400
+    denied = _require_camera(camera_id)
+    if denied:
+        return denied
+    fmt = request.args.get("format", "webp").lower()
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+    try:
+        start = parse_time(request.args.get("from"), now - 7 * 86400)
+        end = parse_time(request.args.get("to"), now)
+        fps = float(request.args.get("fps", 10))
+        size = int(request.args.get("size", MAX_SIDE))
+    except ValueError as e:
+        return jsonify({"error": f"bad parameter: {e}"}), 400
+    if end < start:
+        return jsonify({"error": "'to' is before 'from'"}), 400
+    if not (1 <= fps <= 30 and 64 <= size <= MAX_SIDE):
+        return jsonify({"error": f"fps must be 1-30 and size 64-{MAX_SIDE}"}), 400
+
+    plan = timelapse.plan(camera_id, start, end, fps, fmt, max_side=size)
+    if not plan["frames"]:
+        return jsonify({"error": "no frames in range"}), 404
+    if request.if_none_match.contains(plan["key"]):
+        return Response(status=304)
+    log_event("timelapse_request", camera=camera_id, fmt=fmt, frames=plan["frames"],
+              stride=plan["stride"], cached=plan["path"].exists())
+    resp = Response(timelapse.stream(plan), content_type=FORMATS[fmt], direct_passthrough=True)
+    resp.set_etag(plan["key"])
+    resp.headers["Cache-Control"] = f"private, max-age={TIMELAPSE_MAX_AGE}"
+    resp.headers["X-Timelapse-Frames"] = str(-(-plan["frames"] // plan["stride"]))
+    return resp
 
-    return jsonify({"status": "ok"}), 200
 
 if __name__ == "__main__":
     # Flask listens on 0.0.0.0:8080, so Pi can reach http://<PC_IP>:8080/plants/health
-    app.run(host="0.0.0.0", port=8080)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
\ No newline at end of file
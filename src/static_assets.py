@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+static_assets.py
+
+Serves the dashboard (templates/*.html and static/) from server_http.py so
+that a repeat page load transfers next to nothing:
+
+  • Every file under static/ (except data/) gets a content-hashed URL,
+    e.g. /assets/styles.3f9c2a1b7e.css, served with
+    "Cache-Control: public, max-age=31536000, immutable". A changed file
+    gets a new URL, so browsers never need to revalidate the old one.
+  • Text assets are compressed once, when the manifest is built (gzip, and
+    brotli if the `brotli` package is installed), and picked per request
+    from Accept-Encoding. Nothing is compressed on the request path.
+  • Pages are served with their stylesheet links rewritten to the hashed
+    URLs and the manifest inlined as window.ASSETS, so scripts resolve
+    cameras.json's previewImage paths with assetUrl(). Pages and
+    the public data files (cameras.json and the care/diagnosis JSONs under
+    /static/data/, rewritten by the pipeline) are "no-cache" with an ETag:
+    the browser revalidates and gets a 304. Nothing else in DATA_DIR
+    (queue/budget databases, history, caches) is served.
+
+Files that change while the server runs are re-hashed on their next
+lookup (one stat per asset per page render).
+
+    python src/static_assets.py     # print the manifest
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import os
+import re
+import gzip
+import json
+import hashlib
+import mimetypes
+import threading
+from dataclasses import dataclass, field
+
+from flask import Response, abort, request, send_from_directory
+
+from src.instrumentation import counter
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+ROOT = Path(__file__).resolve().parent.parent
+STATIC_DIR = ROOT / "static"
+TEMPLATES_DIR = ROOT / "templates"
+DATA_DIR = Path(os.getenv("FF_DATA_DIR", STATIC_DIR / "data"))
+ASSET_PREFIX = "/assets"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSIBLE = {".css", ".js", ".html", ".svg", ".json", ".txt", ".map", ".ico"}
+MIN_COMPRESS_BYTES = 512
+# the only DATA_DIR files the dashboard reads; queue/budget DBs, history etc. stay private
+PUBLIC_DATA = re.compile(r"^(?:cameras\.json|(?:finalSuggestions|savedJson)/[A-Za-z0-9 _-]+\.json)$")
+# ../static/styles.css, /static/styles.css or plain styles.css (login.html)
+STYLESHEET = re.compile(r'(<link\b[^>]*\bhref=")(?:\.\./static/|/static/)?([^":]+\.css)(")')
+
+STATIC_RESPONSES = counter("ff_static_responses_total", "Dashboard/static responses by kind, status and encoding.")
+
+
+def compress(data: bytes) -> dict:
+    """encoding → body; only encodings that actually make it smaller."""
+    variants = {"identity": data}
+    if len(data) < MIN_COMPRESS_BYTES:
+        return variants
+    packed = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        packed["br"] = brotli.compress(data, quality=11)
+    variants.update({enc: body for enc, body in packed.items() if len(body) < len(data)})
+    return variants
+
+
+@dataclass
+class Asset:
+    path: str             # relative to static/, e.g. "images/oakImage.png"
+    url: str
+    mimetype: str
+    etag: str
+    mtime: float
+    size: int
+    variants: dict = field(default_factory=dict)
+
+
+def _hashed_name(path: str, digest: str) -> str:
+    p = Path(path)
+    return str(p.with_name(f"{p.stem}.{digest[:10]}{p.suffix}"))
+
+
+def load_asset(root: Path, path: str, url_prefix: str = ASSET_PREFIX) -> Asset:
+    f = root / path
+    st = f.stat()
+    data = f.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    variants = compress(data) if f.suffix.lower() in COMPRESSIBLE else {"identity": data}
+    return Asset(path, f"{url_prefix}/{_hashed_name(path, digest)}", mimetype, digest[:20],
+                 st.st_mtime, st.st_size, variants)
+
+
+def pick_encoding(variants: dict) -> str:
+    """Best encoding the client accepts; q=0 (and absent) excludes it."""
+    for enc in ("br", "gzip"):
+        if enc in variants and request.accept_encodings[enc] > 0:
+            return enc
+    return "identity"
+
+
+def send_variants(variants: dict, mimetype: str, etag: str, cache_control: str,
+                  last_modified: float = None, kind: str = "asset") -> Response:
+    enc = pick_encoding(variants)
+    resp = Response(variants[enc], mimetype=mimetype)
+    if enc != "identity":
+        resp.headers["Content-Encoding"] = enc
+    if len(variants) > 1:
+        resp.vary.add("Accept-Encoding")
+    # one ETag per representation, so caches never mix encodings
+    resp.set_etag(etag if enc == "identity" else f"{etag}-{enc}")
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.headers["Cache-Control"] = cache_control
+    resp.make_conditional(request)
+    STATIC_RESPONSES.inc(kind=kind, status=str(resp.status_code), encoding=enc)
+    return resp
+
+
+class StaticAssets:
+    """Manifest of hashed static files plus the rendered pages that point at them."""
+
+    def __init__(self, static_dir: Path = STATIC_DIR, templates_dir: Path = TEMPLATES_DIR,
+                 data_dir: Path = DATA_DIR, url_prefix: str = ASSET_PREFIX):
+        self.static_dir = Path(static_dir)
+        self.templates_dir = Path(templates_dir)
+        self.data_dir = Path(data_dir)
+        self.url_prefix = url_prefix
+        self._lock = threading.Lock()
+        self._assets = {}    # path → Asset
+        self._by_url = {}    # hashed URL → Asset
+        self._pages = {}     # template name → (cache key, Asset)
+        self.build()
+
+    def _skip(self, f: Path) -> bool:
+        rel = f.relative_to(self.static_dir)
+        return (any(part.startswith(".") for part in rel.parts)
+                or f.resolve().is_relative_to(self.data_dir.resolve())
+                or (self.static_dir / "data") in f.parents)
+
+    def build(self):
+        """Hashes and precompresses every static file; called once at startup."""
+        assets = {}
+        if self.static_dir.is_dir():
+            for f in sorted(self.static_dir.rglob("*")):
+                if f.is_file() and not self._skip(f):
+                    path = f.relative_to(self.static_dir).as_posix()
+                    assets[path] = load_asset(self.static_dir, path, self.url_prefix)
+        with self._lock:
+            self._assets = assets
+            self._by_url = {a.url: a for a in assets.values()}
+            self._pages.clear()
+
+    def asset(self, path: str) -> Asset:
+        """Current Asset for a static path (re-hashed if the file changed), or None."""
+        path = path.lstrip("/")
+        f = self.static_dir / path
+        with self._lock:
+            current = self._assets.get(path)
+        try:
+            st = f.stat()
+        except OSError:
+            return None
+        if current is not None and (current.mtime, current.size) == (st.st_mtime, st.st_size):
+            return current
+        if not f.resolve().is_relative_to(self.static_dir.resolve()) or not f.is_file() or self._skip(f):
+            return None
+        fresh = load_asset(self.static_dir, path, self.url_prefix)
+        with self._lock:
+            self._assets[path] = fresh
+            self._by_url[fresh.url] = fresh   # old URLs keep working until restart
+        return fresh
+
+    def url_for(self, path: str) -> str:
+        a = self.asset(path)
+        return a.url if a else f"/static/{path.lstrip('/')}"
+
+    def manifest(self) -> dict:
+        with self._lock:
+            paths = list(self._assets)
+        return {p: self.url_for(p) for p in paths}
+
+    def page(self, name: str) -> Asset:
+        """templates/<name> with hashed stylesheet URLs and the manifest inlined."""
+        f = self.templates_dir / name
+        if f.suffix != ".html" or f.parent != self.templates_dir or not f.is_file():
+            return None
+        manifest = self.manifest()
+        key = (f.stat().st_mtime, json.dumps(manifest, sort_keys=True))
+        with self._lock:
+            cached = self._pages.get(name)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        def link(m):
+            url = manifest.get(m.group(2))
+            return m.group(1) + url + m.group(3) if url else m.group(0)
+
+        html = STYLESHEET.sub(link, f.read_text(encoding="utf-8"))
+        boot = ("<script>window.ASSETS=" + json.dumps(manifest, separators=(",", ":")).replace("</", "<\\/")
+                + ";window.assetUrl=function(p){return window.ASSETS[p]||\"/static/\"+p;};</script>\n")
+        html = html.replace("</head>", boot + "</head>", 1)
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        page = Asset(name, f"/{name}", "text/html", digest[:20], f.stat().st_mtime, len(data), compress(data))
+        with self._lock:
+            self._pages[name] = (key, page)
+        return page
+
+    def register(self, app):
+        """Adds the page, /assets and /static routes to a Flask app (created with static_folder=None)."""
+
+        @app.route("/", endpoint="dashboard_index")
+        @app.route("/admin", endpoint="dashboard_admin", defaults={"name": "admin.html"})
+        @app.route("/<name>.html", endpoint="dashboard_page")
+        def dashboard_page(name="index.html"):
+            if not name.endswith(".html"):
+                name += ".html"
+            page = self.page(name)
+            if page is None:
+                abort(404)
+            return send_variants(page.variants, page.mimetype, page.etag, REVALIDATE, kind="page")
+
+        @app.route(f"{self.url_prefix}/<path:name>", endpoint="dashboard_asset")
+        def dashboard_asset(name):
+            with self._lock:
+                a = self._by_url.get(f"{self.url_prefix}/{name}")
+            if a is None:
+                abort(404)
+            return send_variants(a.variants, a.mimetype, a.etag, IMMUTABLE, a.mtime)
+
+        @app.route("/static/data/<path:name>", endpoint="dashboard_data")
+        def dashboard_data(name):
+            if not PUBLIC_DATA.match(name):
+                abort(404)
+            # ETag + Last-Modified from the file; If-None-Match/If-Modified-Since → 304
+            resp = send_from_directory(self.data_dir, name, conditional=True, max_age=0)
+            resp.headers["Cache-Control"] = REVALIDATE
+            STATIC_RESPONSES.inc(kind="data", status=str(resp.status_code), encoding="identity")
+            return resp
+
+        @app.route("/static/<path:name>", endpoint="dashboard_static")
+        def dashboard_static(name):
+            # unhashed URLs (bookmarks, old pages) still work, but revalidate
+            a = self.asset(name)
+            if a is None:
+                abort(404)
+            return send_variants(a.variants, a.mimetype, a.etag, REVALIDATE, a.mtime, kind="static")
+
+
+def main():
+    print(json.dumps(StaticAssets().manifest(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
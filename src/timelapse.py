@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+timelapse.py
+
+Time-lapse rendering from the frames archived in pi_input_http, for
+/api/cameras/<id>/timelapse on server_http.py.
+
+Everything is a generator pipeline, so memory stays flat no matter how
+long the range is:
+
+    index lines → sampled paths → frames decoded at reduced size → encoder
+
+  • FrameIndex keeps one append-only JSONL file per camera (ts, path),
+    written by server_http as frames arrive; ranges are read by streaming
+    it. Frames archived before the index existed are found by filename
+    prefix (python src/timelapse.py index pi_input_http adds them).
+  • At most max_frames frames are used, evenly sampled over the range.
+  • Frames are decoded one at a time with JPEG draft mode straight to
+    about the output size (foliage.load_preview), then padded to a fixed
+    canvas.
+  • MJPEG is streamed part by part as frames are decoded, paced at fps.
+  • Animated WebP frames are encoded one at a time and written straight
+    into the RIFF container on disk (AnimatedWebPWriter), which only needs
+    the sizes patched at the end; the finished file is then streamed.
+
+Rendered output is cached on disk by (camera, range, params, frames used),
+so repeated views of the same range cost one file read.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import math
+import struct
+import hashlib
+import datetime
+import threading
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.foliage import load_preview
+from src.instrumentation import CACHE_HITS, CACHE_MISSES, log_event, span
+
+FRAME_SUFFIXES = (".jpg", ".jpeg")
+MAX_FRAMES = int(os.getenv("TIMELAPSE_MAX_FRAMES", "600"))
+MAX_SIDE = int(os.getenv("TIMELAPSE_MAX_SIDE", "640"))
+QUALITY = int(os.getenv("TIMELAPSE_QUALITY", "70"))
+CACHE_MAX_BYTES = int(os.getenv("TIMELAPSE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+FORMATS = {"webp": "image/webp", "mjpeg": "multipart/x-mixed-replace; boundary=frame"}
+BOUNDARY = b"frame"
+
+
+# ——— Frame index ———
+
+class FrameIndex:
+    def __init__(self, archive_dir):
+        self.archive_dir = Path(archive_dir)
+        self.index_dir = self.archive_dir / ".index"
+        self._lock = threading.Lock()
+
+    def _file(self, camera_id: str) -> Path:
+        f = self.index_dir / f"{camera_id}.jsonl"
+        if f.resolve().parent != self.index_dir.resolve():
+            raise ValueError(f"invalid camera id: {camera_id!r}")
+        return f
+
+    def record(self, camera_id: str, image_path, ts: float = None):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        line = json.dumps({"ts": round(ts or time.time(), 3), "path": Path(image_path).name}) + "\n"
+        with self._lock, open(self._file(camera_id), "a") as f:
+            f.write(line)
+
+    def frames(self, camera_id: str, start: float, end: float):
+        """Yields (ts, path) for the camera's frames in [start, end], streaming."""
+        index_file = self._file(camera_id)
+        if not index_file.exists():
+            yield from self._scan(camera_id, start, end)
+            return
+        with open(index_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if start <= entry["ts"] <= end:
+                    yield entry["ts"], self.archive_dir / entry["path"]
+
+    def _scan(self, camera_id: str, start: float, end: float):
+        """Frames archived before the index existed: <camera>_*.jpg by mtime."""
+        found = []
+        with os.scandir(self.archive_dir) as it:
+            for e in it:
+                if e.name.startswith(f"{camera_id}_") and e.name.lower().endswith(FRAME_SUFFIXES):
+                    mtime = e.stat().st_mtime
+                    if start <= mtime <= end:
+                        found.append((mtime, e.name))
+        for mtime, name in sorted(found):
+            yield mtime, self.archive_dir / name
+
+    def rebuild(self) -> dict:
+        """Indexes every archived frame by filename prefix. Returns {camera: count}."""
+        per_camera = {}
+        with os.scandir(self.archive_dir) as it:
+            for e in it:
+                name = e.name
+                if not (e.is_file() and name.lower().endswith(FRAME_SUFFIXES)):
+                    continue
+                camera_id = Path(name).stem.split("_", 1)[0] or "default"
+                per_camera.setdefault(camera_id, []).append((e.stat().st_mtime, name))
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        for camera_id, entries in per_camera.items():
+            tmp = self._file(camera_id).with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                for ts, name in sorted(entries):
+                    f.write(json.dumps({"ts": round(ts, 3), "path": name}) + "\n")
+            os.replace(tmp, self._file(camera_id))
+        return {c: len(v) for c, v in per_camera.items()}
+
+
+def sample(frames_fn, max_frames: int):
+    """
+    Evenly samples at most max_frames from frames_fn() (called twice: once
+    to count, once to pick), without holding the frame list in memory.
+    """
+    total = sum(1 for _ in frames_fn())
+    stride = max(1, math.ceil(total / max_frames)) if max_frames else 1
+    picked = (ts_path for i, ts_path in enumerate(frames_fn()) if i % stride == 0)
+    return total, stride, picked
+
+
+# ——— Decoding ———
+
+def decode(paths, max_side: int = MAX_SIDE):
+    """Yields RGB frames padded to one canvas size, decoding one file at a time."""
+    canvas = None
+    for path in paths:
+        try:
+            img = load_preview(path, max_side)
+        except Exception as e:
+            log_event("timelapse_frame_skipped", path=str(path), error=str(e))
+            continue
+        if canvas is None:
+            canvas = img.size
+        elif img.size != canvas:
+            img = ImageOps.pad(img, canvas, color=(0, 0, 0))
+        yield img
+
+
+# ——— Encoders ———
+
+def mjpeg_parts(frames, quality: int = QUALITY):
+    """multipart/x-mixed-replace parts, one JPEG per frame."""
+    for img in frames:
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=quality)
+        data = buf.getvalue()
+        yield (b"--" + BOUNDARY + b"\r\nContent-Type: image/jpeg\r\n"
+               + f"Content-Length: {len(data)}\r\n\r\n".encode() + data + b"\r\n")
+
+
+def read_mjpeg_parts(path: Path):
+    """Replays parts from a cached MJPEG file, one at a time."""
+    with open(path, "rb") as f:
+        while True:
+            head = b""
+            while not head.endswith(b"\r\n\r\n"):
+                ch = f.read(1)
+                if not ch:
+                    return
+                head += ch
+            length = int(head.split(b"Content-Length: ", 1)[1].split(b"\r\n", 1)[0])
+            yield head + f.read(length + 2)
+
+
+def _chunks(webp: bytes) -> list:
+    """(fourcc, payload) chunks of a single-image WebP file."""
+    out, pos = [], 12
+    while pos + 8 <= len(webp):
+        fourcc, size = webp[pos:pos + 4], struct.unpack("<I", webp[pos + 4:pos + 8])[0]
+        out.append((fourcc, webp[pos + 8:pos + 8 + size]))
+        pos += 8 + size + (size & 1)
+    return out
+
+
+def _chunk(fourcc: bytes, payload: bytes) -> bytes:
+    return fourcc + struct.pack("<I", len(payload)) + payload + (b"\x00" if len(payload) & 1 else b"")
+
+
+def _u24(n: int) -> bytes:
+    return struct.pack("<I", n)[:3]
+
+
+class AnimatedWebPWriter:
+    """
+    Writes an animated WebP frame by frame. Each frame is encoded on its
+    own by Pillow and its bitstream wrapped in an ANMF chunk; only the RIFF
+    and canvas sizes are patched once all frames are in.
+    """
+
+    def __init__(self, fp, fps: float, quality: int = QUALITY, loop: int = 0):
+        self.fp = fp
+        self.duration = max(1, round(1000 / fps))
+        self.quality = quality
+        self.loop = loop
+        self.size = None
+        self.frames = 0
+        self.alpha = False
+        fp.write(b"RIFF" + b"\x00" * 4 + b"WEBP")
+        self._vp8x_at = fp.tell()
+        fp.write(_chunk(b"VP8X", b"\x00" * 10))
+        fp.write(_chunk(b"ANIM", struct.pack("<IH", 0xFF000000, loop)))
+
+    def add(self, img: Image.Image):
+        if self.size is None:
+            self.size = img.size
+        buf = io.BytesIO()
+        img.save(buf, "WEBP", quality=self.quality)
+        chunks = [(fourcc, data) for fourcc, data in _chunks(buf.getvalue())
+                  if fourcc in (b"ALPH", b"VP8 ", b"VP8L")]
+        self.alpha = self.alpha or any(fourcc != b"VP8 " for fourcc, _ in chunks)
+        bitstream = b"".join(_chunk(fourcc, data) for fourcc, data in chunks)
+        w, h = img.size
+        header = _u24(0) + _u24(0) + _u24(w - 1) + _u24(h - 1) + _u24(self.duration) + b"\x02"  # no blending
+        self.fp.write(_chunk(b"ANMF", header + bitstream))
+        self.frames += 1
+
+    def close(self):
+        end = self.fp.tell()
+        w, h = self.size or (1, 1)
+        self.fp.seek(self._vp8x_at + 8)
+        flags = 0x02 | (0x10 if self.alpha else 0)  # animation, alpha
+        self.fp.write(bytes([flags, 0, 0, 0]) + _u24(w - 1) + _u24(h - 1))
+        self.fp.seek(4)
+        self.fp.write(struct.pack("<I", end - 8))
+        self.fp.seek(end)
+
+
+# ——— Rendering + cache ———
+
+def parse_time(value: str, default: float) -> float:
+    """Unix seconds from an ISO date/datetime (UTC if no offset) or a number."""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+class TimelapseRenderer:
+    def __init__(self, archive_dir, cache_dir=None, index: FrameIndex = None):
+        self.index = index or FrameIndex(archive_dir)
+        self.cache_dir = Path(cache_dir or Path(archive_dir) / ".timelapse")
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def plan(self, camera_id: str, start: float, end: float, fps: float, fmt: str,
+             max_side: int = MAX_SIDE, max_frames: int = MAX_FRAMES) -> dict:
+        """
+        Counts the range's frames and derives the cache key and the output
+        path; nothing is decoded here.
+        """
+        total, first, last = 0, None, None
+        for ts, _ in self.index.frames(camera_id, start, end):
+            total += 1
+            first = ts if first is None else min(first, ts)
+            last = ts if last is None else max(last, ts)
+        stride = max(1, math.ceil(total / max_frames)) if max_frames else 1
+        # keyed on the frames actually covered, so "the last 7 days" hits
+        # the cache until a new frame arrives
+        raw = json.dumps([camera_id, first, last, total, fps, fmt, max_side, max_frames])
+        key = hashlib.sha1(raw.encode()).hexdigest()[:24]
+        ext = "webp" if fmt == "webp" else "mjpeg"
+        return {"camera_id": camera_id, "start": start, "end": end, "fps": fps, "fmt": fmt,
+                "max_side": max_side, "max_frames": max_frames, "frames": total, "stride": stride,
+                "key": key, "path": self.cache_dir / f"{key}.{ext}"}
+
+    def _paths(self, plan: dict):
+        _, _, picked = sample(lambda: self.index.frames(plan["camera_id"], plan["start"], plan["end"]),
+                              plan["max_frames"])
+        return (path for _, path in picked)
+
+    def stream(self, plan: dict):
+        """
+        Yields the encoded output. Served from cache when present; otherwise
+        MJPEG streams while it renders (and is cached when complete) and WebP
+        renders to the cache first.
+        """
+        path = plan["path"]
+        if path.exists():
+            CACHE_HITS.inc(cache="timelapse")
+            os.utime(path)
+            yield from self._replay(plan)
+            return
+        CACHE_MISSES.inc(cache="timelapse")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        if plan["fmt"] == "webp":
+            with self._key_lock(plan["key"]):
+                if not path.exists():
+                    self._render_webp(plan)
+            yield from self._replay(plan)
+        else:
+            yield from self._render_mjpeg(plan)
+        self._evict()
+
+    def _replay(self, plan: dict):
+        if plan["fmt"] == "webp":
+            with open(plan["path"], "rb") as f:
+                while True:
+                    block = f.read(64 * 1024)
+                    if not block:
+                        return
+                    yield block
+        delay = 1 / plan["fps"]
+        for part in read_mjpeg_parts(plan["path"]):
+            yield part
+            time.sleep(delay)
+
+    def _render_webp(self, plan: dict):
+        tmp = plan["path"].with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with span("timelapse_render", camera=plan["camera_id"], fmt="webp", frames=plan["frames"]):
+                with open(tmp, "wb") as f:
+                    writer = AnimatedWebPWriter(f, plan["fps"])
+                    for img in decode(self._paths(plan), plan["max_side"]):
+                        writer.add(img)
+                    writer.close()
+            os.replace(tmp, plan["path"])
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def _render_mjpeg(self, plan: dict):
+        tmp = plan["path"].with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        delay = 1 / plan["fps"]
+        complete = False
+        try:
+            with span("timelapse_render", camera=plan["camera_id"], fmt="mjpeg", frames=plan["frames"]):
+                with open(tmp, "wb") as f:
+                    for part in mjpeg_parts(decode(self._paths(plan), plan["max_side"])):
+                        f.write(part)
+                        yield part
+                        time.sleep(delay)
+                complete = True
+            os.replace(tmp, plan["path"])
+        finally:
+            if not complete:
+                tmp.unlink(missing_ok=True)  # client went away mid-stream
+
+    def _evict(self):
+        """Drops least-recently-used renders once the cache exceeds CACHE_MAX_BYTES."""
+        files = [(p.stat().st_mtime, p.stat().st_size, p) for p in self.cache_dir.iterdir()
+                 if p.suffix in (".webp", ".mjpeg")]
+        total = sum(size for _, size, _ in files)
+        for _, size, p in sorted(files):
+            if total <= CACHE_MAX_BYTES:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "index":
+        print(json.dumps(FrameIndex(sys.argv[2]).rebuild()))
+    else:
+        print("usage: python src/timelapse.py index <archive_dir>")
+
+
+if __name__ == "__main__":
+    main()
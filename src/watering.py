@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+watering.py
+
+Watering schedules for the calendar, kept up to date as diagnoses land.
+
+Each species' schedule is stored as a short list of changes, in date order:
+
+    {"date": "2025-07-03", "interval": 7, "anchor": "2025-07-03", "at": "<captured_at>"}
+
+Starting on "date", the species is watered every "interval" days, counted
+from "anchor". A change is only recorded when a diagnosis' "Watering
+Schedule" differs from the interval already in effect. Frequent diagnoses
+therefore don't reset the rhythm. When the interval does change, the new
+one is counted from the last watering under the old one.
+
+record() is called by pipeline.record_diagnosis for every diagnosis, sync
+or batch. It touches only that species, so nothing is recomputed from
+history. The store lives in DATA_DIR/watering.json. rebuild() recreates it
+from history/*.jsonl if it is lost:
+
+    python src/watering.py rebuild
+
+events() expands the changes into dates for a range. It is what
+/api/calendar serves, as JSON or iCalendar (server_http.py).
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import contextlib
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: the store is updated without locking
+    fcntl = None
+
+DATA_DIR = Path(os.getenv("FF_DATA_DIR", Path(__file__).resolve().parent.parent / "static" / "data"))
+STORE_FILE = DATA_DIR / "watering.json"
+HISTORY_DIR = DATA_DIR / "history"
+SAVED_DIR = DATA_DIR / "savedJson"
+DEFAULT_INTERVAL = int(os.getenv("WATERING_DEFAULT_DAYS", "7"))
+MAX_RANGE_DAYS = 400
+
+
+# ——— Store ———
+
+@contextlib.contextmanager
+def _locked():
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    with open(DATA_DIR / "watering.lock", "a") as fh:
+        if fcntl:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def load() -> dict:
+    """The store: {"version", "updated_at", "species": {name: [changes]}}."""
+    try:
+        with open(STORE_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"version": 0, "updated_at": 0, "species": {}}
+
+
+def _save(store: dict):
+    store["version"] = store.get("version", 0) + 1
+    store["updated_at"] = int(time.time())
+    tmp = STORE_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(store, separators=(",", ":")))
+    os.replace(tmp, STORE_FILE)
+
+
+def _day(value) -> datetime.date:
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def interval_of(species: str, diagnosis: dict) -> int:
+    """Watering interval in days from the diagnosis, else the species care JSON, else the default."""
+    sources = [diagnosis]
+    try:
+        with open(SAVED_DIR / f"{species}Care.json") as f:
+            care = json.load(f)
+        sources += [care.get("recommendations") or {}, care]
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    for src in sources:
+        try:
+            days = int(float(src.get("Watering Schedule")))
+        except (TypeError, ValueError):
+            continue
+        if days > 0:
+            return days
+    return DEFAULT_INTERVAL
+
+
+def _last_watering(change: dict, on_or_before: datetime.date) -> datetime.date:
+    anchor = _day(change["anchor"])
+    steps = max(0, (on_or_before - anchor).days) // change["interval"]
+    return anchor + datetime.timedelta(days=steps * change["interval"])
+
+
+def _apply(changes: list, day: datetime.date, interval: int, at: str) -> bool:
+    """Adds one diagnosis to a species' change list. Returns True if it changed."""
+    prev = None
+    for c in changes:
+        if _day(c["date"]) <= day:
+            prev = c
+    if prev is not None and prev["interval"] == interval:
+        return False
+    if prev is not None and _day(prev["date"]) == day:
+        if prev.get("at", "") > at:
+            return False  # a later diagnosis already set this day's interval
+        prev.update(interval=interval, at=at)
+    else:
+        changes.append({"date": day.isoformat(), "interval": interval, "anchor": day.isoformat(), "at": at})
+        changes.sort(key=lambda c: c["date"])
+    _normalize(changes)
+    return True
+
+
+def _normalize(changes: list):
+    """
+    Drops changes that repeat the interval before them (possible after an
+    out-of-order backfill) and re-derives each anchor from the previous
+    schedule's last watering. Linear in the species' change count.
+    """
+    i = 1
+    while i < len(changes):
+        if changes[i]["interval"] == changes[i - 1]["interval"]:
+            changes.pop(i)
+        else:
+            i += 1
+    if changes:
+        changes[0]["anchor"] = changes[0]["date"]
+    for prev, cur in zip(changes, changes[1:]):
+        cur["anchor"] = _last_watering(prev, _day(cur["date"])).isoformat()
+
+
+def record(species: str, diagnosis: dict, captured_at: str):
+    """Folds one diagnosis into its species' schedule."""
+    interval = interval_of(species, diagnosis)
+    with _locked():
+        store = load()
+        changes = store["species"].setdefault(species, [])
+        if _apply(changes, _day(captured_at), interval, captured_at):
+            _save(store)
+        elif not STORE_FILE.exists():
+            _save(store)
+
+
+def rebuild() -> dict:
+    """Recreates the store from history/*.jsonl (one pass, oldest diagnosis first)."""
+    store = {"version": load().get("version", 0), "species": {}}
+    for path in sorted(HISTORY_DIR.glob("*.jsonl")):
+        species = path.stem
+        entries = []
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        changes = store["species"].setdefault(species, [])
+        for entry in sorted(entries, key=lambda e: e.get("captured_at", "")):
+            # local (budget-fallback) scores never set the schedule; see pipeline.record_diagnosis
+            if entry.get("captured_at") and entry.get("scoring") != "local":
+                _apply(changes, _day(entry["captured_at"]), interval_of(species, entry), entry["captured_at"])
+    with _locked():
+        _save(store)
+    return store
+
+
+# ——— Queries ———
+
+def events(store: dict, start: datetime.date, end: datetime.date) -> dict:
+    """
+    Watering dates per species within [start, end], inclusive:
+    {species: {"interval": current interval, "dates": ["YYYY-MM-DD", ...]}}
+    """
+    out = {}
+    for species, changes in store.get("species", {}).items():
+        dates = []
+        for i, change in enumerate(changes):
+            seg_start = max(_day(change["date"]), start)
+            seg_end = end
+            if i + 1 < len(changes):
+                seg_end = min(end, _day(changes[i + 1]["date"]) - datetime.timedelta(days=1))
+            if seg_start > seg_end:
+                continue
+            anchor, step = _day(change["anchor"]), change["interval"]
+            offset = (seg_start - anchor).days
+            day = anchor + datetime.timedelta(days=-(-offset // step) * step)
+            while day <= seg_end:
+                dates.append(day.isoformat())
+                day += datetime.timedelta(days=step)
+        if changes:
+            out[species] = {"interval": changes[-1]["interval"], "dates": dates}
+    return out
+
+
+def parse_range(start: str, end: str, today: datetime.date = None, feed: bool = False):
+    """
+    Parses from/to (YYYY-MM-DD). Defaults to the current month, or for a
+    subscription feed to the past month plus the coming year.
+    Raises ValueError on bad dates or ranges over MAX_RANGE_DAYS.
+    """
+    today = today or datetime.date.today()
+    if feed:
+        first = today - datetime.timedelta(days=31)
+        last = today + datetime.timedelta(days=365)
+    else:
+        first = today.replace(day=1)
+        last = (first + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+    start_d = _day(start) if start else first
+    end_d = _day(end) if end else last
+    if end_d < start_d:
+        raise ValueError("'to' is before 'from'")
+    if (end_d - start_d).days > MAX_RANGE_DAYS:
+        raise ValueError(f"Range is limited to {MAX_RANGE_DAYS} days")
+    return start_d, end_d
+
+
+def _ics_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _ics_fold(line: str) -> str:
+    """Folds a content line at 75 octets (RFC 5545 §3.1), never inside a UTF-8 character."""
+    out, chunk, size, limit = [], "", 0, 75
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > limit:
+            out.append(chunk)
+            chunk, size, limit = "", 0, 74  # continuation lines start with a space
+        chunk += ch
+        size += n
+    out.append(chunk)
+    return "\r\n ".join(out)
+
+
+def to_ics(species_events: dict, cameras: list, stamp: int) -> str:
+    """All-day VEVENTs, one per species per watering day."""
+    # the store is keyed by the lowercased species pipeline.py records; cameras.json may capitalise it
+    names = {}
+    for cam in cameras:
+        names.setdefault(str(cam.get("species") or "").lower(), []).append(cam.get("name") or cam.get("id"))
+    dtstamp = datetime.datetime.utcfromtimestamp(stamp or 0).strftime("%Y%m%dT%H%M%SZ")
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//FolliageFusion//Watering Calendar//EN",
+             "CALSCALE:GREGORIAN", "X-WR-CALNAME:Watering Calendar"]
+    for species in sorted(species_events):
+        where = ", ".join(str(n) for n in names.get(species, []))
+        summary = f"Water {species}" + (f" ({where})" if where else "")
+        for date in species_events[species]["dates"]:
+            day = date.replace("-", "")
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:{species}-{day}@folliagefusion",
+                f"DTSTAMP:{dtstamp}",
+                f"DTSTART;VALUE=DATE:{day}",
+                _ics_fold(f"SUMMARY:{_ics_escape(summary)}"),
+                "TRANSP:TRANSPARENT",
+                "END:VEVENT",
+            ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        store = rebuild()
+        print(json.dumps({s: len(c) for s, c in store["species"].items()}))
+    else:
+        print(json.dumps(load(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
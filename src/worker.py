@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+worker.py
+
+Pipeline worker: claims frames that server_http.py queued (job_queue.py)
+and runs process_image.py on each, on whichever node it is started.
+
+    python src/pipeline.py worker [--concurrency 2] [--once]
+
+Each job runs in its own process, exactly as server_http.py used to spawn
+it, while a heartbeat keeps the job's lease alive. Exit status 0 acks the
+job; 2 (bad arguments, missing image) dead-letters it at once; anything
+else, or a run longer than QUEUE_JOB_TIMEOUT, retries it with backoff.
+SIGTERM/SIGINT stop claiming and let running jobs finish.
+
+Cameras that don't send species/zip with their uploads (the stock Pi
+client sends only the image) get them from the camera registry:
+DATA_DIR/cameras.json or auth_api's camera table ("species", and "zip" if
+the entry has one), with PIPELINE_DEFAULT_ZIP as the fallback ZIP.
+
+Workers on other machines need the same pi_input_http and DATA_DIR paths
+(a shared mount) and the same PIPELINE_QUEUE_URL.
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import os
+import json
+import time
+import socket
+import sqlite3
+import signal
+import logging
+import argparse
+import threading
+import subprocess
+
+from src.job_queue import VISIBILITY_SECONDS, open_queue
+from src.budget import CAMERA_ENV, PRIORITY_ENV
+from src.instrumentation import (
+    CORRELATION_ENV, configure_logging, flush_metrics, histogram, log_event, new_correlation_id,
+    persist_metrics_on_exit,
+)
+
+DATA_DIR = Path(os.getenv("FF_DATA_DIR", Path(__file__).resolve().parent.parent / "static" / "data"))
+CAMERAS_JSON = DATA_DIR / "cameras.json"
+AUTH_DB = Path(os.getenv("AUTH_DB_PATH", Path(__file__).resolve().parent / "auth" / "auth.db"))
+DEFAULT_ZIP = os.getenv("PIPELINE_DEFAULT_ZIP", "")
+POLL_SECONDS = float(os.getenv("QUEUE_POLL_SECONDS", "1"))
+JOB_TIMEOUT = float(os.getenv("QUEUE_JOB_TIMEOUT", "900"))
+PURGE_EVERY = 3600
+PERMANENT_EXIT = 2
+PROCESS_IMAGE = Path(__file__).resolve().parent / "process_image.py"
+
+JOB_SECONDS = histogram("ff_queue_job_duration_seconds", "Time from claim to ack/fail per queued job.")
+
+
+def registered_camera(camera_id: str) -> dict:
+    """{"species", "zip"} the camera registry has for camera_id (values may be None)."""
+    found = {"species": None, "zip": None}
+    if not camera_id:
+        return found
+    try:
+        with open(CAMERAS_JSON) as f:
+            for entry in json.load(f):
+                if entry.get("id") == camera_id:
+                    found = {"species": entry.get("species"), "zip": entry.get("zip")}
+                    break
+    except (OSError, ValueError, AttributeError):
+        pass
+    if not found["species"] and AUTH_DB.exists():
+        try:
+            db = sqlite3.connect(f"file:{AUTH_DB}?mode=ro", uri=True, timeout=5)
+            try:
+                row = db.execute("SELECT species FROM camera WHERE id = ?", (camera_id,)).fetchone()
+            finally:
+                db.close()
+            found["species"] = row[0] if row else None
+        except sqlite3.Error:
+            pass
+    return found
+
+
+def resolve_inputs(payload: dict) -> dict:
+    """The payload with missing species/zip filled in from the camera registry and PIPELINE_DEFAULT_ZIP."""
+    if payload.get("species") and payload.get("zip"):
+        return payload
+    registered = registered_camera(payload.get("camera_id"))
+    return {**payload,
+            "species": payload.get("species") or registered["species"],
+            "zip": payload.get("zip") or registered["zip"] or DEFAULT_ZIP or None}
+
+
+def command_for(payload: dict) -> list:
+    cmd = [sys.executable, str(PROCESS_IMAGE), payload["image"]]
+    if payload.get("species"):
+        cmd += ["--species", payload["species"]]
+    if payload.get("zip"):
+        cmd += ["--zip", payload["zip"]]
+    return cmd
+
+
+class Worker:
+    def __init__(self, queue=None, name: str = None, concurrency: int = 1):
+        self.queue = queue or open_queue()
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.stopping = threading.Event()
+
+    def run_job(self, job) -> str:
+        payload = resolve_inputs(job.payload)
+        correlation_id = payload.get("correlation_id") or new_correlation_id()
+        if not (payload.get("species") and payload.get("zip")):
+            # process_image.py would prompt on a terminal nobody is watching
+            return self.queue.fail(job, f"no species/zip for camera {payload.get('camera_id')!r}: add it to "
+                                        "cameras.json or set PIPELINE_DEFAULT_ZIP", permanent=True)
+        if not Path(payload["image"]).is_file():
+            return self.queue.fail(job, f"image not found on {self.name}: {payload['image']}", permanent=True)
+
+        started = time.perf_counter()
+        log_event("job_started", job=job.id, attempt=job.attempts, worker=self.name, correlation_id=correlation_id)
+        # own session: a Ctrl+C aimed at the worker doesn't kill running jobs
+        proc = subprocess.Popen(command_for(payload), stdin=subprocess.DEVNULL, start_new_session=True,
+                                env={**os.environ, CORRELATION_ENV: correlation_id,
+                                     CAMERA_ENV: str(payload.get("camera_id") or ""),
+                                     PRIORITY_ENV: payload.get("priority") or "scheduled"})
+        lost = False
+        while proc.poll() is None:
+            try:
+                proc.wait(timeout=VISIBILITY_SECONDS / 3)
+            except subprocess.TimeoutExpired:
+                if time.perf_counter() - started > JOB_TIMEOUT:
+                    # the whole session: process_image.py and the pipeline.py it started
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    proc.wait()
+                    break
+                if not self.queue.extend(job):
+                    lost = True  # another worker has it now; let this run finish anyway
+        code = proc.returncode
+        JOB_SECONDS.observe(time.perf_counter() - started)
+
+        if code == 0:
+            state = "done" if self.queue.ack(job) else "lost"
+        elif code == PERMANENT_EXIT:
+            state = self.queue.fail(job, "process_image.py rejected the job (exit 2)", permanent=True)
+        else:
+            reason = "timed out" if code == -signal.SIGKILL else f"exit {code}"
+            state = self.queue.fail(job, f"process_image.py {reason}")
+        log_event("job_finished", level=logging.WARNING if state != "done" else logging.INFO,
+                  job=job.id, attempt=job.attempts, exit_code=code, state=state, lease_lost=lost,
+                  correlation_id=correlation_id)
+        return state
+
+    def _loop(self, slot: int, once: bool):
+        name = f"{self.name}/{slot}"
+        while not self.stopping.is_set():
+            try:
+                job = self.queue.claim(name)
+            except Exception as e:
+                log_event("queue_claim_failed", level=logging.ERROR, worker=name, error=str(e))
+                job = None
+            if job is None:
+                if once:
+                    return
+                self.stopping.wait(POLL_SECONDS)
+                continue
+            try:
+                self.run_job(job)
+            except Exception as e:
+                self.queue.fail(job, f"worker error: {e}")
+                log_event("job_crashed", level=logging.ERROR, job=job.id, error=str(e))
+            # the worker outlives any scrape; don't hold its metrics until exit
+            flush_metrics()
+
+    def run(self, once: bool = False):
+        """Runs until stopped; with once=True, until the queue is empty."""
+        threads = [threading.Thread(target=self._loop, args=(i, once), daemon=True)
+                   for i in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        last_purge = 0
+        while any(t.is_alive() for t in threads):
+            if time.time() - last_purge > PURGE_EVERY:
+                last_purge = time.time()
+                self.queue.purge()
+                self.queue.stats()
+                flush_metrics()
+            for t in threads:
+                t.join(timeout=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pipeline.py worker",
+                                     description="Process queued frames from server_http.py.")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("QUEUE_CONCURRENCY", "2")))
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    parser.add_argument("--name", help="Worker name in the queue (default host:pid)")
+    args = parser.parse_args(argv)
+
+    configure_logging("worker")
+    persist_metrics_on_exit()
+    worker = Worker(name=args.name, concurrency=args.concurrency)
+
+    def stop(signum, frame):
+        log_event("worker_stopping", worker=worker.name, signal=signum)
+        worker.stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    log_event("worker_started", worker=worker.name, concurrency=args.concurrency)
+    worker.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()